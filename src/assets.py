@@ -0,0 +1,203 @@
+# coding: utf-8
+"""
+Pipeline de arquivos estáticos sobre o collectstatic.
+
+AssetStorage (STATICFILES_STORAGE) grava em STATIC_ROOT, além dos
+originais, uma cópia de cada arquivo com o hash do conteúdo no nome
+(css/style.3f2a...css), reescreve as referências url() dos CSS para os
+nomes com hash, minifica os CSS e grava ao lado uma variante .gz dos
+arquivos compressíveis. O hash de um CSS é o do conteúdo final, já
+reescrito: se uma imagem referenciada muda, o nome do CSS também muda. O
+mapa nome -> nome com hash fica em STATIC_ROOT/staticfiles.json, lido uma
+vez por processo pela tag {% static %}; nada é calculado por requisição.
+
+AssetsApplication envolve a aplicação WSGI e serve os arquivos com hash
+com Cache-Control de um ano (o nome muda quando o conteúdo muda), usando a
+variante .gz quando o cliente aceita. Os originais também são servidos,
+mas com cache curto.
+"""
+import gzip
+import json
+import mimetypes
+import os
+import re
+from urllib import unquote
+from urlparse import urldefrag, urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import CachedStaticFilesStorage, StaticFilesStorage
+from django.contrib.staticfiles.utils import matches_patterns
+from django.core.files.base import ContentFile
+from django.utils.encoding import smart_str
+
+from src.negotiation import accepts_gzip
+
+
+MANIFEST = 'staticfiles.json'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.txt', '.html', '.json', '.xml', '.ico')
+MAX_AGE = 60 * 60 * 24 * 365
+# Nomes sem hash (o admin usa STATIC_URL direto) podem mudar a cada deploy.
+PLAIN_MAX_AGE = 60 * 60
+
+
+def minify_css(content):
+    """
+    Minificação conservadora: remove comentários (exceto /*! ... */) e
+    espaços desnecessários. Não entende strings, então não deve ser usada
+    em CSS com '{', ';' ou '/*' dentro de aspas.
+    """
+    content = re.sub(r'/\*(?!!).*?\*/', '', content, flags=re.S)
+    content = re.sub(r'\s+', ' ', content)
+    content = re.sub(r'\s*([{};,>])\s*', r'\1', content)
+    # Fora das declarações, o espaço antes de ':' pode ser um seletor de
+    # descendente (a :hover).
+    content = re.sub(r'\{[^{}]*\}', lambda m: re.sub(r'\s*:\s*', ':', m.group(0)), content)
+    content = content.replace(';}', '}')
+    return content.strip()
+
+
+class AssetStorage(CachedStaticFilesStorage):
+    manifest_name = MANIFEST
+
+    def __init__(self, *args, **kwargs):
+        super(AssetStorage, self).__init__(*args, **kwargs)
+        self.processing = False
+        self._manifest = None
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            try:
+                with self.open(self.manifest_name) as f:
+                    self._manifest = json.load(f)
+            except (IOError, ValueError):
+                self._manifest = {}
+        return self._manifest
+
+    def hashed_name(self, name, content=None):
+        # O CachedStaticFilesStorage do Django 1.4 calcula o hash do CSS
+        # antes de reescrever os url(): o nome não mudaria quando só uma
+        # imagem referenciada mudasse, e o CSS antigo ficaria um ano no
+        # cache apontando para ela. Aqui o hash é o do CSS final.
+        clean_name = urlsplit(unquote(name)).path.strip()
+        if self.processing and matches_patterns(clean_name, self._patterns.keys()):
+            if content is None:
+                content = self.open(clean_name)
+            content = ContentFile(self.final_css(clean_name, content.read()))
+        return super(AssetStorage, self).hashed_name(name, content)
+
+    def final_css(self, name, content):
+        """O CSS como o post_process grava: url() reescritos e minificado."""
+        converter = self.url_converter(name)
+        for patterns in self._patterns.values():
+            for pattern in patterns:
+                content = pattern.sub(converter, content)
+        return smart_str(minify_css(content.decode('utf-8')))
+
+    def url(self, name, force=False):
+        # Durante o collectstatic o CachedFilesMixin calcula os hashes das
+        # referências dos CSS; fora dele, só o manifesto é consultado, e um
+        # arquivo que não está nele sai com o nome original.
+        if self.processing:
+            return super(AssetStorage, self).url(name, force)
+        if settings.DEBUG and not force:
+            return StaticFilesStorage.url(self, name)
+        clean_name, fragment = urldefrag(name)
+        hashed_name = self.manifest.get(clean_name, clean_name)
+        return StaticFilesStorage.url(self, hashed_name) + ('#' + fragment if fragment else '')
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        manifest = {}
+        self.processing = True
+        try:
+            for name, hashed_name, processed in super(AssetStorage, self).post_process(paths, dry_run, **options):
+                name, hashed_name = name.replace('\\', '/'), hashed_name.replace('\\', '/')
+                if processed and hashed_name.endswith('.css'):
+                    self.minify(hashed_name)
+                if processed or not self.exists(hashed_name + '.gz'):
+                    self.compress(hashed_name)
+                manifest[name] = hashed_name
+                yield name, hashed_name, processed
+        finally:
+            self.processing = False
+        self.save_manifest(manifest)
+
+    def minify(self, name):
+        with self.open(name) as f:
+            content = f.read().decode('utf-8')
+        self.delete(name)
+        # O mesmo resultado do final_css, de onde veio o hash do nome.
+        self._save(name, ContentFile(smart_str(minify_css(content))))
+
+    def compress(self, name):
+        if not name.endswith(COMPRESSIBLE):
+            return
+        with self.open(name) as f:
+            content = f.read()
+        path = self.path(name + '.gz')
+        # mtime fixo: o mesmo conteúdo gera sempre o mesmo .gz.
+        with open(path, 'wb') as raw:
+            with gzip.GzipFile(os.path.basename(name), 'wb', 9, raw, 0) as f:
+                f.write(content)
+        if os.path.getsize(path) >= len(content):
+            os.remove(path)
+
+    def save_manifest(self, manifest):
+        # Um collectstatic parcial não apaga as entradas dos demais arquivos.
+        current = dict(self.manifest)
+        current.update(manifest)
+        if self.exists(self.manifest_name):
+            self.delete(self.manifest_name)
+        self._save(self.manifest_name, ContentFile(json.dumps(current, indent=2, sort_keys=True, separators=(',', ': '))))
+        self._manifest = current
+
+
+class AssetsApplication(object):
+    """
+    Serve os arquivos do manifesto de STATIC_ROOT antes de chegar ao
+    Django; o resto das requisições segue para a aplicação.
+    """
+    def __init__(self, application, storage=None):
+        self.application = application
+        self.storage = storage or AssetStorage()
+        self.prefix = settings.STATIC_URL
+        manifest = self.storage.manifest
+        self.max_age = dict((name, PLAIN_MAX_AGE) for name in manifest)
+        self.max_age.update((name, MAX_AGE) for name in manifest.values())
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        name = path[len(self.prefix):]
+        if (not path.startswith(self.prefix) or name not in self.max_age
+                or environ.get('REQUEST_METHOD') not in ('GET', 'HEAD')):
+            return self.application(environ, start_response)
+
+        content_type, encoding = mimetypes.guess_type(name)
+        headers = [
+            ('Content-Type', content_type or 'application/octet-stream'),
+            ('Cache-Control', 'public, max-age=%d' % self.max_age[name]),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        filename = self.storage.path(name)
+        if accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING', '')) and os.path.exists(filename + '.gz'):
+            filename += '.gz'
+            headers.append(('Content-Encoding', 'gzip'))
+        headers.append(('Content-Length', str(os.path.getsize(filename))))
+        start_response('200 OK', headers)
+
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        f = open(filename, 'rb')
+        if 'wsgi.file_wrapper' in environ:
+            return environ['wsgi.file_wrapper'](f, 8192)
+        return read_chunks(f)
+
+
+def read_chunks(f, size=8192):
+    try:
+        for chunk in iter(lambda: f.read(size), ''):
+            yield chunk
+    finally:
+        f.close()
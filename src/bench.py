@@ -0,0 +1,145 @@
+# coding: utf-8
+"""
+Utilitários compartilhados pelos comandos de benchmark (bench_*).
+"""
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+from src.instrumentation import QueryRecorder
+
+
+@contextmanager
+def test_database(verbosity=0, shared=False):
+    """
+    Cria um banco de teste descartável (com as migrações do South) para que
+    os benchmarks não toquem no banco configurado. Com shared=True o banco
+    de teste do SQLite fica num arquivo em vez da memória, para que
+    conexões de outras threads vejam os mesmos dados.
+    """
+    from south.management.commands import patch_for_test_db_setup
+    patch_for_test_db_setup()
+
+    old_name = connection.settings_dict['NAME']
+    old_test_name = connection.settings_dict.get('TEST_NAME')
+    if shared and connection.vendor == 'sqlite':
+        name = os.path.join(tempfile.gettempdir(), 'eventex-bench.db')
+        connection.settings_dict['TEST_NAME'] = name
+        # Um log WAL de uma execução interrompida corromperia o banco novo.
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(name + suffix):
+                os.remove(name + suffix)
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity)
+        connection.settings_dict['TEST_NAME'] = old_test_name
+
+
+def bulk_insert(table, columns, rows, chunk_size=5000):
+    """
+    Insere as tuplas de rows em table com executemany, em transações de
+    chunk_size linhas. Mais rápido que o ORM para gerar massas de dados.
+    """
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        connection.ops.quote_name(table),
+        ', '.join(connection.ops.quote_name(c) for c in columns),
+        ', '.join(['%s'] * len(columns)))
+    cursor = connection.cursor()
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            cursor.executemany(sql, chunk)
+            transaction.commit_unless_managed()
+            chunk = []
+    if chunk:
+        cursor.executemany(sql, chunk)
+        transaction.commit_unless_managed()
+
+
+def insert_subscriptions(stop, start=0, paid=lambda i: False):
+    """
+    Gera as inscrições de start a stop-1 com dados previsíveis: nome
+    'Inscrito <i>', CPF i com 11 dígitos, e-mail user<i>@mail.com e telefone
+    a partir de i. Datas espalhadas ao longo de 2012.
+    """
+    from django.db.models import Max
+    from src.subscriptions.models import SearchToken, Subscription, search_tokens
+
+    last_pk = Subscription.objects.aggregate(pk=Max('pk'))['pk'] or 0
+
+    def rows():
+        for i in xrange(start, stop):
+            phone = '%02d-9%08d' % (11 + i % 89, i)
+            yield (u'Inscrito %d' % i, u'inscrito %d' % i, '%011d' % i,
+                   'User%d@Mail.com' % i, 'user%d@mail.com' % i, phone, phone.replace('-', ''),
+                   '2012-%02d-%02d %02d:%02d:%02d' % (i % 12 + 1, i % 28 + 1, i % 24, i % 60, i // 60 % 60),
+                   paid(i))
+
+    bulk_insert(Subscription._meta.db_table,
+                ('name', 'name_normalized', 'cpf', 'email', 'email_normalized', 'phone', 'phone_digits',
+                 'created_at', 'paid'),
+                rows())
+
+    # Tokens de busca das inscrições novas, lidas em blocos.
+    while True:
+        chunk = list(Subscription.objects.filter(pk__gt=last_pk).order_by('pk')
+                     .values_list('pk', 'name', 'email')[:5000])
+        if not chunk:
+            break
+        bulk_insert(SearchToken._meta.db_table, ('subscription_id', 'token'),
+                    ((pk, token) for pk, name, email in chunk for token in search_tokens(name, email)))
+        last_pk = chunk[-1][0]
+
+
+def bulk_create(model, objs, batch=100):
+    # O bulk_create do Django 1.4 não divide o INSERT, e o SQLite limita os
+    # parâmetros por consulta.
+    for i in xrange(0, len(objs), batch):
+        model.objects.bulk_create(objs[i:i + batch])
+
+
+def populate_event(speakers=20, talks=60, medias=2, contacts=3, subscriptions=1000):
+    """
+    Gera um evento sintético: palestrantes com contatos, palestras com um a
+    três palestrantes e mídias (slides e vídeos alternados), e inscrições.
+    """
+    from src.core.models import Contact, Media, Speaker, Talk
+
+    bulk_create(Speaker, [Speaker(name=u'Palestrante %d' % i, slug='palestrante-%d' % i,
+                                  url='http://palestrante%d.com.br' % i,
+                                  description=u'Descrição do palestrante %d' % i)
+                          for i in xrange(speakers)])
+    speaker_ids = list(Speaker.objects.order_by('pk').values_list('pk', flat=True))
+
+    bulk_create(Contact, [Contact(speaker_id=pk, kind=Contact.KINDS[k % 3][0], value='contato-%d-%d' % (pk, k))
+                          for pk in speaker_ids for k in xrange(contacts)])
+
+    bulk_create(Talk, [Talk(title=u'Palestra %d' % i, description=u'Descrição da palestra %d' % i,
+                            start_time='%02d:%02d' % (8 + i * 12 // max(talks, 1), i * 7 % 60))
+                       for i in xrange(talks)])
+    talk_ids = list(Talk.objects.order_by('pk').values_list('pk', flat=True))
+
+    Through = Talk.speakers.through
+    bulk_create(Through, [Through(talk_id=pk, speaker_id=speaker_ids[(i + j) % len(speaker_ids)])
+                          for i, pk in enumerate(talk_ids) for j in xrange(i % 3 + 1)] if speaker_ids else [])
+
+    bulk_create(Media, [Media(talk_id=pk, type=('SL', 'YT')[m % 2], title=u'Mídia %d' % m,
+                              media_id='media-%d-%d' % (pk, m))
+                        for pk in talk_ids for m in xrange(medias)])
+
+    insert_subscriptions(subscriptions)
+
+
+def measure(func, number):
+    """Executa func number vezes e retorna o tempo médio por chamada, em segundos."""
+    start = time.time()
+    for i in xrange(number):
+        func(i)
+    return (time.time() - start) / number
+
@@ -0,0 +1,202 @@
+# coding: utf-8
+"""
+API JSON somente leitura da agenda, para o aplicativo e as telas do evento.
+
+    /api/palestras/     palestras, com os slugs dos palestrantes e as mídias
+    /api/palestrantes/  palestrantes, com os ids das palestras
+
+Parâmetros:
+
+    fields=id,title     devolve só esses campos de cada item
+    limit=50            itens por página (padrão settings.API_PAGE_SIZE)
+    cursor=...          continua depois do último item da página anterior
+
+A resposta é {"results": [...], "next": url da próxima página ou null}. O
+cursor guarda a chave de ordenação do último item, e não a posição, então
+a paginação não pula nem repete itens quando a agenda muda entre as
+páginas.
+
+Tudo é calculado uma vez por versão do cache de páginas (ver
+src.core.pagecache): os dados da agenda, lidos em quatro consultas, e cada
+resposta já codificada em JSON e em gzip, com o ETag forte. Um cliente que
+consulta a API periodicamente custa uma leitura no cache e um 304.
+"""
+import base64
+import json
+from bisect import bisect_right
+from hashlib import md5
+from urllib import urlencode
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.text import compress_string
+from django.views.decorators.http import require_safe
+
+from src.core.pagecache import get_page_cache, get_version
+from src.negotiation import accepts_gzip
+
+
+MAX_PAGE_SIZE = 1000
+
+TALK_FIELDS = ('id', 'title', 'description', 'start_time', 'speakers', 'media')
+SPEAKER_FIELDS = ('slug', 'name', 'url', 'description', 'avatar', 'talks')
+RESOURCE_FIELDS = {'talks': TALK_FIELDS, 'speakers': SPEAKER_FIELDS}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def load_data():
+    """
+    Monta as listas de palestras e de palestrantes, já ordenadas, e as
+    chaves de ordenação usadas pelos cursores.
+    """
+    from src.core.models import Media, Speaker, Talk
+
+    speakers_by_talk, talks_by_speaker = {}, {}
+    for talk_id, slug in Talk.speakers.through.objects.order_by('pk').values_list('talk_id', 'speaker__slug'):
+        speakers_by_talk.setdefault(talk_id, []).append(slug)
+        talks_by_speaker.setdefault(slug, []).append(talk_id)
+
+    media = {}
+    for talk_id, type, title, media_id in Media.objects.order_by('pk').values_list(
+            'talk_id', 'type', 'title', 'media_id'):
+        media.setdefault(talk_id, []).append({'type': type, 'title': title, 'media_id': media_id})
+
+    talks = [{'id': pk, 'title': title, 'description': description,
+              'start_time': start_time.strftime('%H:%M') if start_time else None,
+              'speakers': speakers_by_talk.get(pk, []), 'media': media.get(pk, [])}
+             for pk, title, description, start_time in Talk.objects.order_by('start_time', 'pk').values_list(
+                 'pk', 'title', 'description', 'start_time')]
+
+    field = Speaker._meta.get_field('avatar')
+    speakers = [{'slug': slug, 'name': name, 'url': url, 'description': description,
+                 'avatar': field.storage.url(avatar) if avatar else None,
+                 'talks': talks_by_speaker.get(slug, [])}
+                for slug, name, url, description, avatar in Speaker.objects.order_by('slug').values_list(
+                    'slug', 'name', 'url', 'description', 'avatar')]
+
+    return {
+        'talks': (talks, [(t['start_time'] or '', t['id']) for t in talks], TALK_FIELDS),
+        'speakers': (speakers, [(s['slug'],) for s in speakers], SPEAKER_FIELDS),
+    }
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')))
+
+
+def decode_cursor(cursor):
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii'))))
+    except (TypeError, ValueError):
+        raise BadRequest(u'Cursor inválido.')
+
+
+def parse_params(query, allowed):
+    fields = allowed
+    if query.get('fields'):
+        fields = tuple(f.strip() for f in query['fields'].split(',') if f.strip())
+        unknown = [f for f in fields if f not in allowed]
+        if unknown:
+            raise BadRequest(u'Campos desconhecidos: %s. Disponíveis: %s.' % (
+                ', '.join(unknown), ', '.join(allowed)))
+
+    try:
+        limit = int(query.get('limit') or getattr(settings, 'API_PAGE_SIZE', 100))
+    except ValueError:
+        raise BadRequest(u'limit deve ser um número.')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise BadRequest(u'limit deve estar entre 1 e %d.' % MAX_PAGE_SIZE)
+
+    cursor = decode_cursor(query['cursor']) if query.get('cursor') else None
+    return fields, limit, cursor
+
+
+def build_payload(path, items, keys, allowed, fields, limit, cursor):
+    start = bisect_right(keys, cursor) if cursor else 0
+    page = items[start:start + limit]
+    next_url = None
+    if start + limit < len(items):
+        params = {'limit': limit, 'cursor': encode_cursor(keys[start + limit - 1])}
+        if fields != allowed:
+            params['fields'] = ','.join(fields)
+        next_url = '%s?%s' % (path, urlencode(sorted(params.items())))
+    results = [dict((f, item[f]) for f in fields) for item in page]
+    return json.dumps({'results': results, 'next': next_url}, separators=(',', ':'))
+
+
+def get_data(cache, version, timeout):
+    if not timeout:
+        return load_data()
+    key = 'core:api:data:%s' % version
+    data = cache.get(key)
+    if data is None:
+        data = load_data()
+        cache.set(key, data, timeout)
+    return data
+
+
+def get_response(request, resource):
+    """
+    Retorna (status, etag, corpo, corpo em gzip) da requisição, do cache
+    quando PAGE_CACHE_SECONDS está ligado.
+    """
+    try:
+        fields, limit, cursor = parse_params(request.GET, RESOURCE_FIELDS[resource])
+    except BadRequest as e:
+        body = json.dumps({'error': unicode(e)})
+        return 400, None, body, None
+
+    timeout = getattr(settings, 'PAGE_CACHE_SECONDS', 0)
+    cache = get_page_cache()
+    version = get_version(cache) if timeout else None
+    # A chave vem dos parâmetros já interpretados, e não da URL: a ordem
+    # deles, parâmetros desconhecidos e valores equivalentes (limit=050)
+    # caem na mesma entrada em vez de encher o cache.
+    key = 'core:api:%s:%s' % (version, md5(repr((request.path, fields, limit, cursor))).hexdigest())
+    if timeout:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    items, keys, allowed = get_data(cache, version, timeout)[resource]
+    body = build_payload(request.path, items, keys, allowed, fields, limit, cursor)
+    compressed = compress_string(body)
+    result = (200, '"%s"' % md5(body).hexdigest(), body, compressed if len(compressed) < len(body) else None)
+    if timeout:
+        cache.set(key, result, timeout)
+    return result
+
+
+def parse_etags(header):
+    return [etag.strip() for etag in header.split(',') if etag.strip()]
+
+
+def api_view(resource):
+    @require_safe
+    def view(request):
+        status, etag, body, compressed = get_response(request, resource)
+        if status != 200:
+            return HttpResponse(body, content_type='application/json', status=status)
+
+        # As duas representações têm ETags distintos, como pede o ETag forte.
+        gzipped = compressed is not None and accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        response_etag = etag[:-1] + '-gz"' if gzipped else etag
+        client_etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in client_etags or etag[:-1] + '-gz"' in client_etags or '*' in client_etags:
+            response = HttpResponse(status=304)
+        elif gzipped:
+            response = HttpResponse(compressed, content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = response_etag
+        response['Vary'] = 'Accept-Encoding'
+        return response
+    return view
+
+
+talks = api_view('talks')
+speakers = api_view('speakers')
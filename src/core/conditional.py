@@ -0,0 +1,81 @@
+# coding: utf-8
+"""
+GET condicional (ETag/Last-Modified) para as páginas públicas do core.
+
+O estado de cada página é o maior updated_at dos objetos exibidos nela,
+lido numa única consulta de agregação; os sinais em models.py propagam
+para Talk e Speaker as alterações de mídias, contatos e da relação entre
+eles. Se o navegador ou o CDN já tem a versão atual, a resposta é um 304
+sem renderizar nada.
+
+Com o cache de páginas ligado, o estado fica no cache junto com a página,
+sob a mesma versão (ver src.core.pagecache), e uma visita repetida não
+toca no banco.
+"""
+from hashlib import md5
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+
+from src.core.models import Speaker, Talk
+from src.core.pagecache import get_page_cache, get_version, page_key
+
+
+def latest(*values):
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def talk_state(pk):
+    state = Talk.objects.filter(pk=pk).aggregate(
+        talk=Max('updated_at'), speakers=Max('speakers__updated_at'))
+    return latest(state['talk'], state['speakers']), None
+
+
+def speaker_state(slug):
+    state = Speaker.objects.filter(slug=slug).aggregate(speaker=Max('updated_at'))
+    return state['speaker'], None
+
+
+def agenda_state():
+    # A contagem muda quando uma palestra é excluída, o que o Max não mostra.
+    state = Talk.objects.aggregate(
+        talks=Max('updated_at'), speakers=Max('speakers__updated_at'), count=Count('id', distinct=True))
+    return latest(state['talks'], state['speakers']), state['count']
+
+
+def cached_state(request, state_func, *args, **kwargs):
+    timeout = getattr(settings, 'PAGE_CACHE_SECONDS', 0)
+    if not timeout:
+        return state_func(*args, **kwargs)
+    cache = get_page_cache()
+    key = page_key(request, get_version(cache), 'state')
+    state = cache.get(key)
+    if state is None:
+        state = state_func(*args, **kwargs)
+        cache.set(key, state, timeout)
+    return state
+
+
+def page_condition(state_func):
+    """
+    Decora uma view com o condition do Django. state_func(*args, **kwargs)
+    retorna (updated_at, extra): o updated_at é o Last-Modified, e o ETag é
+    o hash dos dois. O estado é calculado uma vez por requisição; com
+    updated_at None (objeto inexistente) a view responde normalmente.
+    """
+    def state(request, *args, **kwargs):
+        if not hasattr(request, '_page_state'):
+            request._page_state = cached_state(request, state_func, *args, **kwargs)
+        return request._page_state
+
+    def etag(request, *args, **kwargs):
+        updated_at, extra = state(request, *args, **kwargs)
+        if updated_at is not None:
+            return md5(repr((updated_at, extra))).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        return state(request, *args, **kwargs)[0]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
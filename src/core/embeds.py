@@ -0,0 +1,54 @@
+# coding: utf-8
+from collections import OrderedDict
+from threading import Lock
+
+from django.template import Context, Template
+
+
+class EmbedRenderer(object):
+    """
+    Renderiza um trecho de html de embed (slideshare, youtube...).
+
+    O template é compilado uma única vez, na criação do renderer, e os
+    fragmentos já renderizados ficam num cache LRU limitado, indexado pelos
+    valores de contexto (com o tipo de cada um: uma SafeString e uma str
+    iguais renderizam diferente) e pelo autoescape. Valores que não podem
+    ser chave de dicionário renderizam sem cache.
+    """
+    def __init__(self, source, maxsize=512):
+        self.template = Template(source)
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        self.hits = self.misses = 0
+
+    def render(self, autoescape=True, **values):
+        key = (tuple(sorted((name, type(value), value) for name, value in values.items())), autoescape)
+        try:
+            hash(key)
+        except TypeError:
+            return self.template.render(Context(values, autoescape=autoescape))
+
+        with self.lock:
+            try:
+                fragment = self.cache.pop(key)
+            except KeyError:
+                pass
+            else:
+                self.cache[key] = fragment
+                self.hits += 1
+                return fragment
+
+        fragment = self.template.render(Context(values, autoescape=autoescape))
+
+        with self.lock:
+            self.misses += 1
+            self.cache[key] = fragment
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = self.misses = 0
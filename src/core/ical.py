@@ -0,0 +1,179 @@
+# coding: utf-8
+"""
+Agenda em iCalendar (RFC 5545), para assinatura nos aplicativos de
+calendário.
+
+    /agenda.ics                     todas as palestras e cursos
+    /palestrantes/<slug>/agenda.ics as palestras do palestrante
+
+As palestras guardam só o horário: o dia é settings.EVENT_DATE e a duração
+settings.TALK_DURATION_MINUTES. Os UIDs usam o domínio de
+settings.ICAL_UID_DOMAIN (ou o do Site atual), e não o host da requisição,
+para que o mesmo evento não apareça duplicado para quem assinou por outro
+endereço. Os eventos são lidos com values_list e
+escritos por um gerador direto na resposta, sem montar o arquivo inteiro
+na memória. Com o cache de páginas ligado, o arquivo pronto fica no cache
+sob a versão das páginas (ver src.core.pagecache) e o GET condicional usa
+o mesmo estado das páginas da agenda e do palestrante (ver
+src.core.conditional).
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+
+from src.core.conditional import agenda_state, latest, page_condition
+from src.core.models import Course, Speaker, Talk
+from src.core.pagecache import get_page_cache, get_version, page_key
+from src.streaming import release_connection
+
+
+CONTENT_TYPE = 'text/calendar; charset=utf-8'
+
+
+def escape(value):
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold(line):
+    """Quebra a linha em 75 octetos, sem partir caracteres UTF-8."""
+    line = line.encode('utf-8')
+    if len(line) <= 75:
+        return line + '\r\n'
+    parts, limit = [], 75
+    while len(line) > limit:
+        cut = limit
+        # Não corta no meio de uma sequência UTF-8 (bytes 10xxxxxx).
+        while 0x80 <= ord(line[cut]) < 0xC0:
+            cut -= 1
+        parts.append(line[:cut])
+        line, limit = line[cut:], 74
+    parts.append(line)
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def utc_stamp(value):
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def event_start(start_time):
+    tz = timezone.get_default_timezone()
+    return timezone.make_aware(datetime.combine(settings.EVENT_DATE, start_time), tz)
+
+
+def uid_domain():
+    return getattr(settings, 'ICAL_UID_DOMAIN', None) or Site.objects.get_current().domain
+
+
+def iter_events(talks, base_url, domain):
+    """
+    Gera as linhas dos VEVENT das palestras. talks é um queryset de Talk;
+    palestrantes e vagas dos cursos vêm em uma consulta cada.
+    """
+    pks = talks.values_list('pk', flat=True)
+    speakers = {}
+    for talk_id, name in Talk.speakers.through.objects.using(talks.db).filter(talk__in=pks).order_by('pk').values_list(
+            'talk_id', 'speaker__name'):
+        speakers.setdefault(talk_id, []).append(name)
+    slots = dict(Course.objects.using(talks.db).filter(pk__in=pks).values_list('pk', 'slots'))
+
+    duration = timedelta(minutes=getattr(settings, 'TALK_DURATION_MINUTES', 60))
+    # reverse() e a conversão de fuso custam mais que o resto do evento:
+    # a URL é montada por substituição e os horários, repetidos entre as
+    # palestras, são convertidos uma vez só.
+    url = base_url + reverse('core:talk_detail', args=[0]).replace('/0/', '/%d/')
+    times = {}
+    for pk, title, description, start_time, updated_at in talks.order_by('start_time', 'pk').values_list(
+            'pk', 'title', 'description', 'start_time', 'updated_at').iterator():
+        if start_time not in times:
+            start = event_start(start_time)
+            times[start_time] = 'DTSTART:%s\r\nDTEND:%s\r\n' % (utc_stamp(start), utc_stamp(start + duration))
+        names = speakers.get(pk, [])
+        details = [description] if description else []
+        if names:
+            details.append(u'Palestrantes: %s' % u', '.join(names))
+        if pk in slots:
+            details.append(u'Curso com %d vagas' % slots[pk])
+
+        yield 'BEGIN:VEVENT\r\n'
+        yield fold(u'UID:talk-%d@%s' % (pk, domain))
+        yield 'DTSTAMP:%s\r\n' % utc_stamp(updated_at)
+        yield times[start_time]
+        yield fold(u'SUMMARY:%s' % escape(title))
+        if details:
+            yield fold(u'DESCRIPTION:%s' % escape(u'\n\n'.join(details)))
+        if pk in slots:
+            yield 'CATEGORIES:Curso\r\n'
+        yield fold(u'URL:' + url % pk)
+        yield 'END:VEVENT\r\n'
+
+
+def iter_calendar(name, talks, base_url, domain):
+    yield 'BEGIN:VCALENDAR\r\n'
+    yield 'VERSION:2.0\r\n'
+    yield 'PRODID:-//EventeX//Agenda//PT\r\n'
+    yield 'CALSCALE:GREGORIAN\r\n'
+    yield 'METHOD:PUBLISH\r\n'
+    yield fold(u'X-WR-CALNAME:%s' % escape(name))
+    for line in iter_events(talks, base_url, domain):
+        yield line
+    yield 'END:VCALENDAR\r\n'
+
+
+def caching(lines, cache, key, timeout):
+    """Repassa as linhas e, se o gerador chegar ao fim, guarda o arquivo no cache."""
+    chunks = []
+    for line in lines:
+        chunks.append(line)
+        yield line
+    cache.set(key, ''.join(chunks), timeout)
+
+
+def calendar_response(request, name, talks):
+    # O gerador consulta o banco depois que a view retorna: fixa agora o
+    # banco escolhido pelo roteador para esta requisição (ver src.routers)
+    # e fecha no fim a conexão reaberta para ele (ver src.streaming).
+    talks = talks.using(talks.db)
+    base_url = '%s://%s' % ('https' if request.is_secure() else 'http', request.get_host())
+    # O Site pode estar em outro banco: é lido agora, dentro da requisição.
+    lines = release_connection(iter_calendar(name, talks, base_url, uid_domain()), talks.db)
+    timeout = getattr(settings, 'PAGE_CACHE_SECONDS', 0)
+    if not timeout:
+        return HttpResponse(lines, content_type=CONTENT_TYPE)
+
+    cache = get_page_cache()
+    # O host entra na chave porque aparece nas URLs.
+    key = '%s:%s' % (page_key(request, get_version(cache), 'ical'), base_url)
+    content = cache.get(key)
+    if content is None:
+        content = caching(lines, cache, key, timeout)
+    return HttpResponse(content, content_type=CONTENT_TYPE)
+
+
+def speaker_calendar_state(slug):
+    # O palestrante é atualizado quando ganha ou perde palestras; a
+    # contagem cobre as palestras excluídas, e os outros palestrantes
+    # entram porque os nomes deles aparecem na descrição.
+    state = Speaker.objects.filter(slug=slug).aggregate(
+        speaker=Max('updated_at'), talks=Max('talk__updated_at'), speakers=Max('talk__speakers__updated_at'),
+        count=Count('talk', distinct=True))
+    return latest(state['speaker'], state['talks'], state['speakers']), state['count']
+
+
+@page_condition(agenda_state)
+def agenda(request):
+    return calendar_response(request, u'EventeX', Talk.objects.all())
+
+
+@page_condition(speaker_calendar_state)
+def speaker_agenda(request, slug):
+    try:
+        speaker = Speaker.objects.only('name').get(slug=slug)
+    except Speaker.DoesNotExist:
+        raise Http404
+    return calendar_response(request, u'EventeX - %s' % speaker.name, speaker.talk_set.all())
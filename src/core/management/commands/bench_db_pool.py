@@ -0,0 +1,44 @@
+# coding: utf-8
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, load_backend
+
+
+class Command(BaseCommand):
+    help = (u'Compara o custo de conexão por requisição (abrir, consultar, fechar) com e '
+            u'sem o pool de src.dbpool, no banco configurado.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', default=DEFAULT_DB_ALIAS),
+        make_option('--requests', type='int', default=500),
+    )
+
+    def run(self, engine, settings_dict, alias, requests):
+        settings_dict = dict(settings_dict, ENGINE=engine)
+        wrapper = load_backend(engine).DatabaseWrapper(settings_dict, alias)
+        start = time.time()
+        for i in xrange(requests):
+            # O mesmo que uma view simples faz: uma consulta e o close do request_finished.
+            cursor = wrapper.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+            wrapper.close()
+        return (time.time() - start) / requests, wrapper
+
+    def handle(self, *args, **options):
+        settings_dict = connections[options['database']].settings_dict
+        backend = settings_dict['ENGINE'].rsplit('.', 1)[-1]
+        requests = options['requests']
+
+        plain, wrapper = self.run('django.db.backends.' + backend, settings_dict, 'bench-plain', requests)
+        pooled, wrapper = self.run('src.dbpool.' + backend, settings_dict, 'bench-pool', requests)
+        pool = wrapper.pool
+        stats = pool.stats()
+        pool.clear()
+
+        self.stdout.write('%s, %d requisições\n' % (backend, requests))
+        self.stdout.write('sem pool  %8.1f us por requisição\n' % (plain * 1e6))
+        self.stdout.write('com pool  %8.1f us por requisição\n' % (pooled * 1e6))
+        self.stdout.write('pool: %s\n' % ', '.join('%s=%s' % item for item in sorted(stats.items())))
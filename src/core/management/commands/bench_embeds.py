@@ -0,0 +1,57 @@
+# coding: utf-8
+import timeit
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+
+from src.core.templatetags import slideshare, youtube
+
+
+PAGE = """{% load slideshare youtube %}
+{% for media in medias %}<p>{% slideshare media.media_id media.title %}</p>
+<p>{% youtube media.media_id %}</p>{% endfor %}"""
+
+
+def render_uncached(module, **values):
+    # Comportamento anterior: compila o template do embed a cada renderização.
+    return Template(module.TEMPLATE).render(Context(values))
+
+
+class Command(BaseCommand):
+    help = (u'Mede o custo de renderização das tags slideshare e youtube numa '
+            u'página de palestra com várias mídias, antes e depois do cache.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--medias', type='int', default=40,
+                    help=u'Quantidade de mídias na página.'),
+        make_option('--repeat', type='int', default=50,
+                    help=u'Quantidade de renderizações da página.'),
+    )
+
+    def handle(self, *args, **options):
+        n, repeat = options['medias'], options['repeat']
+        medias = [{'media_id': 'media-%d' % i, 'title': 'doc-%d' % i} for i in range(n)]
+        tags = 2 * n * repeat
+
+        def before():
+            for m in medias:
+                render_uncached(slideshare, id=m['media_id'], doc=m['title'])
+                render_uncached(youtube, id=m['media_id'])
+
+        page = Template(PAGE)
+        context = Context({'medias': medias})
+
+        def after():
+            page.render(context)
+
+        slideshare.renderer.clear()
+        youtube.renderer.clear()
+        results = [
+            ('antes', timeit.timeit(before, number=repeat)),
+            ('depois', timeit.timeit(after, number=repeat)),
+        ]
+        self.stdout.write('%d mídias x %d renderizações\n' % (n, repeat))
+        for label, elapsed in results:
+            self.stdout.write('%-7s %8.1f us/tag  %8.2f ms/página\n' % (
+                label, elapsed / tags * 1e6, elapsed / repeat * 1e3))
@@ -0,0 +1,143 @@
+# coding: utf-8
+import json
+import logging
+import os
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from src.bench import QueryRecorder, populate_event, test_database
+
+
+BASELINE = os.path.join(settings.PROJECT_DIR, 'bench_baseline.json')
+
+
+class Command(BaseCommand):
+    help = (u'Gera um evento sintético, percorre todas as URLs do projeto (e o export e o '
+            u'changelist do admin) e mede tempo, consultas SQL e linhas lidas, comparando '
+            u'com a linha de base em src/bench_baseline.json.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--speakers', type='int', default=20),
+        make_option('--talks', type='int', default=60),
+        make_option('--medias', type='int', default=2, help=u'Mídias por palestra.'),
+        make_option('--contacts', type='int', default=3, help=u'Contatos por palestrante.'),
+        make_option('--subscriptions', type='int', default=1000),
+        make_option('--repeat', type='int', default=5, help=u'Requisições medidas por URL.'),
+        make_option('--baseline', default=BASELINE, help=u'Arquivo da linha de base.'),
+        make_option('--update-baseline', action='store_true', default=False,
+                    help=u'Grava os resultados como nova linha de base.'),
+        make_option('--time-tolerance', type='float', default=3.0,
+                    help=u'Quantas vezes o tempo da linha de base é aceito (0 desliga).'),
+    )
+
+    def scenarios(self):
+        from src.core.models import Speaker, Talk
+        from src.subscriptions.models import Subscription
+
+        speaker = Speaker.objects.order_by('pk')[0]
+        talk = Talk.objects.order_by('pk')[0]
+        subscription = Subscription.objects.order_by('pk')[0]
+        posts = iter(xrange(10 ** 9))
+
+        def subscribe_data():
+            i = posts.next()
+            return {'name': 'Novo %d' % i, 'cpf': '9%010d' % i, 'email': 'novo%d@mail.com' % i,
+                    'phone_0': '21', 'phone_1': '99998888'}
+
+        return [
+            ('homepage', 'get', reverse('homepage'), None),
+            ('talks', 'get', reverse('core:talks'), None),
+            ('talk_detail', 'get', reverse('core:talk_detail', args=[talk.pk]), None),
+            ('speaker_detail', 'get', reverse('core:speaker_detail', args=[speaker.slug]), None),
+            ('api_talks', 'get', reverse('core:api_talks'), None),
+            ('api_speakers', 'get', reverse('core:api_speakers'), None),
+            ('ical', 'get', reverse('core:ical'), None),
+            ('subscribe', 'get', reverse('subscriptions:subscribe'), None),
+            ('subscribe_post', 'post', reverse('subscriptions:subscribe'), subscribe_data),
+            ('success', 'get', reverse('subscriptions:success', args=[subscription.pk]), None),
+            ('admin_changelist', 'get', reverse('admin:subscriptions_subscription_changelist'), None),
+            ('admin_export', 'get', reverse('admin:export_subscriptions'), None),
+        ]
+
+    def measure(self, client, method, url, data, repeat):
+        times, counts = [], set()
+        for i in xrange(repeat):
+            with QueryRecorder() as recorder:
+                start = time.time()
+                response = getattr(client, method)(url, data() if data else {})
+                # O conteúdo pode ser um iterador (export em streaming).
+                response.content
+                elapsed = time.time() - start
+            if response.status_code not in (200, 302):
+                raise CommandError(u'%s respondeu %d' % (url, response.status_code))
+            times.append(elapsed)
+            counts.add((recorder.queries, recorder.rows))
+        times.sort()
+        queries, rows = max(counts)
+        return {'time_ms': round(times[len(times) // 2] * 1e3, 2), 'queries': queries, 'rows': rows}
+
+    def handle(self, *args, **options):
+        # Sem a linha de log por requisição do TimingMiddleware no meio do relatório.
+        logging.getLogger('src.instrumentation').setLevel(logging.WARNING)
+        with test_database():
+            with override_settings(PAGE_CACHE_SECONDS=0):
+                populate_event(options['speakers'], options['talks'], options['medias'],
+                               options['contacts'], options['subscriptions'])
+                cache.clear()
+
+                anonymous = Client()
+                admin = Client()
+                User.objects.create_superuser('bench', 'bench@eventex.com.br', 'bench')
+                admin.login(username='bench', password='bench')
+
+                results = {}
+                for name, method, url, data in self.scenarios():
+                    client = admin if name.startswith('admin_') else anonymous
+                    results[name] = self.measure(client, method, url, data, options['repeat'])
+
+        self.report(results, options)
+
+    def report(self, results, options):
+        path = options['baseline']
+        sizes = dict((k, options[k]) for k in ('speakers', 'talks', 'medias', 'contacts', 'subscriptions'))
+        baseline = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                baseline = json.load(f)
+        if baseline.get('sizes', sizes) != sizes:
+            self.stdout.write(u'Tamanhos diferentes da linha de base: comparação desligada.\n'.encode('utf-8'))
+            baseline = {}
+
+        regressions = []
+        tolerance = options['time_tolerance']
+        self.stdout.write('%-18s %10s %8s %8s\n' % ('view', 'tempo ms', 'queries', 'linhas'))
+        for name in sorted(results):
+            result, base = results[name], baseline.get('results', {}).get(name)
+            notes = []
+            if base:
+                if result['queries'] > base['queries']:
+                    notes.append('queries %d > %d' % (result['queries'], base['queries']))
+                if result['rows'] > base['rows']:
+                    notes.append('linhas %d > %d' % (result['rows'], base['rows']))
+                if tolerance and result['time_ms'] > base['time_ms'] * tolerance:
+                    notes.append('tempo %.1f > %.1f x %.1f' % (result['time_ms'], base['time_ms'], tolerance))
+            regressions.extend('%s: %s' % (name, n) for n in notes)
+            self.stdout.write('%-18s %10.2f %8d %8d %s\n' % (
+                name, result['time_ms'], result['queries'], result['rows'],
+                ('REGRESSAO: ' + ', '.join(notes)) if notes else ''))
+
+        if options['update_baseline']:
+            with open(path, 'w') as f:
+                json.dump({'sizes': sizes, 'results': results}, f, indent=2, sort_keys=True, separators=(',', ': '))
+                f.write('\n')
+            self.stdout.write(u'Linha de base gravada em %s\n' % path)
+        elif regressions:
+            raise CommandError((u'Regressões em relação à linha de base:\n' + '\n'.join(regressions)).encode('utf-8'))
@@ -0,0 +1,36 @@
+# coding: utf-8
+import os
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from src.instrumentation import load_samples, summarize
+
+
+class Command(BaseCommand):
+    help = (u'Junta as amostras gravadas pelo TimingMiddleware de todos os processos e '
+            u'imprime p50/p95/p99 do tempo total por nome de URL, em ms.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dir', default=None,
+                    help=u'Diretório das amostras (padrão: INSTRUMENTATION_DUMP_DIR).'),
+        make_option('--clear', action='store_true', default=False,
+                    help=u'Apaga as amostras depois de imprimir.'),
+    )
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or getattr(settings, 'INSTRUMENTATION_DUMP_DIR', None)
+        if not directory:
+            raise CommandError('Defina INSTRUMENTATION_DUMP_DIR ou use --dir.')
+
+        summary = summarize(load_samples(directory))
+        self.stdout.write('%-45s %7s %9s %9s %9s %9s\n' % ('url', 'n', 'p50', 'p95', 'p99', 'max'))
+        for name, s in sorted(summary.items(), key=lambda item: -item[1]['p95']):
+            self.stdout.write('%-45s %7d %9.2f %9.2f %9.2f %9.2f\n' % (
+                name, s['count'], s['p50'], s['p95'], s['p99'], s['max']))
+
+        if options['clear']:
+            for filename in os.listdir(directory):
+                if filename.startswith('timings-') and filename.endswith('.json'):
+                    os.remove(os.path.join(directory, filename))
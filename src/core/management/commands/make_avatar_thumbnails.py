@@ -0,0 +1,48 @@
+# coding: utf-8
+import multiprocessing
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from src.core.models import Speaker
+from src.core.thumbnails import available_sizes, get_sizes, record_sizes, render_logged
+
+
+def render_task(args):
+    pk, name, path, sizes, force = args
+    written = render_logged(path, sizes, force)
+    return pk, name, available_sizes(path, sizes), len(written)
+
+
+class Command(BaseCommand):
+    help = (u'Gera as miniaturas dos avatares já cadastrados, distribuindo as '
+            u'imagens entre processos.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=multiprocessing.cpu_count(),
+                    help=u'Quantidade de processos (padrão: um por núcleo).'),
+        make_option('--force', action='store_true', default=False,
+                    help=u'Gera de novo as variantes que já existem.'),
+    )
+
+    def handle(self, *args, **options):
+        sizes = get_sizes()
+        tasks = [(speaker.pk, speaker.avatar.name, speaker.avatar.path, sizes, options['force'])
+                 for speaker in Speaker.objects.exclude(avatar='').exclude(avatar=None).only('avatar')]
+        # Os processos filhos não usam o banco; fecha a conexão antes do fork.
+        connection.close()
+
+        pool = multiprocessing.Pool(options['workers'])
+        try:
+            results = list(pool.imap_unordered(render_task, tasks))
+        finally:
+            pool.close()
+            pool.join()
+
+        # Os tamanhos são gravados aqui, no processo principal.
+        written = 0
+        for pk, name, available, count in results:
+            record_sizes(pk, name, available)
+            written += count
+        self.stdout.write('%d avatar(es), %d miniatura(s) gerada(s)\n' % (len(tasks), written))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding index on 'Talk', fields ['start_time']
+        db.create_index('core_talk', ['start_time'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'Talk', fields ['start_time']
+        db.delete_index('core_talk', ['start_time'])
+
+
+    models = {
+        'core.contact': {
+            'Meta': {'object_name': 'Contact'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '1'}),
+            'speaker': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['core.Speaker']"}),
+            'value': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'core.course': {
+            'Meta': {'object_name': 'Course', '_ormbases': ['core.Talk']},
+            'notes': ('django.db.models.fields.TextField', [], {}),
+            'slots': ('django.db.models.fields.IntegerField', [], {}),
+            'talk_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['core.Talk']", 'unique': 'True', 'primary_key': 'True'})
+        },
+        'core.media': {
+            'Meta': {'object_name': 'Media'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'media_id': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'talk': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['core.Talk']"}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '2'})
+        },
+        'core.speaker': {
+            'Meta': {'object_name': 'Speaker'},
+            'avatar': ('django.db.models.fields.files.FileField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '50'}),
+            'url': ('django.db.models.fields.URLField', [], {'max_length': '200'})
+        },
+        'core.talk': {
+            'Meta': {'object_name': 'Talk'},
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'speakers': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['core.Speaker']", 'symmetrical': 'False'}),
+            'start_time': ('django.db.models.fields.TimeField', [], {'db_index': 'True', 'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '50'})
+        }
+    }
+
+    complete_apps = ['core']
\ No newline at end of file
@@ -1,5 +1,7 @@
 # coding: utf-8
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from datetime import time
 
@@ -11,6 +13,32 @@ class Speaker(models.Model):
     url = models.URLField(_('Url'))
     description = models.TextField(_(u'Descrição'), blank=True)
     avatar = models.FileField(_('Avatar'), upload_to='palestrantes', blank=True, null=True)
+    # Tamanhos das variantes do avatar já gravadas (ver src.core.thumbnails).
+    avatar_sizes = models.CommaSeparatedIntegerField(_('Tamanhos do avatar'), max_length=100, blank=True,
+                                                    editable=False)
+    updated_at = models.DateTimeField(_('Atualizado em'), auto_now=True, db_index=True)
+
+    @property
+    def contacts(self):
+        """
+        Contatos do palestrante agrupados por tipo. São carregados numa única
+        consulta no primeiro acesso e guardados na instância.
+        """
+        if not hasattr(self, '_contacts'):
+            Contact.objects.load_for([self])
+        return self._contacts
+
+    @property
+    def phones(self):
+        return self.contacts.get('P', [])
+
+    @property
+    def emails(self):
+        return self.contacts.get('E', [])
+
+    @property
+    def faxes(self):
+        return self.contacts.get('F', [])
 
     def __unicode__(self):
         return self.name
@@ -22,6 +50,24 @@ class Speaker(models.Model):
 #################################
 
 ## Managers
+class ContactManager(models.Manager):
+    def load_for(self, speakers):
+        """
+        Carrega os contatos de vários palestrantes numa única consulta e
+        guarda em cada um o dicionário {tipo: [contatos]} usado por
+        Speaker.contacts.
+        """
+        speakers = dict((speaker.pk, speaker) for speaker in speakers)
+        for speaker in speakers.itervalues():
+            speaker._contacts = {}
+
+        for contact in self.filter(speaker__in=speakers.keys()).order_by('speaker', 'kind', 'pk'):
+            speaker = speakers[contact.speaker_id]
+            setattr(contact, Contact.speaker.cache_name, speaker)
+            speaker._contacts.setdefault(contact.kind, []).append(contact)
+        return speakers.values()
+
+
 class KindContactManager(models.Manager):
     def __init__(self, kind):
         super(KindContactManager, self).__init__()
@@ -47,13 +93,14 @@ class Contact(models.Model):
     speaker = models.ForeignKey('Speaker', verbose_name=_('Palestrante'))
     kind = models.CharField(_('Tipo'), max_length=1, choices=KINDS)
     value = models.CharField(_('Valor'), max_length=255)
+    updated_at = models.DateTimeField(_('Atualizado em'), auto_now=True)
 
     ##############
     ## Meus Managers
     ####
-    objects = models.Manager()
+    objects = ContactManager()
     phones = KindContactManager('P')
-    emails = KindContactManager('M')
+    emails = KindContactManager('E')
     faxes  = KindContactManager('F')
 
 
@@ -75,6 +122,16 @@ class PeriodManager(models.Manager):
         qs = qs.order_by('start_time')
         return qs
 
+    def agenda(self, schedule=None):
+        """
+        Carrega todas as palestras numa única consulta, ordenada por
+        start_time, e os palestrantes numa consulta extra, e as distribui
+        entre os períodos da agenda (ver src.core.schedule).
+        """
+        from src.core.schedule import Schedule
+        schedule = schedule or Schedule()
+        return schedule.bucket(self.order_by('start_time', 'pk').prefetch_related('speakers'))
+
 ##  Model
 class Talk(models.Model):
 
@@ -83,16 +140,27 @@ class Talk(models.Model):
     ######
     title = models.CharField(_(u'Título'), max_length=50, unique=True)
     description = models.TextField(_(u'Descrição'), blank=True)
-    start_time = models.TimeField(blank=True)
+    start_time = models.TimeField(blank=True, db_index=True)
     speakers = models.ManyToManyField('Speaker', verbose_name=_('palestrante'))
+    updated_at = models.DateTimeField(_('Atualizado em'), auto_now=True, db_index=True)
+
+    @property
+    def medias(self):
+        """
+        Mídias da palestra agrupadas por tipo. São carregadas numa única
+        consulta no primeiro acesso e guardadas na instância.
+        """
+        if not hasattr(self, '_medias'):
+            Media.objects.load_for([self])
+        return self._medias
 
     @property
     def slides(self):
-        return self.media_set.filter(type="SL")
+        return self.medias.get('SL', [])
 
     @property
     def videos(self):
-        return self.media_set.filter(type="YT")
+        return self.medias.get('YT', [])
 
     objects = PeriodManager()
 
@@ -109,14 +177,39 @@ class Talk(models.Model):
 class Course(Talk):
     slots = models.IntegerField()
     notes = models.TextField()
+    # Contador de vagas ocupadas, mantido por UPDATE condicional nas
+    # matrículas (ver subscriptions.models.EnrollmentManager).
+    seats_taken = models.PositiveIntegerField(_('Vagas ocupadas'), default=0, editable=False)
 
     objects = PeriodManager()
 
+    @property
+    def seats_left(self):
+        return max(self.slots - self.seats_taken, 0)
+
 
 ################################
 ##             Media
 ################################
 
+## Managers
+class MediaManager(models.Manager):
+    def load_for(self, talks):
+        """
+        Carrega as mídias de várias palestras numa única consulta e guarda
+        em cada uma o dicionário {tipo: [mídias]} usado por Talk.medias.
+        """
+        talks = dict((talk.pk, talk) for talk in talks)
+        for talk in talks.itervalues():
+            talk._medias = {}
+
+        for media in self.filter(talk__in=talks.keys()).order_by('pk'):
+            talk = talks[media.talk_id]
+            setattr(media, Media.talk.cache_name, talk)
+            talk._medias.setdefault(media.type, []).append(media)
+        return talks.values()
+
+
 # Model
 class Media(models.Model):
     MEDIAS = (
@@ -128,7 +221,96 @@ class Media(models.Model):
     type = models.CharField(max_length=2, choices=MEDIAS)
     title = models.CharField(_(u'Título'), max_length=255)
     media_id = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(_('Atualizado em'), auto_now=True)
+
+    objects = MediaManager()
 
     def __unicode__(self):
         return u'%s - %s' % (self.talk.title, self.title)
 
+
+################################
+##             Cache
+################################
+
+# Qualquer alteração nos dados exibidos nas páginas públicas invalida o
+# cache de páginas (ver src.core.pagecache).
+from src.core.pagecache import check_page_cache, invalidate_pages
+
+check_page_cache()
+
+for model in (Speaker, Contact, Talk, Course, Media):
+    post_save.connect(invalidate_pages, sender=model, dispatch_uid='pagecache-save-%s' % model.__name__)
+    post_delete.connect(invalidate_pages, sender=model, dispatch_uid='pagecache-delete-%s' % model.__name__)
+m2m_changed.connect(invalidate_pages, sender=Talk.speakers.through, dispatch_uid='pagecache-speakers')
+
+
+################################
+##             updated_at
+################################
+
+# Mídias e contatos aparecem nas páginas da palestra e do palestrante, e a
+# relação entre palestras e palestrantes aparece nas duas: alterá-los
+# atualiza o updated_at de quem os exibe (ver src.core.conditional). O
+# update() não dispara post_save, então não há recursão nos sinais.
+
+def touch(model, pks):
+    pks = [pk for pk in pks if pk is not None]
+    if pks:
+        model.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
+
+def touch_talk(sender, instance, **kwargs):
+    touch(Talk, [instance.talk_id])
+
+
+def touch_speaker(sender, instance, **kwargs):
+    touch(Speaker, [instance.speaker_id])
+
+
+def touch_speaker_talks(sender, instance, **kwargs):
+    # Antes da exclusão, enquanto a relação ainda existe.
+    touch(Talk, instance.talk_set.values_list('pk', flat=True))
+
+
+def touch_talk_speakers(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # O clear() não informa pk_set: as palestras (ou palestrantes) do
+        # outro lado são buscadas antes de a relação ser apagada.
+        related = (instance.talk_set if reverse else instance.speakers).values_list('pk', flat=True)
+        touch(model, related)
+    elif action in ('post_add', 'post_remove'):
+        touch(model, pk_set or [])
+    else:
+        return
+    touch(Speaker if reverse else Talk, [instance.pk])
+
+
+post_save.connect(touch_talk, sender=Media, dispatch_uid='updated-at-media-save')
+post_delete.connect(touch_talk, sender=Media, dispatch_uid='updated-at-media-delete')
+post_save.connect(touch_speaker, sender=Contact, dispatch_uid='updated-at-contact-save')
+post_delete.connect(touch_speaker, sender=Contact, dispatch_uid='updated-at-contact-delete')
+pre_delete.connect(touch_speaker_talks, sender=Speaker, dispatch_uid='updated-at-speaker-delete')
+m2m_changed.connect(touch_talk_speakers, sender=Talk.speakers.through, dispatch_uid='updated-at-speakers')
+
+
+################################
+##             Avatar
+################################
+
+# Variantes reduzidas do avatar para o srcset (ver src.core.thumbnails).
+from src.core.thumbnails import generate_speaker_thumbnails, remember_avatar
+
+pre_save.connect(remember_avatar, sender=Speaker, dispatch_uid='avatar-remember')
+post_save.connect(generate_speaker_thumbnails, sender=Speaker, dispatch_uid='avatar-thumbnails')
+
+
+################################
+##             SQLite
+################################
+
+# WAL, busy_timeout e demais pragmas em cada conexão nova (ver src.sqlite).
+from django.db.backends.signals import connection_created
+from src.sqlite import apply_pragmas
+
+connection_created.connect(apply_pragmas, dispatch_uid='sqlite-pragmas')
@@ -0,0 +1,121 @@
+# coding: utf-8
+"""
+Cache de página inteira para as páginas públicas do core.
+
+As páginas ficam no cache indexadas por versão, caminho e idioma. Qualquer
+alteração em Talk, Speaker, Media ou Contact incrementa a versão (ver os
+sinais em models.py), o que torna todas as entradas antigas inalcançáveis
+sem precisar varrer chaves; elas expiram sozinhas pelo timeout.
+
+A versão só funciona se todos os processos a virem: com um cache local
+(LocMemCache) a edição atendida por um worker invalida apenas as páginas
+dele, e os demais seguem servindo as antigas até o timeout. Fora do DEBUG o
+cache de páginas precisa ser compartilhado (memcached ou, numa máquina só,
+FileBasedCache); check_page_cache, chamado ao carregar core/models.py,
+recusa um cache local.
+
+Com réplicas, uma leitura feita logo depois de uma alteração pode vir de
+uma réplica atrasada e guardar, sob a versão nova, a página de antes. Por
+isso invalidate_pages anota o momento da alteração, e por
+REPLICA_PIN_SECONDS as requisições que consultam a versão leem do primário
+(ver src.routers).
+"""
+import time
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.utils import translation
+
+from src.routers import use_primary
+
+
+VERSION_KEY = 'core:pages:version'
+# A chave de versão não deve expirar antes das páginas que ela protege.
+VERSION_TIMEOUT = 60 * 60 * 24 * 365
+CHANGED_KEY = 'core:pages:changed_at'
+
+
+def get_page_cache():
+    return get_cache(getattr(settings, 'PAGE_CACHE_ALIAS', 'default'))
+
+
+def check_page_cache():
+    if settings.DEBUG or not getattr(settings, 'PAGE_CACHE_SECONDS', 0):
+        return
+    if isinstance(get_page_cache(), LocMemCache):
+        raise ImproperlyConfigured(u'O cache de páginas (PAGE_CACHE_ALIAS) é local ao processo; '
+                                   u'use um cache compartilhado, como memcached ou FileBasedCache.')
+
+
+def replica_lag():
+    return getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+
+def get_version(cache=None):
+    """
+    Versão atual das páginas. Se a última alteração foi há menos de
+    REPLICA_PIN_SECONDS, o resto da requisição lê do primário.
+    """
+    cache = cache or get_page_cache()
+    values = cache.get_many([VERSION_KEY, CHANGED_KEY])
+    version = values.get(VERSION_KEY)
+    if version is None:
+        # Começa pelo relógio, e não por 1, para não reaproveitar páginas de
+        # uma versão anterior caso a chave tenha sido descartada do cache.
+        cache.add(VERSION_KEY, int(time.time()), VERSION_TIMEOUT)
+        version = cache.get(VERSION_KEY)
+    changed_at = values.get(CHANGED_KEY)
+    if changed_at is not None and time.time() - changed_at < replica_lag():
+        use_primary()
+    return version
+
+
+def invalidate_pages(**kwargs):
+    cache = get_page_cache()
+    # Anotado antes do incr: quem vê a versão nova também vê o momento.
+    cache.set(CHANGED_KEY, time.time(), int(replica_lag()) + 1)
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        get_version(cache)
+        cache.incr(VERSION_KEY)
+
+
+def page_key(request, version, kind='page'):
+    path = md5(request.get_full_path()).hexdigest()
+    return 'core:%s:%s:%s:%s' % (kind, version, translation.get_language(), path)
+
+
+def cache_public_page(view):
+    """
+    Guarda a resposta de views GET públicas por settings.PAGE_CACHE_SECONDS.
+    Requisições de usuários autenticados e respostas diferentes de 200
+    não passam pelo cache. Com PAGE_CACHE_SECONDS = 0 o cache fica desligado.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        timeout = getattr(settings, 'PAGE_CACHE_SECONDS', 0)
+        if not timeout or request.method not in ('GET', 'HEAD') or request.user.is_authenticated():
+            return view(request, *args, **kwargs)
+
+        cache = get_page_cache()
+        key = page_key(request, get_version(cache))
+        cached = cache.get(key)
+        if cached is not None:
+            headers, content = cached
+            response = HttpResponse(content)
+            for header, value in headers:
+                response[header] = value
+            return response
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            # Os cookies ficam de fora: são de quem fez a requisição.
+            cache.set(key, (response.items(), response.content), timeout)
+        return response
+    return wrapper
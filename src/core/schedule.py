@@ -0,0 +1,92 @@
+# coding: utf-8
+"""
+Divisão da agenda em períodos configuráveis.
+
+settings.SCHEDULE_PERIODS é uma lista de pares (início, nome), como
+((time(7), u'Café'), (time(9), u'Manhã'), (time(12), u'Almoço'), ...).
+Cada palestra cai no último período que começa até o seu horário (as
+anteriores ao primeiro início ficam no primeiro). A divisão é feita numa
+única passada pelas palestras já ordenadas, com busca binária nos
+inícios.
+
+A agenda pronta é guardada no cache como tuplas (Period, AgendaTalk,
+AgendaSpeaker), sob a versão do cache de páginas, que muda a cada
+alteração de palestras e palestrantes (ver src.core.pagecache); a página
+da agenda e a API reaproveitam a mesma estrutura sem consultar o banco.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import time
+from hashlib import md5
+
+from django.conf import settings
+
+from src.core.pagecache import get_page_cache, get_version
+
+
+DEFAULT_PERIODS = (
+    (time(0), u'Manhã'),
+    (time(12), u'Tarde'),
+)
+
+Period = namedtuple('Period', 'name start talks')
+AgendaTalk = namedtuple('AgendaTalk', 'id start_time title description speakers')
+AgendaSpeaker = namedtuple('AgendaSpeaker', 'slug name description')
+
+
+class Schedule(object):
+    def __init__(self, periods=None):
+        if periods is None:
+            periods = getattr(settings, 'SCHEDULE_PERIODS', DEFAULT_PERIODS)
+        periods = sorted(periods)
+        self.starts = [start for start, name in periods]
+        self.names = [name for start, name in periods]
+        self.key = md5(repr(periods)).hexdigest()
+
+    def bucket(self, talks):
+        """
+        Distribui as palestras, ordenadas por start_time, entre os períodos.
+        Retorna uma lista de Period com todos os períodos, mesmo vazios.
+        """
+        buckets = [[] for name in self.names]
+        index = 0
+        for talk in talks:
+            # Como as palestras vêm ordenadas, o período só avança.
+            index = max(bisect_right(self.starts, talk.start_time, index) - 1, index)
+            buckets[index].append(talk)
+        return [Period(name, start, talks) for name, start, talks in zip(self.names, self.starts, buckets)]
+
+
+def load_agenda(schedule):
+    """
+    Monta a agenda em duas consultas de values_list, sem instanciar os
+    modelos.
+    """
+    from src.core.models import Talk
+
+    speakers = {}
+    through = Talk.speakers.through.objects.order_by('pk').values_list(
+        'talk_id', 'speaker__slug', 'speaker__name', 'speaker__description')
+    for talk_id, slug, name, description in through:
+        speakers.setdefault(talk_id, []).append(AgendaSpeaker(slug, name, description))
+
+    talks = (AgendaTalk(pk, start_time, title, description, tuple(speakers.get(pk, ())))
+             for pk, start_time, title, description in
+             Talk.objects.order_by('start_time', 'pk').values_list('pk', 'start_time', 'title', 'description'))
+    return [Period(p.name, p.start, tuple(p.talks)) for p in schedule.bucket(talks)]
+
+
+def get_agenda(schedule=None):
+    """Agenda em tuplas, do cache quando PAGE_CACHE_SECONDS está ligado."""
+    schedule = schedule or Schedule()
+    timeout = getattr(settings, 'PAGE_CACHE_SECONDS', 0)
+    if not timeout:
+        return load_agenda(schedule)
+
+    cache = get_page_cache()
+    key = 'core:agenda:%s:%s' % (get_version(cache), schedule.key)
+    agenda = cache.get(key)
+    if agenda is None:
+        agenda = load_agenda(schedule)
+        cache.set(key, agenda, timeout)
+    return agenda
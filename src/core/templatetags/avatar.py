@@ -0,0 +1,30 @@
+# coding: utf-8
+from django import template
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from src.core.thumbnails import variants
+
+register = template.Library()
+
+
+@register.simple_tag
+def avatar(speaker, size=160):
+    """
+    {% avatar speaker [tamanho] %} emite o <img> do avatar exibido com
+    tamanho pixels, com as variantes geradas no srcset para que o navegador
+    escolha a menor que atende à densidade da tela. Sem variantes (ainda
+    sendo geradas), usa o original.
+    """
+    if not speaker.avatar:
+        return ''
+    size = int(size)
+    available = variants(speaker)
+    if available:
+        src = next((url for s, url in available if s >= size), available[-1][1])
+        srcset = ', '.join('%s %dw' % (escape(url), s) for s, url in available)
+        extra = ' srcset="%s" sizes="%dpx"' % (srcset, size)
+    else:
+        src, extra = speaker.avatar.url, ''
+    return mark_safe('<img src="%s"%s width="%d" height="%d" alt="%s" />' % (
+        escape(src), extra, size, size, escape(speaker.name)))
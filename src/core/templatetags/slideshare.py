@@ -1,7 +1,9 @@
 # encoding: utf-8
 
 from django import template
-from django.template import Context, Template, Node
+from django.template import Node
+
+from src.core.embeds import EmbedRenderer
 
 
 TEMPLATE = """
@@ -21,6 +23,8 @@ height="355">
 </object>
 """
 
+renderer = EmbedRenderer(TEMPLATE)
+
 def do_slideshare(parser, token):
     try:
         tag_name, id_, doc = token.split_contents()
@@ -44,9 +48,7 @@ class SlideShareNode(Node):
         except template.VariableDoesNotExist:
             actual_doc = self.doc
 
-        t = Template(TEMPLATE)
-        c = Context({'id': actual_id, 'doc': actual_doc}, autoescape=context.autoescape)
-        return t.render(c)
+        return renderer.render(context.autoescape, id=actual_id, doc=actual_doc)
 
 register = template.Library()
 register.tag('slideshare', do_slideshare)
@@ -1,6 +1,8 @@
 # encoding: utf-8
 from django import template
-from django.template import Context, Template, Node
+from django.template import Node
+
+from src.core.embeds import EmbedRenderer
 
 TEMPLATE = """"
 <object width="480" height="385">
@@ -18,6 +20,8 @@ TEMPLATE = """"
    </object>
 """
 
+renderer = EmbedRenderer(TEMPLATE)
+
 def do_youtube(parser, token):
     try:
         tag_name, id_ = token.split_contents()
@@ -38,9 +42,7 @@ class YoutubeNode(Node):
         except template.VariableDoesNotExist:
             actual_id = self.id
 
-        t = Template(TEMPLATE)
-        c = Context({'id': actual_id}, autoescape=context.autoescape)
-        return t.render(c)
+        return renderer.render(context.autoescape, id=actual_id)
 
 register = template.Library()
 register.tag('youtube', do_youtube)
@@ -1,8 +1,25 @@
 # coding: utf-8
+import json
+import os
+from collections import namedtuple
+from datetime import date, datetime, time
 from django.core.urlresolvers import reverse
+from django.template import Context, Template
+from django.template.loader import get_template
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
 from .models import Speaker, Contact, Talk
-from src.core.models import PeriodManager, Media
+from src.core.models import Course, PeriodManager, Media
+from src.core.embeds import EmbedRenderer
+from django.utils.safestring import mark_safe
+from src.core.pagecache import cache_public_page, check_page_cache, get_page_cache, get_version
+from src.core import thumbnails
+from src.core.schedule import Schedule, get_agenda
+from src import instrumentation
+from src.assets import AssetStorage
+from src.negotiation import accepts_gzip
 
 class HomepageTest(TestCase):
     def test_get_homepage(self):
@@ -77,6 +94,54 @@ class ContactModelTest(TestCase):
         contact = Contact.objects.create(speaker=self.speaker, kind='F', value='88-12345678')
         self.assertEqual(1, contact.pk)
 
+    def test_kind_managers(self):
+        Contact.objects.create(speaker=self.speaker, kind='E', value='joe@doe.com')
+        Contact.objects.create(speaker=self.speaker, kind='P', value='99-12345678')
+        self.assertEqual(['joe@doe.com'], [c.value for c in Contact.emails.all()])
+        self.assertEqual(['99-12345678'], [c.value for c in Contact.phones.all()])
+        self.assertEqual([], list(Contact.faxes.all()))
+
+
+class SpeakerContactsTest(TestCase):
+    def setUp(self):
+        self.speaker = Speaker.objects.create(name='Henrique Bastos', slug='henrique-bastos',
+                                              url='http://henriquebastos.net')
+        self.other = Speaker.objects.create(name='Outro', slug='outro', url='http://outro.net')
+        Contact.objects.create(speaker=self.speaker, kind='P', value='21-1111')
+        Contact.objects.create(speaker=self.speaker, kind='E', value='henrique@bastos.net')
+        Contact.objects.create(speaker=self.speaker, kind='P', value='21-2222')
+        Contact.objects.create(speaker=self.other, kind='F', value='21-3333')
+
+    def test_grouped(self):
+        speaker = Speaker.objects.get(pk=self.speaker.pk)
+        self.assertEqual(['21-1111', '21-2222'], [c.value for c in speaker.phones])
+        self.assertEqual(['henrique@bastos.net'], [c.value for c in speaker.emails])
+        self.assertEqual([], speaker.faxes)
+
+    def test_single_query(self):
+        u'Telefones, e-mails e faxes devem custar uma única consulta.'
+        speaker = Speaker.objects.get(pk=self.speaker.pk)
+        with self.assertNumQueries(1):
+            speaker.phones
+            speaker.emails
+            speaker.faxes
+            [c.speaker.name for c in speaker.phones]
+
+    def test_load_for_many(self):
+        u'Contatos de vários palestrantes devem ser carregados numa única consulta.'
+        speakers = list(Speaker.objects.order_by('pk'))
+        with self.assertNumQueries(1):
+            Contact.objects.load_for(speakers)
+            self.assertEqual(['21-3333'], [c.value for c in speakers[1].faxes])
+            self.assertEqual([], speakers[1].phones)
+
+    def test_detail(self):
+        with self.assertNumQueries(3):
+            resp = self.client.get(reverse('core:speaker_detail', args=[self.speaker.slug]))
+        self.assertContains(resp, 'mailto:henrique@bastos.net')
+        self.assertContains(resp, 'Telefone: 21-2222')
+        self.assertNotContains(resp, '21-3333')
+
 
 #################################
 ##              TALK
@@ -109,11 +174,12 @@ class TalkViewTest(TestCase):
     def test_template(self):
         self.assertTemplateUsed(self.resp, 'core/talks.html')
 
-    def test_morning_talks_in_context(self):
-        self.assertIn('morning_talks', self.resp.context)
+    def test_periods_in_context(self):
+        self.assertEqual([u'Manhã', u'Tarde'], [p.name for p in self.resp.context['periods']])
 
-    def test_afternoon_talks_in_context(self):
-        self.assertIn('afternoon_talks', self.resp.context)
+    def test_empty_periods(self):
+        self.assertContains(self.resp, u'Não existem palestras cadastras para Manhã')
+        self.assertContains(self.resp, u'Não existem palestras cadastras para Tarde')
 
 class TalkPeriodManagerTest(TestCase):
     def setUp(self):
@@ -131,6 +197,72 @@ class TalkPeriodManagerTest(TestCase):
             lambda t: t.title
         )
 
+class TalkAgendaTest(TestCase):
+    def setUp(self):
+        speakers = [Speaker.objects.create(name='Speaker %d' % i, slug='speaker-%d' % i,
+                                           url='http://speaker%d.net' % i)
+                    for i in range(3)]
+        for i in range(30):
+            talk = Talk.objects.create(title=u'Talk %d' % i, start_time='%02d:00' % (8 + i % 12))
+            talk.speakers.add(*speakers[:i % 3 + 1])
+
+    def test_agenda(self):
+        morning, afternoon = Talk.objects.agenda()
+        self.assertEqual([t.title for t in Talk.objects.at_morning()], [t.title for t in morning.talks])
+        self.assertEqual([t.title for t in Talk.objects.at_afternoon()], [t.title for t in afternoon.talks])
+
+    def test_agenda_queries(self):
+        u'Palestras e palestrantes devem ser carregados em duas consultas.'
+        with self.assertNumQueries(2):
+            morning, afternoon = Talk.objects.agenda()
+            for talk in morning.talks + afternoon.talks:
+                list(talk.speakers.all())
+
+    def test_compact_agenda(self):
+        u'A agenda em tuplas deve ter as mesmas palestras e palestrantes.'
+        with self.assertNumQueries(2):
+            agenda = get_agenda()
+        for period, compact in zip(Talk.objects.agenda(), agenda):
+            self.assertEqual([(t.pk, t.title, [s.slug for s in t.speakers.all()]) for t in period.talks],
+                             [(t.id, t.title, [s.slug for s in t.speakers]) for t in compact.talks])
+
+    @override_settings(PAGE_CACHE_SECONDS=600)
+    def test_cached_agenda(self):
+        get_page_cache().clear()
+        agenda = get_agenda()
+        with self.assertNumQueries(0):
+            self.assertEqual(agenda, get_agenda())
+        Talk.objects.create(title=u'Nova', start_time='09:30')
+        self.assertEqual(len(agenda[0].talks) + 1, len(get_agenda()[0].talks))
+
+    def test_view_queries(self):
+        u'O custo da agenda nao deve depender da quantidade de palestras.'
+        # ETag/Last-Modified, palestras e palestrantes.
+        with self.assertNumQueries(3):
+            resp = self.client.get(reverse('core:talks'))
+        self.assertContains(resp, 'Speaker 2', 10)
+
+
+class ScheduleTest(TestCase):
+    def setUp(self):
+        self.schedule = Schedule([(time(12), u'Almoço'), (time(7), u'Café'), (time(9), u'Manhã'),
+                                  (time(14), u'Tarde'), (time(18), u'Noite')])
+
+    def test_bucket(self):
+        u'Cada palestra cai no último período que começa até o seu horário.'
+        Talk = namedtuple('Talk', 'start_time')
+        talks = [Talk(time(h, m)) for h, m in [(6, 0), (7, 0), (8, 59), (9, 0), (12, 30), (18, 0), (23, 0)]]
+        periods = self.schedule.bucket(talks)
+        self.assertEqual([u'Café', u'Manhã', u'Almoço', u'Tarde', u'Noite'], [p.name for p in periods])
+        self.assertEqual([[6, 7, 8], [9], [12], [], [18, 23]],
+                         [[t.start_time.hour for t in p.talks] for p in periods])
+
+    @override_settings(SCHEDULE_PERIODS=[(time(0), u'Manhã'), (time(12), u'Almoço'), (time(14), u'Tarde')])
+    def test_view(self):
+        resp = self.client.get(reverse('core:talks'))
+        self.assertEqual([u'Manhã', u'Almoço', u'Tarde'], [p.name for p in resp.context['periods']])
+
+
 class TalkDetailTest(TestCase):
     def setUp(self):
         Talk.objects.create(title="Talk", start_time='10:00')
@@ -156,3 +288,853 @@ class MediaModelTest(TestCase):
 
     def test_unicode(self):
         self.assertEqual("Talk 1 - Video", unicode(self.media))
+
+
+class EmbedRendererTest(TestCase):
+    def setUp(self):
+        self.renderer = EmbedRenderer('<a href="{{ id }}">{{ doc }}</a>', maxsize=2)
+
+    def test_render(self):
+        self.assertEqual(u'<a href="x">&lt;b&gt;</a>', self.renderer.render(id='x', doc='<b>'))
+
+    def test_autoescape_in_key(self):
+        self.renderer.render(id='x', doc='<b>')
+        self.assertEqual(u'<a href="x"><b></a>', self.renderer.render(False, id='x', doc='<b>'))
+
+    def test_safe_string_in_key(self):
+        self.renderer.render(id='x', doc='<b>')
+        self.assertEqual(u'<a href="x"><b></a>', self.renderer.render(id='x', doc=mark_safe('<b>')))
+        self.assertEqual(u'<a href="x">&lt;b&gt;</a>', self.renderer.render(id='x', doc='<b>'))
+
+    def test_unhashable_not_cached(self):
+        self.assertEqual(u'<a href="x">[1]</a>', self.renderer.render(id='x', doc=[1]))
+        self.assertEqual(0, len(self.renderer.cache))
+
+    def test_memoized(self):
+        self.renderer.render(id='x', doc='y')
+        self.renderer.render(id='x', doc='y')
+        self.assertEqual((1, 1), (self.renderer.hits, self.renderer.misses))
+
+    def test_bounded(self):
+        self.renderer.render(id='a', doc='')
+        self.renderer.render(id='b', doc='')
+        self.renderer.render(id='a', doc='')
+        self.renderer.render(id='c', doc='')
+        self.assertEqual(2, len(self.renderer.cache))
+        self.renderer.render(id='a', doc='')
+        self.assertEqual(2, self.renderer.hits)
+
+
+class EmbedTagsTest(TestCase):
+    def test_slideshare(self):
+        t = Template('{% load slideshare %}{% slideshare "42" "doc-1" %}')
+        html = t.render(Context())
+        self.assertIn('__sse42', html)
+        self.assertIn('doc=doc-1', html)
+
+    def test_youtube(self):
+        t = Template('{% load youtube %}{% youtube media_id %}')
+        html = t.render(Context({'media_id': 'Qjdfasdf'}))
+        self.assertIn('http://www.youtube.com/v/Qjdfasdf', html)
+
+
+class TalkMediaTest(TestCase):
+    def setUp(self):
+        self.talk = Talk.objects.create(title=u'Talk 1', start_time='10:00')
+        self.other = Talk.objects.create(title=u'Talk 2', start_time='14:00')
+        Media.objects.create(talk=self.talk, type='SL', media_id='sl1', title='Slide 1')
+        Media.objects.create(talk=self.talk, type='YT', media_id='yt1', title='Video 1')
+        Media.objects.create(talk=self.talk, type='SL', media_id='sl2', title='Slide 2')
+        Media.objects.create(talk=self.other, type='YT', media_id='yt2', title='Video 2')
+
+    def test_grouped(self):
+        talk = Talk.objects.get(pk=self.talk.pk)
+        self.assertEqual(['sl1', 'sl2'], [m.media_id for m in talk.slides])
+        self.assertEqual(['yt1'], [m.media_id for m in talk.videos])
+
+    def test_single_query(self):
+        u'Slides e videos devem custar uma unica consulta.'
+        talk = Talk.objects.get(pk=self.talk.pk)
+        with self.assertNumQueries(1):
+            talk.slides
+            talk.slides
+            talk.videos
+            [unicode(m) for m in talk.slides]
+
+    def test_load_for_many(self):
+        u'Midias de varias palestras devem ser carregadas numa unica consulta.'
+        talks = list(Talk.objects.order_by('pk'))
+        with self.assertNumQueries(1):
+            Media.objects.load_for(talks)
+            self.assertEqual(['yt2'], [m.media_id for m in talks[1].videos])
+            self.assertEqual([], talks[1].slides)
+
+    def test_detail(self):
+        resp = self.client.get(reverse('core:talk_detail', args=[self.talk.pk]))
+        self.assertContains(resp, 'doc=Slide 1')
+        self.assertContains(resp, 'youtube.com/v/yt1')
+
+
+@override_settings(PAGE_CACHE_SECONDS=600)
+class PageCacheTest(TestCase):
+    def setUp(self):
+        get_page_cache().clear()
+        self.speaker = Speaker.objects.create(name='Henrique Bastos', slug='henrique-bastos',
+                                              url='http://henriquebastos.net')
+        self.talk = Talk.objects.create(title=u'Talk', start_time='10:00')
+        self.talk.speakers.add(self.speaker)
+        self.url = reverse('core:talk_detail', args=[self.talk.pk])
+        self.client.get(self.url)
+
+    def test_cached(self):
+        u'A segunda visita deve ser servida do cache, sem consultas.'
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.url)
+        self.assertContains(resp, 'Henrique Bastos')
+
+    def test_cached_not_modified(self):
+        u'O 304 de uma página no cache também não deve consultar o banco.'
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, resp.status_code)
+
+    def test_invalidate_on_save(self):
+        self.speaker.name = 'Outro Nome'
+        self.speaker.save()
+        self.assertContains(self.client.get(self.url), 'Outro Nome')
+
+    def test_invalidate_on_m2m(self):
+        self.talk.speakers.clear()
+        self.assertNotContains(self.client.get(self.url), 'Henrique Bastos')
+
+    def test_invalidate_on_delete(self):
+        Media.objects.create(talk=self.talk, type='YT', media_id='yt1', title='Video')
+        self.assertContains(self.client.get(self.url), 'youtube.com/v/yt1')
+        Media.objects.all().delete()
+        self.assertNotContains(self.client.get(self.url), 'youtube.com/v/yt1')
+
+    def test_authenticated_bypass(self):
+        u'Usuarios autenticados nao devem receber paginas do cache.'
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        resp = self.client.get(self.url)
+        self.assertTemplateUsed(resp, 'core/talk_detail.html')
+
+    def test_not_found_not_cached(self):
+        u'Respostas de erro nao devem ir para o cache.'
+        self.client.get(reverse('core:talk_detail', args=[99]))
+        with self.assertNumQueries(1):
+            self.client.get(reverse('core:talk_detail', args=[99]))
+
+    def test_cached_headers(self):
+        u'A resposta servida do cache deve manter os cabeçalhos da original.'
+        from django.contrib.auth.models import AnonymousUser
+        from django.http import HttpResponse
+        from django.test.client import RequestFactory
+
+        @cache_public_page
+        def view(request):
+            response = HttpResponse('ok', content_type='text/plain')
+            response['Content-Language'] = 'pt-br'
+            response.set_cookie('pessoal', '1')
+            return response
+
+        request = RequestFactory().get('/cabecalhos/')
+        request.user = AnonymousUser()
+        view(request)
+        resp = view(request)
+        self.assertEqual(('text/plain', 'pt-br'), (resp['Content-Type'], resp['Content-Language']))
+        self.assertNotIn('pessoal', resp.cookies)
+
+    def test_shared_cache_required(self):
+        u'Fora do DEBUG o cache de páginas não pode ser local ao processo.'
+        import shutil, tempfile
+        from django.conf import settings
+        from django.core.exceptions import ImproperlyConfigured
+        with override_settings(DEBUG=False):
+            self.assertRaises(ImproperlyConfigured, check_page_cache)
+            directory = tempfile.mkdtemp()
+            try:
+                caches = dict(settings.CACHES, files={
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory})
+                with override_settings(CACHES=caches, PAGE_CACHE_ALIAS='files'):
+                    check_page_cache()
+            finally:
+                shutil.rmtree(directory)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.speaker = Speaker.objects.create(name='Henrique Bastos', slug='henrique-bastos',
+                                              url='http://henriquebastos.net')
+        self.talk = Talk.objects.create(title=u'Talk', start_time='10:00')
+        self.talk.speakers.add(self.speaker)
+        self.urls = [reverse('core:talk_detail', args=[self.talk.pk]),
+                     reverse('core:speaker_detail', args=[self.speaker.slug]),
+                     reverse('core:talks')]
+
+    def etags(self):
+        return [self.client.get(url)['ETag'] for url in self.urls]
+
+    def assertChanged(self, before, *indexes):
+        after = self.etags()
+        for i, url in enumerate(self.urls):
+            if i in indexes:
+                self.assertNotEqual(before[i], after[i], url)
+            else:
+                self.assertEqual(before[i], after[i], url)
+
+    def test_not_modified(self):
+        u'Com o ETag atual, a resposta é 304 sem renderizar o template.'
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(1):
+                resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(304, resp.status_code)
+            self.assertEqual('', resp.content)
+
+    def test_last_modified(self):
+        resp = self.client.get(self.urls[0])
+        resp = self.client.get(self.urls[0], HTTP_IF_MODIFIED_SINCE=resp['Last-Modified'])
+        self.assertEqual(304, resp.status_code)
+
+    def test_talk_saved(self):
+        before = self.etags()
+        self.talk.description = u'Nova descrição'
+        self.talk.save()
+        self.assertChanged(before, 0, 2)
+
+    def test_speaker_saved(self):
+        before = self.etags()
+        self.speaker.save()
+        self.assertChanged(before, 0, 1, 2)
+
+    def test_media(self):
+        before = self.etags()
+        media = Media.objects.create(talk=self.talk, type='YT', media_id='yt1', title='Video')
+        self.assertChanged(before, 0, 2)
+        before = self.etags()
+        media.delete()
+        self.assertChanged(before, 0, 2)
+
+    def test_contact(self):
+        before = self.etags()
+        Contact.objects.create(speaker=self.speaker, kind='E', value='henrique@bastos.net')
+        # O contato atualiza o palestrante, que aparece nas páginas de palestra.
+        self.assertChanged(before, 0, 1, 2)
+
+    def test_speakers_m2m(self):
+        other = Speaker.objects.create(name='Outro', slug='outro', url='http://outro.net')
+        before = self.etags()
+        self.talk.speakers.add(other)
+        self.assertChanged(before, 0, 2)
+        before = self.etags()
+        self.talk.speakers.clear()
+        self.assertChanged(before, 0, 1, 2)
+
+    def test_speaker_deleted(self):
+        before = self.etags()[0]
+        self.speaker.delete()
+        self.assertNotEqual(before, self.client.get(self.urls[0])['ETag'])
+
+    def test_talk_deleted(self):
+        Talk.objects.create(title=u'Outra', start_time='14:00')
+        before = self.etags()[2]
+        self.talk.delete()
+        self.assertNotEqual(before, self.client.get(self.urls[2])['ETag'])
+
+
+class TimingMiddlewareTest(TestCase):
+    def setUp(self):
+        instrumentation.stats.reset()
+        speaker = Speaker.objects.create(name='Henrique Bastos', slug='henrique-bastos',
+                                         url='http://henriquebastos.net')
+        Talk.objects.create(title=u'Talk', start_time='10:00').speakers.add(speaker)
+        self.resp = self.client.get(reverse('core:talks'))
+
+    @override_settings(INTERNAL_IPS=('127.0.0.1',))
+    def test_server_timing(self):
+        header = self.client.get(reverse('core:talks'))['Server-Timing']
+        for metric in ('sql;dur=', 'tpl;dur=', 'view;dur=', 'total;dur='):
+            self.assertIn(metric, header)
+        self.assertIn('"3 queries"', header)
+        template = float(header.split('tpl;dur=')[1].split(',')[0])
+        self.assertGreater(template, 0)
+
+    def test_server_timing_hidden(self):
+        u'Visitantes anônimos de fora não devem ver consultas e tempos.'
+        self.assertFalse(self.resp.has_header('Server-Timing'))
+
+    def test_server_timing_staff(self):
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.assertTrue(self.client.get(reverse('core:talks')).has_header('Server-Timing'))
+
+    def test_template_not_patched(self):
+        u'A medição vem do carregador de templates, sem alterar a classe Template.'
+        self.assertEqual(instrumentation.TimedTemplate, type(get_template('core/talks.html')))
+
+    def test_stats_by_url_name(self):
+        self.client.get(reverse('core:talks'))
+        summary = instrumentation.stats.summary()
+        self.assertEqual(2, summary['core:talks']['count'])
+
+    def test_assert_num_queries(self):
+        u'O middleware não deve esconder as consultas do assertNumQueries.'
+        with self.assertNumQueries(3):
+            self.client.get(reverse('core:talks'))
+
+    def test_slowest(self):
+        with instrumentation.QueryRecorder(slowest=2) as recorder:
+            list(Talk.objects.all())
+            list(Speaker.objects.all())
+            list(Contact.objects.all())
+        self.assertEqual(3, recorder.queries)
+        self.assertEqual(2, len(recorder.slowest))
+        self.assertTrue(recorder.slowest[0][0] >= recorder.slowest[1][0])
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(50, instrumentation.percentile(values, 50))
+        self.assertEqual(95, instrumentation.percentile(values, 95))
+        self.assertEqual(99, instrumentation.percentile(values, 99))
+        self.assertEqual(None, instrumentation.percentile([], 50))
+
+    def test_flush_and_load(self):
+        import shutil, tempfile
+        directory = tempfile.mkdtemp()
+        try:
+            instrumentation.stats.flush(directory)
+            samples = instrumentation.load_samples(directory)
+            self.assertEqual(1, len(samples['core:talks']))
+        finally:
+            shutil.rmtree(directory)
+
+
+class AssetStorageTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.core.files.storage import FileSystemStorage
+        self.source = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        files = {
+            'css/style.css': '/* comentario */\nbody {\n    background: url("../img/logo.png");\n    color : red;\n}\n'
+                             + 'p {\n    margin: 0;\n}\n' * 20,
+            'img/logo.png': 'PNG',
+        }
+        # O collectstatic copia os originais para STATIC_ROOT antes do post_process.
+        for directory in (self.source, self.root):
+            for name, content in files.items():
+                path = os.path.join(directory, name)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'w') as f:
+                    f.write(content)
+        source = FileSystemStorage(self.source)
+        self.storage = AssetStorage(location=self.root, base_url='/static/')
+        self.processed = list(self.storage.post_process(dict((n, (source, n)) for n in files)))
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.root)
+
+    def test_manifest(self):
+        manifest = AssetStorage(location=self.root, base_url='/static/').manifest
+        self.assertRegexpMatches(manifest['css/style.css'], r'^css/style\.[0-9a-f]{12}\.css$')
+        self.assertRegexpMatches(manifest['img/logo.png'], r'^img/logo\.[0-9a-f]{12}\.png$')
+
+    def test_css_rewritten_and_minified(self):
+        manifest = self.storage.manifest
+        with self.storage.open(manifest['css/style.css']) as f:
+            content = f.read()
+        self.assertEqual('body{background:url("../%s");color:red}' % manifest['img/logo.png']
+                         + 'p{margin:0}' * 20, content)
+
+    def test_css_hash_from_final_content(self):
+        u'O nome do CSS deve mudar quando muda uma imagem que ele referencia.'
+        from hashlib import md5
+        from django.core.files.storage import FileSystemStorage
+        name = self.storage.manifest['css/style.css']
+        with self.storage.open(name) as f:
+            self.assertIn(md5(f.read()).hexdigest()[:12], name)
+
+        for directory in (self.source, self.root):
+            with open(os.path.join(directory, 'img/logo.png'), 'w') as f:
+                f.write('PNG novo')
+        source = FileSystemStorage(self.source)
+        storage = AssetStorage(location=self.root, base_url='/static/')
+        list(storage.post_process(dict((n, (source, n)) for n in ('css/style.css', 'img/logo.png'))))
+        self.assertNotEqual(name, storage.manifest['css/style.css'])
+        with storage.open(storage.manifest['css/style.css']) as f:
+            self.assertIn(storage.manifest['img/logo.png'], f.read())
+
+    def test_gzip(self):
+        import gzip
+        manifest = self.storage.manifest
+        self.assertTrue(self.storage.exists(manifest['css/style.css'] + '.gz'))
+        self.assertFalse(self.storage.exists(manifest['img/logo.png'] + '.gz'))
+        with gzip.open(self.storage.path(manifest['css/style.css'] + '.gz')) as f:
+            self.assertTrue(f.read().startswith('body{'))
+
+    def test_url(self):
+        self.assertEqual('/static/' + self.storage.manifest['img/logo.png'], self.storage.url('img/logo.png'))
+        self.assertEqual('/static/img/other.png', self.storage.url('img/other.png'))
+
+    def test_application(self):
+        from src.assets import AssetsApplication
+        app = AssetsApplication(lambda environ, start_response: ['django'], self.storage)
+        headers = {}
+        start_response = lambda status, h: headers.update(h)
+        name = self.storage.manifest['css/style.css']
+        body = ''.join(app({'PATH_INFO': '/static/' + name, 'REQUEST_METHOD': 'GET',
+                            'HTTP_ACCEPT_ENCODING': 'gzip'}, start_response))
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual('public, max-age=31536000', headers['Cache-Control'])
+        self.assertEqual(len(body), int(headers['Content-Length']))
+        headers.clear()
+        app({'PATH_INFO': '/static/' + name, 'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip;q=0'},
+            start_response)
+        self.assertNotIn('Content-Encoding', headers)
+        app({'PATH_INFO': '/static/css/style.css', 'REQUEST_METHOD': 'GET'}, start_response)
+        self.assertEqual('public, max-age=3600', headers['Cache-Control'])
+        self.assertEqual(['django'], app({'PATH_INFO': '/static/css/other.css', 'REQUEST_METHOD': 'GET'}, None))
+
+
+@override_settings(AVATAR_THUMBNAIL_WORKERS=0, AVATAR_SIZES=(20, 40, 80))
+class AvatarThumbnailTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.core.files.storage import FileSystemStorage
+        from PIL import Image
+        self.root = tempfile.mkdtemp()
+        self.field = Speaker._meta.get_field('avatar')
+        self.storage = self.field.storage
+        self.field.storage = FileSystemStorage(self.root, '/media/')
+
+        self.path = os.path.join(self.root, 'original.png')
+        Image.new('RGBA', (60, 50), (255, 0, 0, 128)).save(self.path)
+        self.speaker = Speaker(name='Henrique Bastos', slug='henrique-bastos', url='http://henriquebastos.net')
+        self.upload(self.speaker, 'foto.png')
+
+    def upload(self, speaker, name):
+        from django.core.files import File
+        with open(self.path, 'rb') as f:
+            speaker.avatar.save(name, File(f))
+
+    def variant_path(self, name):
+        return os.path.join(self.root, 'palestrantes', name)
+
+    def tearDown(self):
+        import shutil
+        self.field.storage = self.storage
+        shutil.rmtree(self.root)
+
+    def test_variants(self):
+        u'Gera variantes quadradas em JPEG ao lado do original, sem ampliar a imagem.'
+        from PIL import Image
+        self.assertEqual([(20, '/media/palestrantes/foto_20.jpg'), (40, '/media/palestrantes/foto_40.jpg')],
+                         thumbnails.variants(self.speaker))
+        image = Image.open(self.variant_path('foto_40.jpg'))
+        self.assertEqual(('JPEG', (40, 40)), (image.format, image.size))
+
+    def test_sizes_recorded(self):
+        u'Os tamanhos gerados ficam no palestrante; variants() não consulta o storage.'
+        speaker = Speaker.objects.get(pk=self.speaker.pk)
+        self.assertEqual('20,40', speaker.avatar_sizes)
+        os.remove(self.variant_path('foto_20.jpg'))
+        self.assertEqual([20, 40], [size for size, url in thumbnails.variants(speaker)])
+
+    def test_generation_touches_speaker(self):
+        u'Ao terminar, atualiza updated_at e invalida o cache de páginas.'
+        Speaker.objects.filter(pk=self.speaker.pk).update(updated_at=datetime(2012, 1, 1, tzinfo=timezone.utc))
+        cache = get_page_cache()
+        version = get_version(cache)
+        thumbnails.record_sizes(self.speaker.pk, self.speaker.avatar.name, [20])
+        speaker = Speaker.objects.get(pk=self.speaker.pk)
+        self.assertEqual('20', speaker.avatar_sizes)
+        self.assertGreater(speaker.updated_at, datetime(2012, 1, 1, tzinfo=timezone.utc))
+        self.assertNotEqual(version, get_version(cache))
+
+    def test_stale_avatar_not_recorded(self):
+        u'Um resultado atrasado não sobrescreve os tamanhos de um avatar trocado.'
+        self.assertFalse(thumbnails.record_sizes(self.speaker.pk, 'palestrantes/outra.png', [20]))
+        self.assertEqual('20,40', Speaker.objects.get(pk=self.speaker.pk).avatar_sizes)
+
+    def test_replaced_avatar(self):
+        u'Trocar o avatar apaga as variantes do antigo e gera as do novo.'
+        speaker = Speaker.objects.get(pk=self.speaker.pk)
+        self.upload(speaker, 'nova.png')
+        self.assertFalse(os.path.exists(self.variant_path('foto_20.jpg')))
+        self.assertTrue(os.path.exists(self.variant_path('nova_20.jpg')))
+        self.assertEqual('20,40', Speaker.objects.get(pk=speaker.pk).avatar_sizes)
+
+    def test_replaced_avatar_same_name(self):
+        u'Um avatar novo com o nome do antigo não reaproveita as variantes antigas.'
+        from PIL import Image
+        speaker = Speaker.objects.get(pk=self.speaker.pk)
+        speaker.avatar.delete()
+        self.assertEqual('', Speaker.objects.get(pk=speaker.pk).avatar_sizes)
+        self.assertFalse(os.path.exists(self.variant_path('foto_20.jpg')))
+
+        Image.new('RGB', (60, 50), (0, 0, 255)).save(self.path)
+        self.upload(speaker, 'foto.png')
+        self.assertEqual('palestrantes/foto.png', speaker.avatar.name)
+        image = Image.open(self.variant_path('foto_20.jpg'))
+        red, green, blue = image.getpixel((10, 10))
+        self.assertGreater(blue, red)
+
+    def test_tag(self):
+        html = Template('{% load avatar %}{% avatar speaker 40 %}').render(Context({'speaker': self.speaker}))
+        self.assertIn('src="/media/palestrantes/foto_40.jpg"', html)
+        self.assertIn('srcset="/media/palestrantes/foto_20.jpg 20w, /media/palestrantes/foto_40.jpg 40w"', html)
+        self.assertIn('alt="Henrique Bastos"', html)
+
+    def test_tag_without_avatar(self):
+        html = Template('{% load avatar %}{% avatar speaker %}').render(Context({'speaker': Speaker(name='X')}))
+        self.assertEqual('', html)
+
+    def test_backfill(self):
+        from django.core.management import call_command
+        from StringIO import StringIO
+        os.remove(self.variant_path('foto_20.jpg'))
+        Speaker.objects.filter(pk=self.speaker.pk).update(avatar_sizes='')
+        out = StringIO()
+        call_command('make_avatar_thumbnails', workers=2, stdout=out)
+        self.assertEqual('1 avatar(es), 1 miniatura(s) gerada(s)\n', out.getvalue())
+        self.assertTrue(os.path.exists(self.variant_path('foto_20.jpg')))
+        self.assertEqual('20,40', Speaker.objects.get(pk=self.speaker.pk).avatar_sizes)
+
+
+@override_settings(PAGE_CACHE_SECONDS=600, API_PAGE_SIZE=2)
+class AgendaApiTest(TestCase):
+    def setUp(self):
+        get_page_cache().clear()
+        self.speaker = Speaker.objects.create(name='Henrique Bastos', slug='henrique-bastos',
+                                              url='http://henriquebastos.net')
+        self.talks = [Talk.objects.create(title=u'Talk %d' % i, start_time='%02d:00' % (10 + i))
+                      for i in range(3)]
+        self.talks[0].speakers.add(self.speaker)
+        Media.objects.create(talk=self.talks[0], type='YT', media_id='yt1', title='Video')
+        self.url = reverse('core:api_talks')
+
+    def get(self, url=None, **extra):
+        resp = self.client.get(url or self.url, **extra)
+        return resp, json.loads(resp.content) if resp.status_code in (200, 400) else None
+
+    def test_talks(self):
+        resp, data = self.get()
+        self.assertEqual('application/json', resp['Content-Type'])
+        self.assertEqual({'id': self.talks[0].pk, 'title': 'Talk 0', 'description': '', 'start_time': '10:00',
+                          'speakers': ['henrique-bastos'],
+                          'media': [{'type': 'YT', 'title': 'Video', 'media_id': 'yt1'}]},
+                         data['results'][0])
+
+    def test_speakers(self):
+        resp, data = self.get(reverse('core:api_speakers'))
+        self.assertEqual([{'slug': 'henrique-bastos', 'name': 'Henrique Bastos', 'url': 'http://henriquebastos.net',
+                           'description': '', 'avatar': None, 'talks': [self.talks[0].pk]}],
+                         data['results'])
+
+    def test_fields(self):
+        resp, data = self.get(self.url + '?fields=id,title')
+        self.assertEqual({'id': self.talks[0].pk, 'title': 'Talk 0'}, data['results'][0])
+        resp, data = self.get(self.url + '?fields=id,senha')
+        self.assertEqual(400, resp.status_code)
+        self.assertIn('senha', data['error'])
+
+    def test_cursor(self):
+        u'Uma palestra inserida entre as páginas não desloca a paginação.'
+        resp, data = self.get(self.url + '?fields=title')
+        self.assertEqual(['Talk 0', 'Talk 1'], [t['title'] for t in data['results']])
+        Talk.objects.create(title=u'Cedo', start_time='09:00')
+        resp, data = self.get(data['next'])
+        self.assertEqual([{'title': 'Talk 2'}], data['results'])
+        self.assertEqual(None, data['next'])
+
+    def test_bad_cursor(self):
+        resp, data = self.get(self.url + '?cursor=xyz')
+        self.assertEqual(400, resp.status_code)
+
+    def test_not_modified_from_cache(self):
+        u'Um cliente com o ETag atual recebe 304 sem consultas ao banco.'
+        resp, data = self.get()
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual('', resp.content)
+
+    def test_etag_changes(self):
+        etag = self.get()[0]['ETag']
+        Media.objects.create(talk=self.talks[0], type='SL', media_id='sl1', title='Slide')
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, resp.status_code)
+        self.assertNotEqual(etag, resp['ETag'])
+
+    def test_gzip(self):
+        import gzip
+        from StringIO import StringIO
+        with self.settings(API_PAGE_SIZE=100):
+            plain = self.client.get(self.url)
+            resp = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+            self.assertEqual('gzip', resp['Content-Encoding'])
+            self.assertEqual(plain.content, gzip.GzipFile(fileobj=StringIO(resp.content)).read())
+            self.assertNotEqual(plain['ETag'], resp['ETag'])
+            resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=plain['ETag'], HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(304, resp.status_code)
+
+    def test_gzip_refused(self):
+        u'gzip;q=0 recusa o gzip, mesmo com ele no cabeçalho.'
+        with self.settings(API_PAGE_SIZE=100):
+            resp = self.client.get(self.url, HTTP_ACCEPT_ENCODING='deflate, gzip;q=0')
+        self.assertFalse(resp.has_header('Content-Encoding'))
+        self.assertFalse(resp['ETag'].endswith('-gz"'))
+
+    def test_accepts_gzip(self):
+        self.assertTrue(accepts_gzip('gzip'))
+        self.assertTrue(accepts_gzip('deflate, GZIP;q=0.5'))
+        self.assertTrue(accepts_gzip('*'))
+        self.assertTrue(accepts_gzip('x-gzip'))
+        self.assertFalse(accepts_gzip(''))
+        self.assertFalse(accepts_gzip('gzip;q=0'))
+        self.assertFalse(accepts_gzip('gzip; q=0.000, *'))
+        self.assertFalse(accepts_gzip('*;q=0'))
+        self.assertFalse(accepts_gzip('gzip;q=abc'))
+        self.assertFalse(accepts_gzip('deflate, identity'))
+
+    def test_cache_key_from_params(self):
+        u'A mesma página pedida com os parâmetros em outra ordem ou forma usa a mesma entrada do cache.'
+        from src.core import api
+        calls = []
+        build_payload = api.build_payload
+        api.build_payload = lambda *args: calls.append(args) or build_payload(*args)
+        try:
+            first = self.get(self.url + '?fields=id,title&limit=1')[1]
+            self.assertEqual(first, self.get(self.url + '?limit=01&fields=id,%20title&x=1')[1])
+        finally:
+            api.build_payload = build_payload
+        self.assertEqual(1, len(calls))
+
+
+@override_settings(EVENT_DATE=date(2012, 12, 8), TALK_DURATION_MINUTES=45)
+class ICalendarTest(TestCase):
+    def setUp(self):
+        get_page_cache().clear()
+        self.speaker = Speaker.objects.create(name='Henrique Bastos', slug='henrique-bastos',
+                                              url='http://henriquebastos.net')
+        self.talk = Talk.objects.create(title=u'Introdução ao Django', description=u'Views, models; e templates',
+                                        start_time='10:00')
+        self.talk.speakers.add(self.speaker)
+        self.course = Course.objects.create(title=u'Tutorial', start_time='14:00', slots=20, notes='')
+
+    def test_agenda(self):
+        resp = self.client.get(reverse('core:ical'))
+        self.assertEqual('text/calendar; charset=utf-8', resp['Content-Type'])
+        content = resp.content
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\nVERSION:2.0\r\n'))
+        self.assertTrue(content.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(2, content.count('BEGIN:VEVENT'))
+        from datetime import datetime
+        from django.utils import timezone
+        start = timezone.make_aware(datetime(2012, 12, 8, 10), timezone.get_default_timezone())
+        self.assertIn('DTSTART:%s\r\nDTEND:%s\r\n' % (
+            start.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ'),
+            start.astimezone(timezone.utc).strftime('%Y%m%dT%H45%SZ')), content)
+        self.assertIn(u'SUMMARY:Introdução ao Django\r\n'.encode('utf-8'), content)
+        self.assertIn('DESCRIPTION:Views\\, models\; e templates\\n\\nPalestrantes: Henrique Bastos', content)
+        self.assertIn('URL:http://testserver/palestras/%d/' % self.talk.pk, content)
+        self.assertIn('Curso com 20 vagas', content)
+        self.assertIn('CATEGORIES:Curso', content)
+
+    def test_speaker(self):
+        resp = self.client.get(reverse('core:speaker_ical', args=['henrique-bastos']))
+        self.assertEqual(1, resp.content.count('BEGIN:VEVENT'))
+        self.assertNotIn('Tutorial', resp.content)
+        resp = self.client.get(reverse('core:speaker_ical', args=['ninguem']))
+        self.assertEqual(404, resp.status_code)
+
+    def test_uid_domain(self):
+        u'O UID não depende do host pelo qual o arquivo foi pedido.'
+        for host in ('testserver', 'www.outro.com'):
+            content = self.client.get(reverse('core:ical'), HTTP_HOST=host).content
+            self.assertIn('UID:talk-%d@eventex.com.br\r\n' % self.talk.pk, content)
+        with self.settings(ICAL_UID_DOMAIN=None):
+            content = self.client.get(reverse('core:ical')).content
+            self.assertIn('UID:talk-%d@example.com\r\n' % self.talk.pk, content)
+
+    def test_speaker_etag_follows_other_speakers(self):
+        u'Renomear outro palestrante da palestra muda o arquivo e o ETag do palestrante.'
+        other = Speaker.objects.create(name='Outro', slug='outro', url='http://outro.com')
+        self.talk.speakers.add(other)
+        url = reverse('core:speaker_ical', args=['henrique-bastos'])
+        etag = self.client.get(url)['ETag']
+        other.name = u'Outro Nome'
+        other.save()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, resp.status_code)
+        self.assertIn('Outro Nome', resp.content)
+
+    def test_fold(self):
+        from src.core.ical import fold
+        line = fold(u'SUMMARY:' + u'ã' * 60)
+        self.assertTrue(all(len(part) <= 75 for part in line.split('\r\n')))
+        self.assertEqual(u'SUMMARY:' + u'ã' * 60, line.replace('\r\n ', '').rstrip('\r\n').decode('utf-8'))
+
+    @override_settings(PAGE_CACHE_SECONDS=600)
+    def test_cached(self):
+        u'Com o cache ligado, o arquivo pronto e o 304 não consultam o banco.'
+        url = reverse('core:ical')
+        content = self.client.get(url).content
+        with self.assertNumQueries(0):
+            resp = self.client.get(url)
+            self.assertEqual(content, resp.content)
+            resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(304, resp.status_code)
+
+    @override_settings(PAGE_CACHE_SECONDS=600)
+    def test_invalidated(self):
+        url = reverse('core:speaker_ical', args=['henrique-bastos'])
+        etag = self.client.get(url)['ETag']
+        self.talk.title = u'Django avançado'
+        self.talk.save()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, resp.status_code)
+        self.assertIn(u'Django avançado'.encode('utf-8'), resp.content)
+
+
+class ConnectionPoolTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from src.dbpool import ConnectionPool
+        self.path = tempfile.mktemp(suffix='.db')
+        self.pool = ConnectionPool(lambda conn: conn.execute('SELECT 1'), max_size=2, timeout=0.05)
+
+    def tearDown(self):
+        self.pool.clear()
+        os.remove(self.path)
+
+    def connect(self):
+        import sqlite3
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def test_reuse(self):
+        conn = self.pool.checkout(self.connect)
+        self.pool.checkin(conn)
+        self.assertIs(conn, self.pool.checkout(self.connect))
+        self.assertEqual((1, 1, 1), tuple(self.pool.stats()[k] for k in ('created', 'reused', 'in_use')))
+
+    def test_rollback_on_checkin(self):
+        conn = self.pool.checkout(self.connect)
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.commit()
+        conn.execute('INSERT INTO t VALUES (1)')
+        self.pool.checkin(conn)
+        self.assertEqual(0, self.pool.checkout(self.connect).execute('SELECT COUNT(*) FROM t').fetchone()[0])
+
+    def test_bounded(self):
+        from src.dbpool import PoolTimeout
+        self.pool.checkout(self.connect)
+        self.pool.checkout(self.connect)
+        self.assertRaises(PoolTimeout, self.pool.checkout, self.connect)
+        stats = self.pool.stats()
+        self.assertEqual((2, 1, 1), (stats['size'], stats['waits'], stats['timeouts']))
+
+    def test_waits_for_checkin(self):
+        import threading
+        first = self.pool.checkout(self.connect)
+        self.pool.checkout(self.connect)
+        self.pool.timeout = 5
+        threading.Timer(0.05, self.pool.checkin, [first]).start()
+        self.assertIs(first, self.pool.checkout(self.connect))
+
+    def test_max_age(self):
+        self.pool.max_age = 0
+        conn = self.pool.checkout(self.connect)
+        self.pool.checkin(conn)
+        self.assertIsNot(conn, self.pool.checkout(self.connect))
+        self.assertEqual(1, self.pool.stats()['recycled'])
+
+    def test_health_check(self):
+        u'Uma conexão que falha no SELECT 1 é descartada e substituída.'
+        self.pool.check_after = 0
+        conn = self.pool.checkout(self.connect)
+        self.pool.checkin(conn)
+        conn.close()
+        other = self.pool.checkout(self.connect)
+        self.assertIsNot(conn, other)
+        self.assertEqual((1, 2), (self.pool.stats()['broken'], self.pool.stats()['created']))
+
+    def test_backend(self):
+        u'O backend devolve a conexão ao pool no close() e a reaproveita.'
+        from django.db import load_backend
+        from src.dbpool import all_pools
+        settings_dict = {'ENGINE': 'src.dbpool.sqlite3', 'NAME': self.path, 'USER': '', 'PASSWORD': '',
+                         'HOST': '', 'PORT': '', 'OPTIONS': {}, 'TIME_ZONE': None, 'POOL': {'MAX_SIZE': 1}}
+        wrapper = load_backend('src.dbpool.sqlite3').DatabaseWrapper(settings_dict, 'pool-test')
+        wrapper.cursor().execute('SELECT 1')
+        conn = wrapper.connection
+        wrapper.close()
+        self.assertIsNone(wrapper.connection)
+        other = load_backend('src.dbpool.sqlite3').DatabaseWrapper(settings_dict, 'pool-test')
+        other.cursor().execute('SELECT 1')
+        self.assertIs(conn, other.connection)
+        other.close()
+        pool = all_pools()[other.pool_key()]
+        self.assertEqual((1, 1, 1), (pool.stats()['created'], pool.stats()['reused'], pool.max_size))
+        pool.clear()
+
+
+class SQLiteModeTest(TestCase):
+    def test_pragmas(self):
+        import tempfile
+        from django.db import load_backend
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        settings_dict = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path, 'USER': '', 'PASSWORD': '',
+                         'HOST': '', 'PORT': '', 'OPTIONS': {}, 'TIME_ZONE': None}
+        wrapper = load_backend('django.db.backends.sqlite3').DatabaseWrapper(settings_dict, 'pragmas-test')
+        pragmas = {'journal_mode': 'WAL', 'busy_timeout': 1234, 'synchronous': 'NORMAL', 'cache_size': -2000}
+        try:
+            with self.settings(SQLITE_PRAGMAS=pragmas):
+                cursor = wrapper.cursor()
+            values = []
+            for name in ('journal_mode', 'busy_timeout', 'synchronous', 'cache_size'):
+                cursor.execute('PRAGMA %s' % name)
+                values.append(cursor.fetchone()[0])
+            # synchronous=NORMAL é 1.
+            self.assertEqual(['wal', 1234, 1, -2000], values)
+        finally:
+            wrapper.close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    def test_retry_on_lock(self):
+        from django.db import DatabaseError
+        from src.sqlite import retry_on_lock
+        calls = []
+
+        def locked_twice():
+            calls.append(1)
+            if len(calls) < 3:
+                raise DatabaseError('database is locked')
+            return 'ok'
+
+        self.assertEqual('ok', retry_on_lock(locked_twice, retries=3, backoff=0))
+        self.assertEqual(3, len(calls))
+        del calls[:]
+        self.assertRaises(DatabaseError, retry_on_lock, locked_twice, retries=1, backoff=0)
+        self.assertEqual(2, len(calls))
+
+    def test_other_errors_not_retried(self):
+        from django.db import DatabaseError
+        from src.sqlite import retry_on_lock
+        calls = []
+
+        def broken():
+            calls.append(1)
+            raise DatabaseError('no such table: x')
+
+        self.assertRaises(DatabaseError, retry_on_lock, broken, retries=3, backoff=0)
+        self.assertEqual(1, len(calls))
@@ -0,0 +1,208 @@
+# coding: utf-8
+"""
+Miniaturas dos avatares dos palestrantes.
+
+Cada avatar ganha, ao lado do original, variantes quadradas em JPEG nos
+tamanhos de settings.AVATAR_SIZES (palestrantes/foto.jpg ->
+palestrantes/foto_80.jpg, ...). Elas são geradas num pool de threads
+quando o palestrante é salvo, fora do caminho da requisição do admin, e
+pelo comando make_avatar_thumbnails para os avatares já existentes. Os
+tamanhos gerados ficam em Speaker.avatar_sizes, e a tag {% avatar %} usa
+as variantes num srcset sem consultar o storage.
+"""
+import logging
+import os
+import time
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+QUALITY = 85
+
+# Tentativas de gravar os tamanhos num palestrante que ainda não apareceu.
+RETRIES = 5
+RETRY_DELAY = 0.5
+
+_pool = None
+_pool_lock = Lock()
+
+
+def get_sizes():
+    return tuple(sorted(getattr(settings, 'AVATAR_SIZES', (80, 160, 320))))
+
+
+def variant_name(name, size):
+    root, ext = os.path.splitext(name)
+    return '%s_%d.jpg' % (root, size)
+
+
+def render_variants(path, sizes, force=False):
+    """
+    Gera as variantes do arquivo em path e retorna os caminhos gravados.
+    Não toca no banco nem nos settings, para poder rodar num processo à
+    parte. Tamanhos maiores que o lado menor do original são pulados, exceto
+    o menor deles.
+    """
+    from PIL import Image, ImageOps
+
+    targets = [(size, variant_name(path, size)) for size in sizes]
+    if not force:
+        targets = [(size, target) for size, target in targets if not os.path.exists(target)]
+    if not targets:
+        return []
+
+    image = Image.open(path)
+    # Num JPEG grande, decodifica direto numa escala reduzida.
+    largest = max(size for size, target in targets)
+    image.draft('RGB', (largest, largest))
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+
+    written = []
+    smallest = min(sizes)
+    for size, target in targets:
+        if size > min(image.size) and size != smallest:
+            continue
+        thumbnail = ImageOps.fit(image, (size, size), Image.ANTIALIAS)
+        thumbnail.save(target, 'JPEG', quality=QUALITY, optimize=True, progressive=True)
+        written.append(target)
+    return written
+
+
+def available_sizes(path, sizes):
+    """Tamanhos cujas variantes existem ao lado do arquivo em path."""
+    return [size for size in sizes if os.path.exists(variant_name(path, size))]
+
+
+def parse_sizes(value):
+    return [int(size) for size in (value or '').split(',') if size]
+
+
+def render_logged(path, sizes, force=False):
+    try:
+        return render_variants(path, sizes, force)
+    except Exception:
+        logger.exception('Falha ao gerar as miniaturas de %s', path)
+        return []
+
+
+def delete_variants(storage, name):
+    """Apaga as variantes de um avatar que deixou de ser usado."""
+    for size in get_sizes():
+        try:
+            storage.delete(variant_name(name, size))
+        except OSError:
+            logger.exception('Falha ao apagar a miniatura de %s', name)
+
+
+def record_sizes(pk, name, sizes, retries=0):
+    """
+    Grava os tamanhos gerados no palestrante, se o avatar ainda for name, e
+    atualiza updated_at e o cache de páginas para as páginas passarem a usar
+    as variantes. Retorna se o palestrante foi atualizado.
+
+    Um palestrante novo pode ainda não estar visível quando o pool termina,
+    antes do commit do admin; com retries a gravação é tentada de novo.
+    """
+    from django.utils import timezone
+    from src.core.models import Speaker
+    from src.core.pagecache import invalidate_pages
+
+    value = ','.join(str(size) for size in sizes)
+    for attempt in range(retries + 1):
+        updated = Speaker.objects.filter(pk=pk, avatar=name).update(avatar_sizes=value, updated_at=timezone.now())
+        if updated or Speaker.objects.filter(pk=pk).exists():
+            break
+        if attempt < retries:
+            time.sleep(RETRY_DELAY * (attempt + 1))
+    if updated:
+        invalidate_pages()
+    return bool(updated)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(getattr(settings, 'AVATAR_THUMBNAIL_WORKERS', 2))
+        return _pool
+
+
+def render_and_record(pk, name, path, sizes, force=False, retries=0):
+    render_logged(path, sizes, force)
+    available = available_sizes(path, sizes)
+    try:
+        record_sizes(pk, name, available, retries)
+    except Exception:
+        logger.exception('Falha ao gravar as miniaturas de %s', path)
+    return available
+
+
+def run_in_pool(*args):
+    # A thread do pool abre a própria conexão; fecha-a ao terminar.
+    from django.db import connection
+    try:
+        render_and_record(*args, retries=RETRIES)
+    finally:
+        connection.close()
+
+
+def generate(speaker, force=False):
+    """
+    Agenda a geração das variantes do avatar e a gravação dos tamanhos no
+    palestrante. Com AVATAR_THUMBNAIL_WORKERS igual a 0 tudo é feito na hora.
+    """
+    field_file = speaker.avatar
+    if not field_file:
+        return
+    args = (speaker.pk, field_file.name, field_file.path, get_sizes(), force)
+    if getattr(settings, 'AVATAR_THUMBNAIL_WORKERS', 2):
+        get_pool().apply_async(run_in_pool, args)
+    else:
+        speaker.avatar_sizes = ','.join(str(size) for size in render_and_record(*args))
+
+
+def variants(speaker):
+    """
+    Lista (tamanho, url) das variantes já geradas do avatar, a partir dos
+    tamanhos gravados no palestrante, sem consultar o storage.
+    """
+    field_file = speaker.avatar
+    if not field_file:
+        return []
+    storage = field_file.storage
+    return [(size, storage.url(variant_name(field_file.name, size))) for size in parse_sizes(speaker.avatar_sizes)]
+
+
+def remember_avatar(sender, instance, raw=False, **kwargs):
+    """
+    Guarda o avatar anterior do palestrante. Se ele mudou, os tamanhos
+    gravados deixam de valer.
+    """
+    previous = ''
+    if instance.pk and not raw:
+        previous = sender.objects.filter(pk=instance.pk).values_list('avatar', flat=True)
+        previous = (previous[0] if previous else '') or ''
+    instance._previous_avatar = previous
+    if previous != (instance.avatar.name or ''):
+        instance.avatar_sizes = ''
+
+
+def generate_speaker_thumbnails(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_avatar', '')
+    changed = previous != (instance.avatar.name or '')
+    if changed and previous:
+        # Sem isso, um avatar novo com o mesmo nome reaproveitaria as
+        # variantes do antigo.
+        delete_variants(instance.avatar.storage, previous)
+    if instance.avatar and (changed or not instance.avatar_sizes):
+        generate(instance, force=changed)
@@ -5,4 +5,14 @@ urlpatterns = patterns('src.core.views',
     url(r'^palestrantes/(?P<slug>[\w-]+)/$', 'speaker_detail', name='speaker_detail'),
     url(r'^palestras/$', 'talks_agenda', name='talks'),
     url(r'^palestras/(\d+)/$', 'talk_detail', name='talk_detail'),
-)
\ No newline at end of file
+)
+
+urlpatterns += patterns('src.core.api',
+    url(r'^api/palestras/$', 'talks', name='api_talks'),
+    url(r'^api/palestrantes/$', 'speakers', name='api_speakers'),
+)
+
+urlpatterns += patterns('src.core.ical',
+    url(r'^agenda\.ics$', 'agenda', name='ical'),
+    url(r'^palestrantes/(?P<slug>[\w-]+)/agenda\.ics$', 'speaker_agenda', name='speaker_ical'),
+)
@@ -4,17 +4,25 @@ from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
 from django.views.generic.simple import direct_to_template
 
+from src.core.conditional import agenda_state, page_condition, speaker_state, talk_state
 from src.core.models import Speaker, Talk
+from src.core.pagecache import cache_public_page
+from src.core.schedule import get_agenda
 
 
+@cache_public_page
 def homepage(request):
     context = RequestContext(request)
     return render_to_response('index.html', context)
 
+@page_condition(speaker_state)
+@cache_public_page
 def speaker_detail(request, slug):
     speaker = get_object_or_404(Speaker, slug=slug)
     return direct_to_template(request, 'core/speaker_detail.html', {'speaker': speaker})
 
+@page_condition(talk_state)
+@cache_public_page
 def talk_detail(request, pk):
     talk = get_object_or_404(Talk, pk=pk)
 
@@ -22,11 +30,11 @@ def talk_detail(request, pk):
     return direct_to_template(request, 'core/talk_detail.html', {'talk': talk})
 
 
+@page_condition(agenda_state)
+@cache_public_page
 def talks_agenda(request):
-
     context = {
-        'morning_talks': Talk.objects.at_morning(),
-        'afternoon_talks': Talk.objects.at_afternoon(),
+        'periods': get_agenda(),
     }
 
     return direct_to_template(request, 'core/talks.html', context)
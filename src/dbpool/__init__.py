@@ -0,0 +1,273 @@
+# coding: utf-8
+"""
+Pool de conexões com o banco, por processo.
+
+O Django 1.4 abre uma conexão no primeiro acesso de cada requisição e a
+fecha no request_finished. Os backends src.dbpool.postgresql_psycopg2 e
+src.dbpool.sqlite3 trocam esse fechamento pela devolução da conexão a um
+pool, de onde a próxima requisição (de qualquer thread) a retira já pronta:
+sem handshake, autenticação, SET TIME ZONE ou registro de funções.
+
+A configuração fica na chave POOL do banco em settings.DATABASES:
+
+    MAX_SIZE      conexões abertas no máximo, em uso ou ociosas (10)
+    MAX_AGE       segundos até a conexão ser reciclada; None desliga (300)
+    CHECK_AFTER   ociosa há mais que isso, a conexão é testada com um
+                  SELECT 1 antes de ser entregue; 0 testa sempre (30)
+    TIMEOUT       segundos esperando uma conexão livre quando o pool está
+                  cheio, antes de PoolTimeout (10)
+
+Na devolução a transação aberta é desfeita; uma conexão que falha no
+rollback ou no teste é descartada. pool.stats() mostra o tamanho do pool e
+os contadores de conexões criadas, reaproveitadas, recicladas, quebradas e
+de esperas.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.db.utils import DatabaseError
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_SIZE': 10,
+    'MAX_AGE': 300,
+    'CHECK_AFTER': 30,
+    'TIMEOUT': 10,
+}
+
+
+class PoolTimeout(DatabaseError):
+    pass
+
+
+class ConnectionPool(object):
+    """
+    Pool de conexões DB-API. check(conn) levanta exceção se a conexão não
+    serve mais.
+    """
+    def __init__(self, check, max_size=10, max_age=300, check_after=30, timeout=10):
+        self.check = check
+        self.max_size = max_size
+        self.max_age = max_age
+        self.check_after = check_after
+        self.timeout = timeout
+        self.cond = threading.Condition(threading.Lock())
+        # (conexão, criada em, devolvida em); a mais recente fica à direita.
+        self.idle = deque()
+        self.created_at = {}
+        self.counters = dict.fromkeys(('created', 'reused', 'recycled', 'broken', 'waits', 'timeouts'), 0)
+
+    @property
+    def size(self):
+        return len(self.created_at)
+
+    def expired(self, created, now):
+        return self.max_age is not None and now - created > self.max_age
+
+    def checkout(self, connect):
+        """
+        Retira uma conexão ociosa ou, havendo vaga, abre uma nova com
+        connect(). Com o pool cheio, espera até TIMEOUT segundos.
+        """
+        deadline = None
+        while True:
+            with self.cond:
+                conn = self._take_idle()
+                while conn is None and self.size >= self.max_size:
+                    if deadline is None:
+                        self.counters['waits'] += 1
+                        deadline = time.time() + self.timeout
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.counters['timeouts'] += 1
+                        raise PoolTimeout('Nenhuma conexão livre em %s s (%d abertas).' % (self.timeout, self.size))
+                    self.cond.wait(remaining)
+                    conn = self._take_idle()
+                if conn is None:
+                    # Reserva a vaga; a conexão é aberta fora da trava.
+                    placeholder = object()
+                    self.created_at[placeholder] = None
+            if conn is None:
+                return self._open(connect, placeholder)
+
+            # O teste também fica fora da trava.
+            conn, returned = conn
+            if time.time() - returned < self.check_after or self._healthy(conn):
+                with self.cond:
+                    self.counters['reused'] += 1
+                return conn
+            with self.cond:
+                self._discard(conn, 'broken')
+
+    def _take_idle(self):
+        while self.idle:
+            conn, created, returned = self.idle.pop()
+            if not self.expired(created, time.time()):
+                return conn, returned
+            self._discard(conn, 'recycled')
+        return None
+
+    def _open(self, connect, placeholder):
+        try:
+            conn = connect()
+        except Exception:
+            with self.cond:
+                del self.created_at[placeholder]
+                self.cond.notify()
+            raise
+        with self.cond:
+            del self.created_at[placeholder]
+            self.created_at[conn] = time.time()
+            self.counters['created'] += 1
+        return conn
+
+    def checkin(self, conn):
+        try:
+            conn.rollback()
+        except Exception:
+            logger.warning('Conexão descartada: falha no rollback ao devolvê-la ao pool.', exc_info=True)
+            broken = True
+        else:
+            broken = False
+
+        with self.cond:
+            created = self.created_at.get(conn)
+            if created is None:
+                # Não é deste pool (ou já foi descartada pelo clear).
+                self._close(conn)
+            elif broken:
+                self._discard(conn, 'broken')
+            elif self.expired(created, time.time()):
+                self._discard(conn, 'recycled')
+            else:
+                self.idle.append((conn, created, time.time()))
+            self.cond.notify()
+
+    def clear(self):
+        """Fecha as conexões ociosas e esquece as que estão em uso."""
+        with self.cond:
+            while self.idle:
+                self._close(self.idle.pop()[0])
+            self.created_at.clear()
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            stats = dict(self.counters, size=self.size, idle=len(self.idle), max_size=self.max_size)
+        stats['in_use'] = stats['size'] - stats['idle']
+        return stats
+
+    def _healthy(self, conn):
+        try:
+            self.check(conn)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn, reason):
+        self.counters[reason] += 1
+        self.created_at.pop(conn, None)
+        self._close(conn)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Pools herdados num fork: não podem ser fechados no filho, porque o socket
+# é compartilhado com o pai, nem coletados (o que também os fecharia).
+_inherited = []
+_pid = os.getpid()
+
+
+def get_pool(key, factory):
+    global _pid
+    with _pools_lock:
+        if os.getpid() != _pid:
+            _inherited.extend(_pools.values())
+            _pools.clear()
+            _pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = factory()
+        return pool
+
+
+def all_pools():
+    with _pools_lock:
+        return dict(_pools)
+
+
+class PooledDatabaseWrapperMixin(object):
+    """
+    Mixin para o DatabaseWrapper de um backend do Django. As conexões são
+    abertas e configuradas pelo próprio backend e devolvidas ao pool no
+    close(). Bancos SQLite em memória não passam pelo pool, porque cada
+    conexão seria um banco diferente.
+    """
+    def pool_key(self):
+        s = self.settings_dict
+        return (self.alias, s['ENGINE'], s['NAME'], s['USER'], s['HOST'], s['PORT'])
+
+    @property
+    def pool(self):
+        if self.settings_dict['NAME'] in ('', ':memory:'):
+            return None
+        return get_pool(self.pool_key(), self.create_pool)
+
+    def create_pool(self):
+        options = dict(DEFAULTS, **self.settings_dict.get('POOL', {}))
+        return ConnectionPool(self.check_connection, max_size=options['MAX_SIZE'],
+                              max_age=options['MAX_AGE'], check_after=options['CHECK_AFTER'],
+                              timeout=options['TIMEOUT'])
+
+    def new_connection(self):
+        # O _cursor do backend abre e configura self.connection.
+        super(PooledDatabaseWrapperMixin, self)._cursor().close()
+        conn, self.connection = self.connection, None
+        return conn
+
+    @staticmethod
+    def check_connection(conn):
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+
+    def _cursor(self):
+        if self.connection is None:
+            pool = self.pool
+            if pool is not None:
+                self.connection = pool.checkout(self.new_connection)
+        return super(PooledDatabaseWrapperMixin, self)._cursor()
+
+    def close(self):
+        pool = self.pool
+        if pool is None:
+            return super(PooledDatabaseWrapperMixin, self).close()
+        self.validate_thread_sharing()
+        if self.connection is not None:
+            conn, self.connection = self.connection, None
+            pool.checkin(conn)
+
+
+class PooledCreationMixin(object):
+    """
+    Fecha as conexões ociosas do banco de testes antes de destruí-lo (o
+    PostgreSQL não apaga um banco com conexões abertas).
+    """
+    def destroy_test_db(self, old_database_name, verbosity=1):
+        # Enquanto settings_dict ainda aponta para o banco de testes.
+        self.connection.close()
+        pool = self.connection.pool
+        if pool is not None:
+            pool.clear()
+        return super(PooledCreationMixin, self).destroy_test_db(old_database_name, verbosity)
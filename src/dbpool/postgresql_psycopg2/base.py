@@ -0,0 +1,17 @@
+# coding: utf-8
+"""Backend postgresql_psycopg2 do Django com pool de conexões (ver src.dbpool)."""
+from django.db.backends.postgresql_psycopg2.base import *
+from django.db.backends.postgresql_psycopg2.base import DatabaseWrapper as PostgreSQLDatabaseWrapper
+from django.db.backends.postgresql_psycopg2.creation import DatabaseCreation as PostgreSQLDatabaseCreation
+
+from src.dbpool import PooledCreationMixin, PooledDatabaseWrapperMixin
+
+
+class DatabaseCreation(PooledCreationMixin, PostgreSQLDatabaseCreation):
+    pass
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, PostgreSQLDatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.creation = DatabaseCreation(self)
@@ -0,0 +1,366 @@
+# coding: utf-8
+"""
+Instrumentação por requisição, ligada mesmo com DEBUG=False.
+
+O TimingMiddleware mede, em cada requisição, a quantidade e o tempo das
+consultas SQL (e as mais lentas), o tempo de renderização de templates, o
+tempo da view e o total. Os números saem numa linha de log em JSON (logger
+'src.instrumentation') e num histograma por nome de URL mantido em memória,
+de onde saem p50/p95/p99. O cabeçalho Server-Timing, que expõe consultas e
+tempos, só vai para usuários da equipe, para INTERNAL_IPS e com DEBUG.
+
+O tempo de templates vem do TimedLoader, configurado em TEMPLATE_LOADERS
+em volta dos carregadores do projeto; templates compilados direto de uma
+string ficam dentro do tempo da view.
+
+Com INSTRUMENTATION_DUMP_DIR definido, cada processo grava periodicamente
+suas amostras nele; o comando dump_timings junta os arquivos de todos os
+processos e imprime os percentis.
+"""
+import heapq
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.urlresolvers import Resolver404, resolve
+from django.db import connections
+from django.db.backends.util import CursorWrapper
+from django.template.base import TemplateDoesNotExist
+from django.template.loader import get_template_from_string
+from django.template.loaders import cached
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class RecordingCursor(CursorWrapper):
+    """Cursor que soma consultas, tempo de SQL e linhas lidas num QueryRecorder."""
+    def __init__(self, cursor, db, recorder):
+        super(RecordingCursor, self).__init__(cursor, db)
+        self.recorder = recorder
+
+    def execute(self, sql, params=()):
+        return self.recorder.timed(sql, self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self.recorder.timed(sql, self.cursor.executemany, sql, param_list)
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.recorder.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self.cursor.fetchmany(*args)
+        self.recorder.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.recorder.rows += len(rows)
+        return rows
+
+
+class QueryRecorder(object):
+    """
+    Conta consultas, tempo de SQL e linhas lidas em todas as conexões, mesmo
+    com DEBUG=False, usando o gancho make_debug_cursor do Django. Guarda
+    também as `slowest` consultas mais lentas, como pares (segundos, sql).
+
+        with QueryRecorder() as recorder:
+            client.get('/')
+        recorder.queries, recorder.sql_time, recorder.rows
+
+    Pode ser aninhado: o cursor de fora continua recebendo as consultas, e
+    com DEBUG=True o connection.queries do Django também.
+    """
+    def __init__(self, slowest=3):
+        self.queries = self.rows = 0
+        self.sql_time = 0.0
+        self.keep = slowest
+        self.heap = []
+
+    def timed(self, sql, execute, *args):
+        start = time.time()
+        try:
+            return execute(*args)
+        finally:
+            elapsed = time.time() - start
+            self.queries += 1
+            self.sql_time += elapsed
+            if self.keep:
+                push = heapq.heappush if len(self.heap) < self.keep else heapq.heappushpop
+                push(self.heap, (elapsed, sql))
+
+    @property
+    def slowest(self):
+        return sorted(self.heap, reverse=True)
+
+    def wrapper(self, conn):
+        debug = conn.use_debug_cursor or (conn.use_debug_cursor is None and settings.DEBUG)
+        previous = conn.make_debug_cursor
+
+        def make_debug_cursor(cursor):
+            return RecordingCursor(previous(cursor) if debug else cursor, conn, self)
+        return make_debug_cursor
+
+    def __enter__(self):
+        self.saved = []
+        for conn in connections.all():
+            self.saved.append((conn, conn.use_debug_cursor, conn.__dict__.get('make_debug_cursor')))
+            conn.make_debug_cursor = self.wrapper(conn)
+            conn.use_debug_cursor = True
+        return self
+
+    def __exit__(self, *exc_info):
+        for conn, use_debug_cursor, make_debug_cursor in reversed(self.saved):
+            conn.use_debug_cursor = use_debug_cursor
+            if make_debug_cursor is None:
+                del conn.make_debug_cursor
+            else:
+                conn.make_debug_cursor = make_debug_cursor
+
+
+def timed_render(render, context):
+    # Só o template mais externo é cronometrado; includes e extends ficam
+    # dentro do tempo dele. Fora de uma requisição medida, só renderiza.
+    if getattr(_local, 'template_time', None) is None or _local.depth:
+        _local.depth = getattr(_local, 'depth', 0) + 1
+        try:
+            return render(context)
+        finally:
+            _local.depth -= 1
+    _local.depth = 1
+    start = time.time()
+    try:
+        return render(context)
+    finally:
+        _local.depth = 0
+        _local.template_time += time.time() - start
+
+
+class TimedTemplate(object):
+    """
+    Template cujo render() entra no tempo de templates da requisição. Os
+    demais atributos vêm do template original (extends e include usam
+    nodelist e _render).
+    """
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context):
+        return timed_render(self.template.render, context)
+
+
+class TimedLoader(cached.Loader):
+    """
+    Carrega os templates pelos carregadores dados, como o cached.Loader, mas
+    sem o cache, e os entrega como TimedTemplate:
+
+        TEMPLATE_LOADERS = (
+            ('src.instrumentation.TimedLoader', (
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            )),
+        )
+    """
+    def load_template(self, template_name, template_dirs=None):
+        template, origin = self.find_template(template_name, template_dirs)
+        if not hasattr(template, 'render'):
+            try:
+                template = get_template_from_string(template, origin, template_name)
+            except TemplateDoesNotExist:
+                # Como no cached.Loader: devolve o fonte para o erro apontar o
+                # template que falta de fato.
+                return template, origin
+        return TimedTemplate(template), None
+
+
+def show_timing(request):
+    """O Server-Timing expõe consultas e tempos: só para a equipe."""
+    if settings.DEBUG or request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS:
+        return True
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+def percentile(values, p):
+    """Percentil p (0 a 100) de uma lista ordenada, pelo método do posto mais próximo."""
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+def summarize(samples):
+    """Recebe {nome: [ms, ...]} e retorna {nome: {count, p50, p95, p99, max}}."""
+    summary = {}
+    for name, values in samples.items():
+        values = sorted(values)
+        summary[name] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'max': values[-1] if values else None,
+        }
+    return summary
+
+
+class TimingStats(object):
+    """
+    Histograma em memória do tempo total por nome de URL. Guarda as últimas
+    `size` amostras (em ms) de cada nome, o que limita a memória e faz os
+    percentis refletirem o tráfego recente.
+    """
+    def __init__(self, size=1000):
+        self.size = size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+            self.flushed_at = time.time()
+
+    def record(self, name, ms):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.size)
+            self.samples[name].append(ms)
+
+    def snapshot(self):
+        with self.lock:
+            return dict((name, list(values)) for name, values in self.samples.items())
+
+    def summary(self):
+        return summarize(self.snapshot())
+
+    def flush(self, directory):
+        """Grava as amostras deste processo em directory/timings-<pid>.json."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, 'timings-%d.json' % os.getpid())
+        # Grava num temporário e renomeia, para o dump nunca ler meio arquivo.
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.timings-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'pid': os.getpid(), 'time': time.time(), 'samples': self.snapshot()}, f)
+        os.rename(tmp, path)
+        self.flushed_at = time.time()
+
+    def maybe_flush(self):
+        directory = getattr(settings, 'INSTRUMENTATION_DUMP_DIR', None)
+        interval = getattr(settings, 'INSTRUMENTATION_FLUSH_SECONDS', 60)
+        if directory and time.time() - self.flushed_at >= interval:
+            try:
+                self.flush(directory)
+            except (IOError, OSError):
+                logger.exception('Falha ao gravar as amostras em %s', directory)
+
+
+stats = TimingStats()
+
+
+def load_samples(directory):
+    """Junta as amostras gravadas por todos os processos em directory."""
+    samples = {}
+    if not os.path.isdir(directory):
+        return samples
+    for filename in sorted(os.listdir(directory)):
+        if not (filename.startswith('timings-') and filename.endswith('.json')):
+            continue
+        with open(os.path.join(directory, filename)) as f:
+            try:
+                data = json.load(f)
+            except ValueError:
+                continue
+        for name, values in data['samples'].items():
+            samples.setdefault(name, []).extend(values)
+    return samples
+
+
+def url_name(request, view_func):
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        match = None
+    if match is not None and match.url_name:
+        return ':'.join(match.namespaces + [match.url_name])
+    return '%s.%s' % (view_func.__module__, getattr(view_func, '__name__', view_func.__class__.__name__))
+
+
+class TimingMiddleware(object):
+    """
+    Deve ser o primeiro de MIDDLEWARE_CLASSES, para que o total inclua os
+    demais middlewares. O tempo da view vai do process_view até a resposta
+    chegar de volta a este middleware.
+    """
+    def process_request(self, request):
+        recorder = getattr(_local, 'recorder', None)
+        if recorder is not None:
+            # Sobrou de uma requisição que não chegou ao process_response.
+            recorder.__exit__(None, None, None)
+        _local.recorder = QueryRecorder(getattr(settings, 'INSTRUMENTATION_SLOWEST_QUERIES', 3)).__enter__()
+        _local.template_time = 0.0
+        _local.depth = 0
+        request._timing = {'start': time.time(), 'view': None, 'name': None}
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timing = getattr(request, '_timing', None)
+        if timing is not None:
+            timing['name'] = url_name(request, view_func)
+            timing['view'] = time.time()
+
+    def process_response(self, request, response):
+        timing = getattr(request, '_timing', None)
+        recorder = getattr(_local, 'recorder', None)
+        if timing is None or recorder is None:
+            return response
+        recorder.__exit__(None, None, None)
+        now = time.time()
+        template_time, _local.recorder, _local.template_time = _local.template_time, None, None
+
+        total = (now - timing['start']) * 1e3
+        view = (now - timing['view']) * 1e3 if timing['view'] else 0.0
+        sql = recorder.sql_time * 1e3
+        template = template_time * 1e3
+        name = timing['name'] or 'unresolved'
+
+        if show_timing(request):
+            response['Server-Timing'] = ', '.join([
+                'sql;dur=%.2f;desc="%d queries"' % (sql, recorder.queries),
+                'tpl;dur=%.2f' % template,
+                'view;dur=%.2f' % view,
+                'total;dur=%.2f' % total,
+            ])
+
+        stats.record(name, total)
+        stats.maybe_flush()
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'url_name': name,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': round(total, 2),
+                'view_ms': round(view, 2),
+                'template_ms': round(template, 2),
+                'sql_ms': round(sql, 2),
+                'queries': recorder.queries,
+                'rows': recorder.rows,
+                'slowest': [{'ms': round(t * 1e3, 2), 'sql': s} for t, s in recorder.slowest],
+            }, sort_keys=True))
+        return response
@@ -0,0 +1,38 @@
+# coding: utf-8
+"""
+Negociação de Content-Encoding pelo Accept-Encoding (RFC 7231, 5.3.4).
+
+Usada pela API da agenda (src.core.api) e pelos estáticos servidos pelo
+AssetsApplication (src.assets) para decidir se mandam a variante em gzip.
+Procurar "gzip" no cabeçalho não basta: "gzip;q=0" recusa o gzip, e
+"*;q=0.5" o aceita sem citá-lo.
+"""
+
+
+def parse_accept_encoding(header):
+    """Mapeia cada content-coding do cabeçalho para o seu q."""
+    codings = {}
+    for part in header.split(','):
+        params = part.split(';')
+        coding = params[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            name, sep, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    # Um q ilegível não autoriza a codificação.
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def accepts_gzip(header):
+    codings = parse_accept_encoding(header or '')
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in codings:
+            return codings[coding] > 0
+    return False
@@ -0,0 +1,91 @@
+# coding: utf-8
+"""
+Leituras nas réplicas, escritas no primário.
+
+As réplicas são os aliases de settings.REPLICA_DATABASES (criados a partir
+de DATABASE_REPLICA_URLS, ver settings.py). O ReplicaRouter manda para uma
+delas as leituras dos apps de REPLICA_APPS, mas só durante requisições
+GET/HEAD marcadas pelo ReplicaMiddleware; todo o resto (POSTs, comandos,
+sessões e usuários) fica no primário, que também recebe todas as escritas.
+Assim os comandos que leem e depois escrevem, como o send_outbox e o
+import_subscriptions, nunca trabalham sobre dados atrasados.
+
+Leia o que escreveu: depois de um POST o cliente recebe o cookie PIN_COOKIE
+por REPLICA_PIN_SECONDS, e enquanto ele existir as suas leituras também vão
+para o primário. É o que garante que a página de sucesso encontre a
+inscrição recém-criada, mesmo com a réplica atrasada.
+
+O mesmo vale logo depois de qualquer alteração nas páginas públicas: o
+cache de páginas chama use_primary para não guardar dados atrasados sob a
+versão nova (ver src.core.pagecache).
+
+A réplica é sorteada uma vez por requisição, para que uma página não misture
+dados de réplicas em pontos diferentes da replicação. Respostas em streaming
+consultam o banco depois do middleware; as views que as geram fixam o banco
+com using() antes de devolver a resposta.
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+PIN_COOKIE = 'db_pin'
+SAFE_METHODS = ('GET', 'HEAD')
+
+_state = threading.local()
+
+
+def get_replicas():
+    return getattr(settings, 'REPLICA_DATABASES', ())
+
+
+def current_replica():
+    return getattr(_state, 'replica', None)
+
+
+def use_primary():
+    """Manda as próximas leituras desta requisição para o primário."""
+    _state.replica = None
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        replica = current_replica()
+        if replica and model._meta.app_label in getattr(settings, 'REPLICA_APPS', ()):
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplicas são cópias do primário: os objetos podem se relacionar.
+        databases = set([DEFAULT_DB_ALIAS]).union(get_replicas())
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        if db in get_replicas():
+            return False
+        return None
+
+
+class ReplicaMiddleware(object):
+    def process_request(self, request):
+        _state.replica = None
+        replicas = get_replicas()
+        if replicas and request.method in SAFE_METHODS and PIN_COOKIE not in request.COOKIES:
+            _state.replica = random.choice(replicas)
+
+    def process_response(self, request, response):
+        _state.replica = None
+        if get_replicas() and request.method not in SAFE_METHODS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 10),
+                                httponly=True)
+        return response
+
+    def process_exception(self, request, exception):
+        _state.replica = None
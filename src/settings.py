@@ -1,5 +1,7 @@
 # Django settings for src project.
 import os
+import tempfile
+from datetime import date
 
 DEBUG = True
 TEMPLATE_DEBUG = DEBUG
@@ -17,6 +19,48 @@ PROJECT_DIR = Path(__file__).parent
 import dj_database_url
 DATABASES = {'default': dj_database_url.config(default='sqlite:///'+PROJECT_DIR+'/eventex.db')}
 
+# Read replicas, as database URLs separated by spaces. GET requests read the
+# core and subscriptions tables from one of them; everything else uses the
+# primary (see src.routers). Tests run them as mirrors of the primary.
+REPLICA_DATABASES = []
+for i, url in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split()):
+    alias = 'replica%d' % (i + 1)
+    DATABASES[alias] = dict(dj_database_url.parse(url), TEST_MIRROR='default')
+    REPLICA_DATABASES.append(alias)
+DATABASE_ROUTERS = ['src.routers.ReplicaRouter']
+REPLICA_APPS = ('core', 'subscriptions')
+# Seconds a client reads from the primary after a POST (read-your-writes),
+# and that the page cache is filled from the primary after any change to the
+# public pages. Keep it above the worst replication lag.
+REPLICA_PIN_SECONDS = 10
+
+# Keep a bounded pool of connections per process instead of opening one per
+# request (see src.dbpool). DATABASE_POOL=0 falls back to the plain backends.
+# South only knows the stock engine names, hence the adapters.
+SOUTH_DATABASE_ADAPTERS = {}
+if os.environ.get('DATABASE_POOL', '1') != '0':
+    for alias, db in DATABASES.items():
+        backend = db['ENGINE'].rsplit('.', 1)[-1]
+        if db['ENGINE'] == 'django.db.backends.' + backend and backend in ('postgresql_psycopg2', 'sqlite3'):
+            db['ENGINE'] = 'src.dbpool.' + backend
+            db['POOL'] = {'MAX_SIZE': 10, 'MAX_AGE': 300, 'CHECK_AFTER': 30, 'TIMEOUT': 10}
+            SOUTH_DATABASE_ADAPTERS[alias] = 'south.db.' + backend
+
+# Applied to every new SQLite connection (see src.sqlite): WAL lets readers
+# run while a writer commits, and writers wait busy_timeout ms for their turn
+# instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -16000,
+}
+# Write transactions that still hit "database is locked" are retried this
+# many times, backing off from DATABASE_WRITE_BACKOFF seconds.
+DATABASE_WRITE_RETRIES = 3
+DATABASE_WRITE_BACKOFF = 0.05
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -52,6 +96,12 @@ MEDIA_ROOT = PROJECT_DIR.child('media')
 # Examples: "http://media.lawrence.com/media/", "http://example.com/media/"
 MEDIA_URL = '/media/'
 
+# Square JPEG variants generated beside each speaker avatar (see
+# src.core.thumbnails), and the threads that render them after a save.
+# With 0 workers they are rendered inside the request.
+AVATAR_SIZES = (80, 160, 320)
+AVATAR_THUMBNAIL_WORKERS = 2
+
 # Absolute path to the directory static files should be collected to.
 # Don't put anything in this directory yourself; store your static files
 # in apps' "static/" subdirectories and in STATICFILES_DIRS.
@@ -71,6 +121,10 @@ STATICFILES_DIRS = (
     PROJECT_DIR.child('static'),
 )
 
+# collectstatic writes content-hashed, minified and gzipped copies plus a
+# manifest (see src.assets); {% static %} resolves names through it.
+STATICFILES_STORAGE = 'src.assets.AssetStorage'
+
 # List of finder classes that know how to find static files in
 # various locations.
 STATICFILES_FINDERS = (
@@ -83,14 +137,21 @@ STATICFILES_FINDERS = (
 SECRET_KEY = 'bl)%u3gz)_^g#w@*mw^%36sa_)8rh!+a35wd5b$u&amp;^1@x==w6k'
 
 # List of callables that know how to import templates from various sources.
+# TimedLoader measures template rendering for the TimingMiddleware (see
+# src.instrumentation) and loads through the loaders listed inside it.
 TEMPLATE_LOADERS = (
-    'django.template.loaders.filesystem.Loader',
-    'django.template.loaders.app_directories.Loader',
-#     'django.template.loaders.eggs.Loader',
+    ('src.instrumentation.TimedLoader', (
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    #     'django.template.loaders.eggs.Loader',
+    )),
 )
 
 MIDDLEWARE_CLASSES = (
+    # Keep first so that its total covers the other middlewares.
+    'src.instrumentation.TimingMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'src.routers.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -99,6 +160,94 @@ MIDDLEWARE_CLASSES = (
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
 
+CACHES = {
+    'default': {
+        # To share the cache between processes on the same machine use
+        # 'django.core.cache.backends.filebased.FileBasedCache'.
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Full-page cache and the version counter that invalidates it, also used
+    # by the conditional GET states, the JSON API and the iCalendar feeds
+    # (see src.core.pagecache). Every worker must share it, or an edit
+    # handled by one process leaves the others serving stale pages, so
+    # outside DEBUG it is memcached (MEMCACHED_LOCATION, "host:port ...")
+    # or files in PAGE_CACHE_DIR.
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pages',
+    },
+    # Admission control state for the subscribe view. Per process by
+    # default, which is exact for a single process; with several workers
+    # the limits are only shared through memcached (MEMCACHED_LOCATION).
+    'admission': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'admission',
+    },
+}
+
+if os.environ.get('MEMCACHED_LOCATION'):
+    CACHES['pages'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ['MEMCACHED_LOCATION'].split(),
+    }
+    CACHES['admission'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ['MEMCACHED_LOCATION'].split(),
+        'KEY_PREFIX': 'admission',
+    }
+elif not DEBUG:
+    CACHES['pages'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('PAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'eventex-pages')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+PAGE_CACHE_ALIAS = 'pages'
+
+# Admission control for subscription POSTs (see src.subscriptions.admission):
+# a token bucket per client IP, spent only by accepted subscriptions, and a
+# cap on POSTs being processed at once.
+ADMISSION_CACHE = 'admission'
+ADMISSION_BURST = 5
+ADMISSION_RATE = 0.2
+ADMISSION_MAX_CONCURRENT = 8
+# Set to True in multi-process deployments to refuse to start with a
+# per-process ADMISSION_CACHE or without ADMISSION_TRUSTED_PROXIES. A single
+# process (the default SQLite setup) is fine with the local cache.
+ADMISSION_REQUIRE_SHARED_CACHE = False
+# Addresses of the reverse proxies in front of the app ("ip ip ..."), whose
+# X-Forwarded-For is trusted. Without them everyone behind the proxy shares
+# one bucket. A venue behind NAT also shares one address: raise
+# ADMISSION_BURST for on-site registration.
+if 'ADMISSION_TRUSTED_PROXIES' in os.environ:
+    ADMISSION_TRUSTED_PROXIES = os.environ['ADMISSION_TRUSTED_PROXIES'].split()
+else:
+    ADMISSION_TRUSTED_PROXIES = None
+
+# Seconds public pages stay in the full-page cache (see src.core.pagecache).
+# Disabled while developing so that changes show up right away.
+PAGE_CACHE_SECONDS = 0 if DEBUG else 60 * 10
+
+# Default number of items per page in the JSON agenda API (see src.core.api).
+API_PAGE_SIZE = 100
+
+# Talks only store their start time: the iCalendar feeds (see src.core.ical)
+# place them on EVENT_DATE, each lasting TALK_DURATION_MINUTES.
+EVENT_DATE = date(2012, 12, 8)
+TALK_DURATION_MINUTES = 60
+# Domain in the event UIDs, which must not change with the host the feed was
+# fetched from. Falls back to the current Site when empty.
+ICAL_UID_DOMAIN = 'eventex.com.br'
+
+# Request instrumentation (see src.instrumentation). When
+# INSTRUMENTATION_DUMP_DIR is set (off by default), each process writes its
+# samples there every INSTRUMENTATION_FLUSH_SECONDS and `manage.py
+# dump_timings` merges them. The Server-Timing header only goes to staff
+# users, to INTERNAL_IPS and when DEBUG is on.
+INTERNAL_IPS = ()
+INSTRUMENTATION_DUMP_DIR = os.environ.get('INSTRUMENTATION_DUMP_DIR')
+INSTRUMENTATION_FLUSH_SECONDS = 60
+INSTRUMENTATION_SLOWEST_QUERIES = 3
+
 ROOT_URLCONF = 'src.urls'
 
 # Python dotted path to the WSGI application used by Django's runserver.
@@ -130,6 +279,9 @@ INSTALLED_APPS = (
     'src.subscriptions',
 )
 
+# Django's runner, with the per-request instrumentation log quieted.
+TEST_RUNNER = 'src.testrunner.TestRunner'
+
 # A sample logging configuration. The only tangible logging
 # performed by this configuration is to send an email to
 # the site admins on every HTTP 500 error when DEBUG=False.
@@ -143,11 +295,21 @@ LOGGING = {
             '()': 'django.utils.log.RequireDebugFalse'
         }
     },
+    'formatters': {
+        'timestamped': {
+            'format': '%(asctime)s %(name)s %(levelname)s %(message)s'
+        }
+    },
     'handlers': {
         'mail_admins': {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
             'class': 'django.utils.log.AdminEmailHandler'
+        },
+        'console': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+            'formatter': 'timestamped',
         }
     },
     'loggers': {
@@ -156,6 +318,13 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        # One JSON line per request with SQL, template and view timings.
+        # src.testrunner quiets it while running the test suite.
+        'src.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
 
@@ -0,0 +1,75 @@
+# coding: utf-8
+"""
+Modo de produção do SQLite.
+
+Os eventos pequenos rodam no SQLite padrão de settings.DATABASES. No modo
+de journal padrão (DELETE) quem escreve bloqueia quem lê durante o commit,
+e inscrições simultâneas terminam em "database is locked". apply_pragmas,
+ligado ao connection_created em core/models.py, configura cada conexão
+nova com settings.SQLITE_PRAGMAS:
+
+    journal_mode=WAL    leitores leem o último commit enquanto um escritor
+                        grava no log; só escritores se enfileiram
+    busy_timeout        milissegundos esperando a vez de escrever, em vez
+                        de falhar na hora
+    synchronous=NORMAL  no WAL, fsync só nos checkpoints; um commit pode se
+                        perder numa queda de energia, mas o banco não
+                        se corrompe
+    mmap_size           bytes do arquivo lidos por mmap, sem cópia
+    cache_size          páginas em cache por conexão (negativo: em KiB)
+
+Bancos em memória não têm WAL e ficam de fora.
+
+Mesmo com o busy_timeout, o SQLite devolve "database is locked" na hora
+quando uma transação que começou lendo tenta escrever depois de outro
+commit (não há como esperar sem violar o isolamento). retry_on_lock repete
+a transação inteira nesses casos.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+
+
+# A ordem importa: o journal_mode vem antes dos demais.
+PRAGMA_ORDER = ('journal_mode', 'busy_timeout', 'synchronous', 'mmap_size', 'cache_size')
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or connection.settings_dict['NAME'] in ('', ':memory:'):
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    names = [name for name in PRAGMA_ORDER if name in pragmas]
+    names += sorted(name for name in pragmas if name not in PRAGMA_ORDER)
+    cursor = connection.connection.cursor()
+    for name in names:
+        # Valores vêm dos settings; PRAGMA não aceita parâmetros.
+        cursor.execute('PRAGMA %s = %s' % (name, pragmas[name]))
+    cursor.close()
+
+
+def is_locked(error):
+    return 'database is locked' in str(error) or 'database table is locked' in str(error)
+
+
+def retry_on_lock(func, retries=None, backoff=None):
+    """
+    Executa func() e, se ela falhar com "database is locked", executa de
+    novo, até settings.DATABASE_WRITE_RETRIES vezes, esperando backoff * 2^n
+    segundos (com variação aleatória) entre as tentativas. func deve abrir
+    e fechar a própria transação.
+    """
+    if retries is None:
+        retries = getattr(settings, 'DATABASE_WRITE_RETRIES', 3)
+    if backoff is None:
+        backoff = getattr(settings, 'DATABASE_WRITE_BACKOFF', 0.05)
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except DatabaseError as e:
+            if attempt >= retries or not is_locked(e):
+                raise
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            attempt += 1
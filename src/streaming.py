@@ -0,0 +1,27 @@
+# coding: utf-8
+"""
+Respostas em streaming que consultam o banco.
+
+O WSGIHandler do Django 1.4 envia o request_finished, que fecha as conexões,
+antes de percorrer o corpo da resposta. Um gerador que consulta o banco
+enquanto é percorrido (o export do admin, os arquivos iCalendar) reabre a
+conexão depois dessa limpeza, e ela ficaria presa: fora do pool até a
+próxima requisição da mesma thread e, no PostgreSQL, "idle in transaction".
+"""
+from django.db import connections, transaction
+
+
+def release_connection(iterable, using):
+    """
+    Repassa iterable. Se a conexão de using estava fechada quando a
+    iteração começou, ela foi reaberta aqui: ao terminar, ou se o gerador
+    for fechado no meio, a transação é desfeita e a conexão fechada.
+    """
+    reopened = connections[using].connection is None
+    try:
+        for item in iterable:
+            yield item
+    finally:
+        if reopened:
+            transaction.rollback_unless_managed(using=using)
+            connections[using].close()
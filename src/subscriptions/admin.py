@@ -1,10 +1,140 @@
 # coding: utf-8
+import csv
+from datetime import datetime
+from hashlib import md5
 from django.conf.urls import patterns, url
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import router
+from django.db.models import Q
 from django.http import HttpResponse
-from django.utils.datetime_safe import datetime
+from django.shortcuts import render_to_response
+from django.template import RequestContext
+from django.utils import timezone
 from django.utils.translation import ungettext, ugettext as _
+from src.streaming import release_connection
+from .forms import PaymentFileForm
+from .importer import read_csv
 from .models import Subscription
+from .reconciliation import PaymentReconciler
+from .search import search
+
+
+class Echo(object):
+    """
+    Pseudo-buffer para o csv.writer: devolve a linha escrita em vez de
+    acumulá-la, permitindo gerar o arquivo linha a linha.
+    """
+    def write(self, value):
+        return value
+
+
+CURSOR_VAR = 'apos'
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def cached_count(queryset, timeout):
+    """
+    COUNT(*) guardado no cache por alguns segundos, indexado pelo SQL da
+    consulta. Numa tabela grande o número exato não vale o custo por página.
+    """
+    key = 'subscriptions:count:%s' % md5(unicode(queryset.query).encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def format_cursor(obj):
+    """Cursor da paginação keyset: created_at (UTC) e id da última linha."""
+    created_at = obj.created_at.astimezone(timezone.utc)
+    return '%s_%d' % (created_at.strftime(CURSOR_FORMAT), obj.pk)
+
+
+def parse_cursor(value):
+    try:
+        created_at, pk = value.split('_')
+        created_at = datetime.strptime(created_at, CURSOR_FORMAT).replace(tzinfo=timezone.utc)
+        return created_at, int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+class CachedCountPaginator(Paginator):
+    def __init__(self, object_list, per_page, count_timeout=60, **kwargs):
+        super(CachedCountPaginator, self).__init__(object_list, per_page, **kwargs)
+        self.count_timeout = count_timeout
+
+    def _get_count(self):
+        if self._count is None:
+            self._count = cached_count(self.object_list, self.count_timeout)
+        return self._count
+    count = property(_get_count)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Changelist para tabelas grandes. Na ordenação padrão (-created_at, -id)
+    as páginas são buscadas por keyset, a partir do cursor ?apos=, em vez de
+    OFFSET; as contagens vêm do cache. Com outra ordenação, volta à paginação
+    do admin, ainda com contagens em cache. A busca usa src.subscriptions.search.
+    """
+    def get_query_set(self, request):
+        # O cursor não é um filtro: tira de self.params antes que o admin
+        # tente aplicá-lo ao queryset.
+        self.cursor = parse_cursor(self.params.pop(CURSOR_VAR, None))
+
+        # A busca vai pelas colunas indexadas (search.py) em vez do
+        # icontains do admin sobre cada um dos search_fields.
+        query, self.query = self.query, ''
+        qs = super(KeysetChangeList, self).get_query_set(request)
+        self.query = query
+        return search(qs, query)
+
+    def get_results(self, request):
+        timeout = self.model_admin.count_cache_timeout
+        self.keyset = ORDER_VAR not in self.params
+
+        if not self.keyset:
+            super(KeysetChangeList, self).get_results(request)
+        else:
+            paginator = self.model_admin.get_paginator(request, self.query_set, self.list_per_page)
+            qs = self.query_set
+            if self.cursor:
+                created_at, pk = self.cursor
+                qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+            result_list = list(qs[:self.list_per_page + 1])
+
+            self.next_cursor = None
+            if len(result_list) > self.list_per_page:
+                result_list = result_list[:self.list_per_page]
+                self.next_cursor = format_cursor(result_list[-1])
+
+            self.result_count = paginator.count
+            if self.query_set.query.where:
+                self.full_result_count = cached_count(self.root_query_set, timeout)
+            else:
+                self.full_result_count = self.result_count
+            self.result_list = result_list
+            self.can_show_all = False
+            self.multi_page = bool(self.cursor or self.next_cursor)
+            self.paginator = paginator
+
+        # "Hoje" é calculado uma vez por requisição, no fuso local.
+        today = timezone.localtime(timezone.now()).date()
+        self.result_list = list(self.result_list)
+        for obj in self.result_list:
+            obj.is_today = timezone.localtime(obj.created_at).date() == today
+
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor}, [PAGE_VAR])
+
+    def first_page_url(self):
+        return self.get_query_string(remove=[CURSOR_VAR, PAGE_VAR])
 
 
 class SubscriptionAdmin(admin.ModelAdmin):
@@ -13,6 +143,23 @@ class SubscriptionAdmin(admin.ModelAdmin):
     search_fields = ('name', 'email', 'phone', 'created_at')
     list_filter = ['created_at']
     actions = ['mark_as_paid']
+    ordering = ('-created_at', '-id')
+
+    # Modo para grandes volumes: paginação por keyset e contagens em cache.
+    high_volume = True
+    count_cache_timeout = 60
+
+    def get_changelist(self, request, **kwargs):
+        if self.high_volume:
+            return KeysetChangeList
+        return super(SubscriptionAdmin, self).get_changelist(request, **kwargs)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if self.high_volume:
+            return CachedCountPaginator(queryset, per_page, count_timeout=self.count_cache_timeout,
+                                        orphans=orphans, allow_empty_first_page=allow_empty_first_page)
+        return super(SubscriptionAdmin, self).get_paginator(request, queryset, per_page, orphans,
+                                                            allow_empty_first_page)
 
     def mark_as_paid(self, request, queryset):
         count = queryset.update(paid = True)
@@ -27,7 +174,9 @@ class SubscriptionAdmin(admin.ModelAdmin):
 
 
     def subscribed_today(self, obj):
-        return obj.created_at.date() == datetime.today().date()
+        if hasattr(obj, 'is_today'):
+            return obj.is_today
+        return timezone.localtime(obj.created_at).date() == timezone.localtime(timezone.now()).date()
     subscribed_today.short_description = _(u'Inscrito hoje?')
     subscribed_today.boolean = True
 
@@ -36,18 +185,68 @@ class SubscriptionAdmin(admin.ModelAdmin):
         extra_url = patterns('',
             # Envolvemos nossa view em admin_view, por que ela faz o controle de permissões e cache automaticamente
             # para nós.
-            url(r'exportar-inscricoes/$', self.admin_site.admin_view(self.export_subscriptions), name='export_subscriptions')
+            url(r'exportar-inscricoes/$', self.admin_site.admin_view(self.export_subscriptions), name='export_subscriptions'),
+            url(r'conciliar-pagamentos/$', self.admin_site.admin_view(self.reconcile_payments), name='reconcile_payments'),
         )
         #
         return extra_url + original_urls
 
-    def export_subscriptions(self, request):
-        subscriptions = self.model.objects.all()
-        rows = [','.join([s.name, s.email, s.phone ]) for s in subscriptions]
+    export_fields = ('name', 'email', 'phone')
+    export_chunk_size = 2000
 
-        response = HttpResponse('\r\n'.join(rows), content_type='text/csv')
+    def iter_export_rows(self, using=None):
+        """
+        Percorre a tabela em blocos ordenados por pk (keyset), buscando apenas
+        as colunas exportadas como tuplas, e gera as linhas do csv uma a uma.
+        A memória usada não depende do tamanho da tabela.
+        """
+        writer = csv.writer(Echo())
+        last_pk = 0
+        while True:
+            chunk = list(self.model.objects.using(using)
+                         .filter(pk__gt=last_pk)
+                         .order_by('pk')
+                         .values_list('pk', *self.export_fields)[:self.export_chunk_size])
+            if not chunk:
+                break
+            for row in chunk:
+                yield writer.writerow([value.encode('utf-8') for value in row[1:]])
+            last_pk = chunk[-1][0]
+
+    def export_subscriptions(self, request):
+        # As linhas são lidas depois que a view retorna: o banco (a réplica
+        # desta requisição, ver src.routers) é escolhido agora, e a conexão
+        # reaberta para lê-las é fechada no fim (ver src.streaming).
+        using = router.db_for_read(self.model)
+        response = HttpResponse(release_connection(self.iter_export_rows(using=using), using),
+                                content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename=inscricoes.csv'
 
         return response
 
+    reconcile_report_limit = 200
+
+    def reconcile_payments(self, request):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+
+        form = PaymentFileForm(request.POST or None, request.FILES or None)
+        context = {'form': form, 'opts': self.model._meta, 'title': _(u'Conciliar pagamentos')}
+
+        if form.is_valid():
+            # Na tela mostramos apenas as primeiras linhas não conciliadas; o
+            # comando reconcile_payments gera o relatório completo.
+            problems = []
+            def report(row, status):
+                if len(problems) < self.reconcile_report_limit:
+                    problems.append((status, row.get('cpf'), row.get('email')))
+
+            reconciler = PaymentReconciler()
+            context['counts'] = reconciler.run(read_csv(form.cleaned_data['file']), report)
+            context['updated'] = reconciler.updated
+            context['problems'] = problems
+
+        return render_to_response('admin/subscriptions/reconcile_payments.html', context,
+                                  RequestContext(request))
+
 admin.site.register(Subscription, SubscriptionAdmin)
@@ -0,0 +1,177 @@
+# coding: utf-8
+"""
+Controle de admissão dos POSTs de inscrição.
+
+Antes de validar o formulário (consultas) e gravar a inscrição, cada POST
+passa por duas barreiras baratas, ambas guardadas no cache
+settings.ADMISSION_CACHE:
+
+- um balde de fichas por cliente (IP): ADMISSION_BURST fichas, repostas a
+  ADMISSION_RATE por segundo. Sem ficha, a resposta é 429 com Retry-After.
+  Só as inscrições aceitas gastam ficha; um formulário com erro pode ser
+  corrigido e reenviado. O balde é lido e gravado sem trava, então sob
+  concorrência o mesmo cliente pode passar um pouco do limite; para robôs
+  e cliques repetidos isso basta;
+- um limite global de POSTs em andamento (ADMISSION_MAX_CONCURRENT): cada
+  POST ocupa uma das vagas com cache.add, e cada vaga expira sozinha.
+  Sem vaga a resposta é um 503 curto com Retry-After, em vez de a
+  requisição esperar na fila dos workers.
+
+Atrás de um proxy, REMOTE_ADDR é o do proxy e todos cairiam no mesmo
+balde: os endereços dos proxies confiáveis vão em
+ADMISSION_TRUSTED_PROXIES, e o cliente passa a ser o último endereço do
+X-Forwarded-For que não é de um deles.
+
+O backend padrão é o LocMemCache, em memória e por processo: exato num
+processo só, como na instalação padrão com SQLite, mas com vários workers
+os limites se multiplicam pelo número de processos. Nesse caso, ligue
+ADMISSION_REQUIRE_SHARED_CACHE: check_admission_cache, chamado ao carregar
+subscriptions/models.py, passa a exigir um cache compartilhado, como
+memcached, e a lista de proxies explícita.
+"""
+import random
+import time
+from functools import wraps
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+
+
+SLOT_KEY = 'admission:slot:%d'
+# Um worker que morre segurando uma vaga a perde depois deste tempo, sem
+# afetar as demais.
+SLOT_TIMEOUT = 60
+
+
+def get_admission_cache():
+    return get_cache(getattr(settings, 'ADMISSION_CACHE', 'default'))
+
+
+def check_admission_cache():
+    if not getattr(settings, 'ADMISSION_REQUIRE_SHARED_CACHE', False):
+        return
+    if not (getattr(settings, 'ADMISSION_RATE', None) or getattr(settings, 'ADMISSION_MAX_CONCURRENT', None)):
+        return
+    if isinstance(get_admission_cache(), LocMemCache):
+        raise ImproperlyConfigured(u'O cache do controle de admissão (ADMISSION_CACHE) é local ao processo; '
+                                   u'use um cache compartilhado, como memcached.')
+    if getattr(settings, 'ADMISSION_TRUSTED_PROXIES', None) is None:
+        raise ImproperlyConfigured(u'Defina ADMISSION_TRUSTED_PROXIES com os endereços dos proxies '
+                                   u'(vazio se não houver nenhum).')
+
+
+def client_id(request):
+    """
+    Endereço do cliente. Se a requisição veio de um proxy confiável, é o
+    último endereço do X-Forwarded-For que não é de um proxy confiável; os
+    anteriores foram escritos pelo próprio cliente.
+    """
+    trusted = getattr(settings, 'ADMISSION_TRUSTED_PROXIES', None) or ()
+    address = request.META.get('REMOTE_ADDR', '')
+    if address in trusted:
+        forwarded = [a.strip() for a in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if a.strip()]
+        while forwarded and address in trusted:
+            address = forwarded.pop()
+    return address
+
+
+def bucket_key(client):
+    return 'admission:bucket:%s' % md5(client).hexdigest()
+
+
+def fill_level(cache, client, rate, burst, now):
+    """Fichas no balde do cliente em now, já com as repostas desde a última retirada."""
+    tokens, stamp = cache.get(bucket_key(client)) or (burst, now)
+    return min(burst, tokens + (now - stamp) * rate)
+
+
+def check_token(cache, client, rate, burst, now=None):
+    """Retorna 0 se o balde do cliente tem ficha, ou os segundos até a próxima."""
+    tokens = fill_level(cache, client, rate, burst, now or time.time())
+    return (1 - tokens) / rate if tokens < 1 else 0
+
+
+def take_token(cache, client, rate, burst, now=None):
+    """Retira uma ficha do balde do cliente. Retorna 0 ou os segundos até a próxima ficha."""
+    now = now or time.time()
+    tokens = fill_level(cache, client, rate, burst, now)
+    if tokens < 1:
+        return (1 - tokens) / rate
+    # O balde expira quando estaria cheio de novo.
+    cache.set(bucket_key(client), (tokens - 1, now), int(burst / rate) + 1)
+    return 0
+
+
+def acquire_slot(cache, limit):
+    """
+    Ocupa uma das limit vagas e retorna o par (chave, dono) a devolver em
+    release_slot, ou None se estão todas ocupadas. As vagas livres são
+    tentadas em ordem aleatória para que POSTs simultâneos não disputem a
+    mesma chave.
+    """
+    keys = [SLOT_KEY % i for i in range(limit)]
+    taken = cache.get_many(keys)
+    free = [key for key in keys if key not in taken]
+    random.shuffle(free)
+    owner = uuid4().hex
+    for key in free:
+        if cache.add(key, owner, SLOT_TIMEOUT):
+            return key, owner
+    return None
+
+
+def release_slot(cache, slot):
+    key, owner = slot
+    # Se a vaga expirou e foi ocupada por outro POST, ela é dele.
+    if cache.get(key) == owner:
+        cache.delete(key)
+
+
+def try_again(status, seconds):
+    response = HttpResponse(u'Muitas inscrições neste momento. Tente novamente em alguns segundos.',
+                            content_type='text/plain; charset=utf-8', status=status)
+    response['Retry-After'] = str(max(int(seconds + 0.999), 1))
+    return response
+
+
+def admission_control(view):
+    """
+    Aplica o balde por cliente e o limite de concorrência aos POSTs da
+    view. GETs passam direto.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return view(request, *args, **kwargs)
+
+        cache = get_admission_cache()
+        client = client_id(request)
+        rate = getattr(settings, 'ADMISSION_RATE', None)
+        burst = getattr(settings, 'ADMISSION_BURST', 5)
+        if rate:
+            wait = check_token(cache, client, rate, burst)
+            if wait:
+                return try_again(429, wait)
+
+        limit = getattr(settings, 'ADMISSION_MAX_CONCURRENT', None)
+        slot = None
+        if limit:
+            slot = acquire_slot(cache, limit)
+            if not slot:
+                return try_again(503, 1)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            if slot:
+                release_slot(cache, slot)
+        # Só a inscrição aceita (redirecionada para a página de sucesso)
+        # gasta a ficha.
+        if rate and response.status_code == 302:
+            take_token(cache, client, rate, burst)
+        return response
+    return wrapper
@@ -2,7 +2,7 @@
 from django import forms
 from django.core.exceptions import ValidationError
 from django.core.validators import EMPTY_VALUES
-from .models import Subscription
+from .models import Subscription, normalize_email
 from django.utils.translation import ungettext, ugettext as _
 
 
@@ -13,7 +13,9 @@ def CpfValidator(value):
         raise ValidationError(_(u'O CPF deve ter 11 dígitos'))
 
 def EmailValidator(value):
-    if (not (value in EMPTY_VALUES)) and Subscription.objects.filter(email=value).count()>0:
+    if value in EMPTY_VALUES:
+        return
+    if Subscription.objects.filter(email_normalized=normalize_email(value)).exists():
         raise ValidationError(_(u'Email já cadastrado.'))
 
 class PhoneWidget(forms.MultiWidget):
@@ -72,3 +74,6 @@ class SubscriptionForm(forms.ModelForm):
         return self.cleaned_data
 
 
+class PaymentFileForm(forms.Form):
+    file = forms.FileField(label=_(u'Extrato de pagamentos (CSV com as colunas cpf e/ou email)'))
+
@@ -0,0 +1,177 @@
+# coding: utf-8
+import csv
+import json
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils.translation import ugettext as _
+
+from .forms import CpfValidator, PhoneField
+from .models import SearchToken, Subscription
+
+
+FIELDS = ('name', 'cpf', 'email', 'phone')
+
+
+def decode(value):
+    # Planilhas e extratos de banco costumam vir em cp1252, não em UTF-8.
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value.decode('cp1252', 'replace')
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        yield dict((k, decode(v or '')) for k, v in row.iteritems() if k)
+
+
+class InvalidRow(dict):
+    """Linha que nem chegou a virar um dicionário; vai direto para reject."""
+    def __init__(self, errors):
+        super(InvalidRow, self).__init__()
+        self.errors = errors
+
+
+def read_jsonl(stream):
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield InvalidRow([_(u'Linha %d: JSON inválido.') % number])
+            continue
+        if isinstance(row, dict):
+            yield row
+        else:
+            yield InvalidRow([_(u'Linha %d: esperado um objeto JSON.') % number])
+
+
+class SubscriptionImporter(object):
+    """
+    Importa inscrições em lote a partir de um iterável de dicionários.
+
+    As linhas são validadas com as mesmas regras do SubscriptionForm (CPF,
+    e-mail, telefone), os duplicados são verificados por bloco com uma
+    consulta por coluna, e cada bloco é inserido com bulk_create numa única
+    transação. As linhas recusadas são entregues a reject(row, errors).
+    """
+    name_field = Subscription._meta.get_field('name')
+
+    def __init__(self, reject, chunk_size=500, insert_batch=100):
+        # O SQLite aceita no máximo 999 parâmetros por consulta: chunk_size
+        # limita os "IN (...)" e insert_batch os INSERTs com várias linhas.
+        self.reject = reject
+        self.chunk_size = chunk_size
+        self.insert_batch = insert_batch
+        self.email_field = forms.EmailField(required=False)
+        self.phone_field = PhoneField(required=False)
+        self.imported = self.rejected = 0
+
+    def run(self, rows):
+        chunk = []
+        for row in rows:
+            subscription = self.validate(row)
+            if subscription is not None:
+                chunk.append((row, subscription))
+            if len(chunk) == self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self.imported, self.rejected
+
+    def fail(self, row, errors):
+        self.rejected += 1
+        self.reject(row, errors)
+
+    def validate(self, row):
+        if isinstance(row, InvalidRow):
+            self.fail(row, row.errors)
+            return None
+        values, errors = {}, []
+        for f in FIELDS:
+            value = row.get(f)
+            if value is None:
+                value = u''
+            elif isinstance(value, (int, long)) and not isinstance(value, bool):
+                # JSON traz CPF e telefone como número às vezes.
+                value = unicode(value)
+            elif not isinstance(value, basestring):
+                errors.append(_(u'Valor inválido para %s.') % f)
+                value = u''
+            values[f] = value.strip()
+
+        try:
+            self.name_field.clean(values['name'], None)
+        except ValidationError, e:
+            errors.extend(e.messages)
+        try:
+            CpfValidator(values['cpf'])
+        except ValidationError, e:
+            errors.extend(e.messages)
+        try:
+            values['email'] = self.email_field.clean(values['email'])
+        except ValidationError, e:
+            errors.extend(e.messages)
+        try:
+            values['phone'] = self.phone_field.clean(values['phone'].split('-', 1) if values['phone'] else [])
+        except ValidationError, e:
+            errors.extend(e.messages)
+
+        if not errors and not values['email'] and not values['phone']:
+            errors.append(_(u'Informe seu e-mail ou telefone.'))
+
+        if errors:
+            self.fail(row, errors)
+            return None
+        subscription = Subscription(**values)
+        subscription.normalize()
+        return subscription
+
+    def import_chunk(self, chunk):
+        cpfs = set(s.cpf for row, s in chunk)
+        emails = set(s.email_normalized for row, s in chunk if s.email_normalized)
+        taken_cpfs = set(Subscription.objects.filter(cpf__in=cpfs).values_list('cpf', flat=True))
+        taken_emails = set(Subscription.objects.filter(email_normalized__in=emails)
+                           .values_list('email_normalized', flat=True))
+
+        accepted = []
+        for row, s in chunk:
+            if s.cpf in taken_cpfs:
+                self.fail(row, [_(u'CPF já cadastrado.')])
+            elif s.email_normalized and s.email_normalized in taken_emails:
+                self.fail(row, [_(u'Email já cadastrado.')])
+            else:
+                taken_cpfs.add(s.cpf)
+                if s.email_normalized:
+                    taken_emails.add(s.email_normalized)
+                accepted.append((row, s))
+
+        try:
+            with transaction.commit_on_success():
+                self.insert([s for row, s in accepted])
+        except IntegrityError:
+            # Alguém inseriu o mesmo CPF entre a verificação e o INSERT:
+            # refaz o bloco linha a linha para isolar as recusadas.
+            for row, s in accepted:
+                try:
+                    with transaction.commit_on_success():
+                        self.insert([s])
+                except IntegrityError:
+                    self.fail(row, [_(u'CPF já cadastrado.')])
+                else:
+                    self.imported += 1
+        else:
+            self.imported += len(accepted)
+
+    def insert(self, subscriptions):
+        for i in range(0, len(subscriptions), self.insert_batch):
+            batch = subscriptions[i:i + self.insert_batch]
+            Subscription.objects.bulk_create(batch)
+            # O bulk_create não devolve os pks: os tokens de busca são
+            # gravados a partir das linhas inseridas.
+            inserted = Subscription.objects.filter(cpf__in=[s.cpf for s in batch])
+            SearchToken.objects.index(inserted.values_list('pk', 'name', 'email'), replace=False)
@@ -0,0 +1,78 @@
+# coding: utf-8
+import logging
+import threading
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from src.bench import test_database
+from src.instrumentation import percentile
+from src.subscriptions.admission import get_admission_cache
+
+
+class Command(BaseCommand):
+    help = (u'Teste de carga do POST de inscrição: várias threads, cada uma um cliente, '
+            u'postando ao mesmo tempo, com e sem o limite de concorrência. Mostra a '
+            u'latência (p50/p95/p99) e as respostas de cada rodada.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', default=32),
+        make_option('--requests', type='int', default=20, help=u'POSTs por thread.'),
+        make_option('--max-concurrent', type='int', default=4,
+                    help=u'Limite de POSTs simultâneos na rodada com controle de admissão.'),
+    )
+
+    def run(self, threads, requests, counter):
+        url = reverse('subscriptions:subscribe')
+        latencies, statuses = [], {}
+        lock = threading.Lock()
+
+        def worker(n):
+            client = Client(REMOTE_ADDR='10.0.%d.%d' % (n // 250, n % 250 + 1))
+            for i in xrange(requests):
+                with lock:
+                    k = counter.next()
+                data = {'name': 'Carga %d' % k, 'cpf': '8%010d' % k, 'email': 'carga%d@mail.com' % k,
+                        'phone_0': '21', 'phone_1': '99998888'}
+                start = time.time()
+                try:
+                    status = client.post(url, data).status_code
+                finally:
+                    # O que o request_finished faz fora do cliente de teste:
+                    # a conexão volta ao pool a cada requisição.
+                    connection.close()
+                elapsed = time.time() - start
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in xrange(threads)]
+        start = time.time()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return time.time() - start, sorted(latencies), statuses
+
+    def handle(self, *args, **options):
+        logging.getLogger('src.instrumentation').setLevel(logging.WARNING)
+        rounds = [('sem limite', None), ('com limite de %d' % options['max_concurrent'], options['max_concurrent'])]
+
+        # Compartilhado entre as rodadas, para que nenhum CPF ou e-mail se repita.
+        counter = iter(xrange(10 ** 9))
+
+        with test_database(shared=True):
+            for label, limit in rounds:
+                get_admission_cache().clear()
+                # Cada thread é um cliente diferente: o balde por IP não interfere.
+                with override_settings(ADMISSION_MAX_CONCURRENT=limit, ADMISSION_RATE=None):
+                    elapsed, latencies, statuses = self.run(options['threads'], options['requests'], counter)
+                self.stdout.write((u'%-18s %5d POSTs em %6.2f s  p50 %7.1f ms  p95 %7.1f ms  p99 %7.1f ms  %s\n' % (
+                    label, len(latencies), elapsed,
+                    percentile(latencies, 50) * 1e3, percentile(latencies, 95) * 1e3, percentile(latencies, 99) * 1e3,
+                    ', '.join('%d: %d' % item for item in sorted(statuses.items())))).encode('utf-8'))
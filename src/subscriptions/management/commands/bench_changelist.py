@@ -0,0 +1,68 @@
+# coding: utf-8
+import logging
+from optparse import make_option
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.test.client import Client
+
+from src.bench import insert_subscriptions, measure, test_database
+from src.subscriptions.admin import CURSOR_VAR, format_cursor
+from src.subscriptions.models import Subscription
+
+
+class Command(BaseCommand):
+    help = (u'Mede o tempo de carga do changelist de inscrições no admin com uma '
+            u'tabela grande, com e sem o modo high_volume.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=1000000,
+                    help=u'Quantidade de inscrições na tabela.'),
+        make_option('--repeat', type='int', default=5,
+                    help=u'Carregamentos medidos por cenário.'),
+    )
+
+    def handle(self, *args, **options):
+        # Sem a linha de log por requisição do TimingMiddleware no meio do relatório.
+        logging.getLogger('src.instrumentation').setLevel(logging.WARNING)
+        rows, repeat = options['rows'], options['repeat']
+        model_admin = admin.site._registry[Subscription]
+
+        with test_database():
+            insert_subscriptions(rows, paid=lambda i: i % 3 == 0)
+
+            User.objects.create_superuser('bench', 'bench@eventex.com.br', 'bench')
+            client = Client()
+            client.login(username='bench', password='bench')
+            url = reverse('admin:subscriptions_subscription_changelist')
+            deep = rows // model_admin.list_per_page // 2
+
+            def load(query):
+                def get(i):
+                    response = client.get(url + query)
+                    assert response.status_code == 200, response.status_code
+                return get
+
+            scenarios = [
+                (u'primeira página', '', ''),
+                (u'filtro paid', '?paid__exact=1', '?paid__exact=1'),
+                (u'página do meio', '?p=%d' % deep, None),
+            ]
+            self.stdout.write('%d inscrições, %d carregamentos por cenário\n' % (rows, repeat))
+            for label, before, after in scenarios:
+                model_admin.high_volume = False
+                elapsed_before = measure(load(before), repeat)
+                model_admin.high_volume = True
+                cache.clear()
+                if after is None:
+                    # No modo keyset a mesma página é alcançada pelo cursor.
+                    last = Subscription.objects.order_by(*model_admin.ordering)[deep * model_admin.list_per_page - 1]
+                    after = '?%s=%s' % (CURSOR_VAR, format_cursor(last))
+                # A primeira carga preenche o cache de contagens e datas.
+                cold = measure(load(after), 1)
+                warm = measure(load(after), repeat)
+                self.stdout.write((u'%-16s antes %9.1f ms  depois %9.1f ms (sem cache %9.1f ms)\n' % (
+                    label, elapsed_before * 1e3, warm * 1e3, cold * 1e3)).encode('utf-8'))
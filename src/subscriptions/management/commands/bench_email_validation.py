@@ -0,0 +1,51 @@
+# coding: utf-8
+from optparse import make_option
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+
+from src.bench import insert_subscriptions, measure, test_database
+from src.subscriptions.forms import EmailValidator
+from src.subscriptions.models import Subscription
+
+
+def count_validator(value):
+    # Validação anterior: COUNT(*) sobre a coluna email, sem índice.
+    return Subscription.objects.filter(email=value).count() > 0
+
+
+def exists_validator(value):
+    try:
+        EmailValidator(value)
+    except ValidationError:
+        return True
+    return False
+
+
+class Command(BaseCommand):
+    help = (u'Mede a latência da validação de e-mail duplicado com 10k, 100k e 1M '
+            u'inscrições, comparando o COUNT(*) antigo com a busca indexada.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', default='10000,100000,1000000',
+                    help=u'Tamanhos da tabela, separados por vírgula.'),
+        make_option('--probes', type='int', default=200,
+                    help=u'Quantidade de validações medidas por tamanho.'),
+    )
+
+    def handle(self, *args, **options):
+        sizes = [int(n) for n in options['sizes'].split(',')]
+        probes = options['probes']
+
+        with test_database():
+            total = 0
+            for size in sorted(sizes):
+                insert_subscriptions(size, start=total)
+                total = size
+
+                # Metade das sondagens encontra um e-mail, metade não.
+                value = lambda i: 'user%d@mail.com' % (i * size // probes if i % 2 else size + i)
+                before = measure(lambda i: count_validator(value(i)), probes)
+                after = measure(lambda i: exists_validator(value(i)), probes)
+                self.stdout.write('%8d inscrições: count %9.3f ms  exists %7.3f ms\n' % (
+                    size, before * 1e3, after * 1e3))
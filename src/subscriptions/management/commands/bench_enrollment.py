@@ -0,0 +1,95 @@
+# coding: utf-8
+import threading
+import time
+from Queue import Empty, Queue
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from src.bench import insert_subscriptions, test_database
+from src.core.models import Course
+from src.subscriptions.models import AlreadyEnrolled, CourseFull, Enrollment, Subscription
+
+
+def naive_enroll(subscription, course):
+    # Contagem seguida de inserção, sem contador: o que o enroll evita.
+    with transaction.commit_on_success():
+        if Enrollment.objects.filter(course=course).count() >= course.slots:
+            raise CourseFull(course.pk)
+        if Enrollment.objects.filter(course=course, subscription=subscription).exists():
+            raise AlreadyEnrolled(subscription.pk, course.pk)
+        return Enrollment.objects.create(subscription=subscription, course=course)
+
+
+class Command(BaseCommand):
+    help = (u'Dispara matrículas simultâneas, de várias threads, num curso com poucas '
+            u'vagas e confere que nenhuma vaga foi vendida a mais. Roda no banco '
+            u'configurado (SQLite em arquivo ou PostgreSQL).')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', default=16),
+        make_option('--slots', type='int', default=40, help=u'Vagas do curso.'),
+        make_option('--attempts', type='int', default=400,
+                    help=u'Inscrições tentando a matrícula (10% repetem a tentativa).'),
+        make_option('--naive', action='store_true', default=False,
+                    help=u'Usa contagem seguida de inserção, para comparar.'),
+    )
+
+    def handle(self, *args, **options):
+        enroll = naive_enroll if options['naive'] else Enrollment.objects.enroll
+
+        with test_database(shared=True):
+            insert_subscriptions(options['attempts'])
+            course = Course.objects.create(title=u'Curso concorrido', start_time='09:00',
+                                           slots=options['slots'], notes='')
+            pks = list(Subscription.objects.values_list('pk', flat=True))
+            tasks = Queue()
+            for pk in pks + pks[::10]:
+                tasks.put(pk)
+
+            results = {'ok': 0, 'full': 0, 'duplicate': 0, 'error': 0}
+            lock = threading.Lock()
+
+            def worker():
+                try:
+                    while True:
+                        try:
+                            pk = tasks.get_nowait()
+                        except Empty:
+                            break
+                        try:
+                            enroll(Subscription(pk=pk), course)
+                            result = 'ok'
+                        except CourseFull:
+                            result = 'full'
+                        except AlreadyEnrolled:
+                            result = 'duplicate'
+                        except DatabaseError:
+                            # Ex.: "database is locked" no SQLite após o timeout.
+                            result = 'error'
+                        with lock:
+                            results[result] += 1
+                finally:
+                    connection.close()
+
+            threads = [threading.Thread(target=worker) for i in xrange(options['threads'])]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.time() - start
+
+            course = Course.objects.get(pk=course.pk)
+            enrolled = Enrollment.objects.filter(course=course).count()
+
+        total = sum(results.values())
+        self.stdout.write('%s, %d threads: %d tentativas em %.2f s (%.0f/s)\n' % (
+            connection.vendor, options['threads'], total, elapsed, total / elapsed))
+        self.stdout.write('matriculadas %(ok)d, curso cheio %(full)d, repetidas %(duplicate)d, '
+                          'erros %(error)d\n' % results)
+        self.stdout.write('vagas %d, matrículas %d, contador %d\n' % (course.slots, enrolled, course.seats_taken))
+        if enrolled > course.slots or (not options['naive'] and enrolled != course.seats_taken):
+            raise CommandError('Vagas vendidas a mais: %d matriculas para %d vagas (contador %d).' % (
+                enrolled, course.slots, course.seats_taken))
@@ -0,0 +1,57 @@
+# coding: utf-8
+import operator
+from optparse import make_option
+
+from django.contrib import admin
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from src.bench import insert_subscriptions, measure, test_database
+from src.subscriptions.admin import SubscriptionAdmin
+from src.subscriptions.models import Subscription
+from src.subscriptions.search import search
+
+
+def like_search(queryset, query):
+    # Busca padrão do admin: icontains em cada search_field, para cada palavra.
+    for bit in query.split():
+        lookups = [Q(**{'%s__icontains' % f: bit}) for f in SubscriptionAdmin.search_fields]
+        queryset = queryset.filter(reduce(operator.or_, lookups))
+    return queryset
+
+
+class Command(BaseCommand):
+    help = (u'Compara a busca de inscrições do admin (LIKE sobre cada coluna) com a '
+            u'busca pelas colunas normalizadas e indexadas.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=1000000,
+                    help=u'Quantidade de inscrições na tabela.'),
+        make_option('--repeat', type='int', default=5,
+                    help=u'Buscas medidas por formato de termo.'),
+    )
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        n = rows // 2
+
+        with test_database():
+            insert_subscriptions(rows)
+
+            queries = [
+                ('CPF', '%011d' % n),
+                ('e-mail', 'user%d@' % n),
+                ('telefone', '%02d 9%08d' % (11 + n % 89, n)),
+                ('nome', 'Inscrito %d' % n),
+                (u'domínio', '@mail.com'),
+            ]
+            self.stdout.write('%d inscrições, %d buscas por formato\n' % (rows, repeat))
+            for label, query in queries:
+                # Só a primeira página, como no changelist.
+                def run(func):
+                    return lambda i: list(func(Subscription.objects.all(), query)[:100])
+                found = len(list(search(Subscription.objects.all(), query)[:100]))
+                before = measure(run(like_search), repeat)
+                after = measure(run(search), repeat)
+                self.stdout.write((u'%-9s %-22r LIKE %9.2f ms  índice %7.2f ms  (%d encontrada(s))\n' % (
+                    label, query, before * 1e3, after * 1e3, found)).encode('utf-8'))
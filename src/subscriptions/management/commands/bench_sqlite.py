@@ -0,0 +1,98 @@
+# coding: utf-8
+import logging
+import threading
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from src.bench import populate_event, test_database
+from src.instrumentation import percentile
+
+
+# Como o SQLite vem sem o modo de produção.
+DEFAULT_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+
+class Command(BaseCommand):
+    help = (u'Leitores (agenda) e escritores (POST de inscrição) simultâneos num SQLite em '
+            u'arquivo, com os pragmas padrão e com os de SQLITE_PRAGMAS. Mostra vazão, '
+            u'p99 e erros de cada lado.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--readers', type='int', default=8),
+        make_option('--writers', type='int', default=4),
+        make_option('--seconds', type='float', default=3.0, help=u'Duração de cada rodada.'),
+    )
+
+    def run(self, readers, writers, seconds, counter):
+        read_url, write_url = reverse('subscriptions:success', args=[1]), reverse('subscriptions:subscribe')
+        results = {'read': [], 'write': [], 'errors': 0}
+        lock = threading.Lock()
+        stop = time.time() + seconds
+
+        def worker(kind):
+            client = Client()
+            try:
+                while time.time() < stop:
+                    if kind == 'write':
+                        with lock:
+                            k = counter.next()
+                        data = {'name': 'Carga %d' % k, 'cpf': '7%010d' % k, 'email': 'carga%d@mail.com' % k,
+                                'phone_0': '21', 'phone_1': '99998888'}
+                    start = time.time()
+                    try:
+                        if kind == 'write':
+                            ok = client.post(write_url, data).status_code == 302
+                        else:
+                            ok = client.get(read_url).status_code == 200
+                    except Exception:
+                        ok = False
+                    finally:
+                        # O que o request_finished faz fora do cliente de teste.
+                        connection.close()
+                    elapsed = time.time() - start
+                    with lock:
+                        if ok:
+                            results[kind].append(elapsed)
+                        else:
+                            results['errors'] += 1
+            finally:
+                connection.close()
+
+        threads = ([threading.Thread(target=worker, args=('read',)) for i in xrange(readers)] +
+                   [threading.Thread(target=worker, args=('write',)) for i in xrange(writers)])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def handle(self, *args, **options):
+        logging.getLogger('src.instrumentation').setLevel(logging.WARNING)
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        if connection.vendor != 'sqlite':
+            raise CommandError('O banco configurado não é SQLite.')
+
+        counter = iter(xrange(10 ** 9))
+        rounds = [(u'padrão', dict(SQLITE_PRAGMAS=DEFAULT_PRAGMAS, DATABASE_WRITE_RETRIES=0)),
+                  (u'produção', {})]
+        self.stdout.write('%-10s %9s %9s %9s %9s %6s\n' % ('pragmas', 'leituras/s', 'p99 ms', 'escritas/s',
+                                                           'p99 ms', 'erros'))
+        for label, overrides in rounds:
+            # Sem cache de páginas nem controle de admissão: só o banco.
+            with override_settings(PAGE_CACHE_SECONDS=0, ADMISSION_RATE=None, ADMISSION_MAX_CONCURRENT=None,
+                                   **overrides):
+                with test_database(shared=True):
+                    populate_event(20, 60, 2, 3, 1000)
+                    connection.close()
+                    results = self.run(options['readers'], options['writers'], options['seconds'], counter)
+            seconds = options['seconds']
+            self.stdout.write((u'%-10s %9.1f %9.1f %9.1f %9.1f %6d\n' % (
+                label, len(results['read']) / seconds, percentile(sorted(results['read']), 99) * 1e3,
+                len(results['write']) / seconds, percentile(sorted(results['write']), 99) * 1e3,
+                results['errors'])).encode('utf-8'))
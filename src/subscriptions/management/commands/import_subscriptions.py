@@ -0,0 +1,42 @@
+# coding: utf-8
+import csv
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from src.subscriptions.importer import FIELDS, SubscriptionImporter, read_csv, read_jsonl
+
+
+class Command(BaseCommand):
+    args = '<arquivo.csv|arquivo.jsonl>'
+    help = (u'Importa inscrições de um arquivo CSV (com cabeçalho) ou JSONL com os campos '
+            u'name, cpf, email e phone. As linhas recusadas vão para um arquivo à parte.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=('csv', 'jsonl'),
+                    help=u'Formato do arquivo. Por padrão é deduzido da extensão.'),
+        make_option('--rejects',
+                    help=u'Arquivo CSV com as linhas recusadas. Padrão: <arquivo>.rejeitados.csv'),
+        make_option('--chunk-size', type='int', default=500,
+                    help=u'Linhas validadas e inseridas por transação.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError(u'Informe o arquivo a importar.')
+        path = args[0]
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        reader = read_jsonl if fmt == 'jsonl' else read_csv
+
+        with open(path, 'rb') as source, open(options['rejects'] or path + '.rejeitados.csv', 'wb') as rejects:
+            writer = csv.writer(rejects)
+            writer.writerow(FIELDS + ('errors',))
+
+            def reject(row, errors):
+                values = [unicode(row.get(f) or u'') for f in FIELDS] + [u'; '.join(errors)]
+                writer.writerow([v.encode('utf-8') for v in values])
+
+            importer = SubscriptionImporter(reject, chunk_size=options['chunk_size'])
+            imported, rejected = importer.run(reader(source))
+
+        self.stdout.write('%d inscrição(ões) importada(s), %d recusada(s)\n' % (imported, rejected))
@@ -0,0 +1,39 @@
+# coding: utf-8
+import csv
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from src.subscriptions.importer import read_csv
+from src.subscriptions.reconciliation import AMBIGUOUS, MATCHED, UNMATCHED, PaymentReconciler
+
+
+class Command(BaseCommand):
+    args = '<extrato.csv>'
+    help = (u'Marca como pagas as inscrições encontradas num extrato de pagamentos '
+            u'(CSV com as colunas cpf e/ou email). As linhas não conciliadas vão para um relatório.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--report',
+                    help=u'Arquivo CSV com as linhas não conciliadas. Padrão: <extrato>.conciliacao.csv'),
+        make_option('--chunk-size', type='int', default=500,
+                    help=u'Inscrições marcadas como pagas por UPDATE.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError(u'Informe o extrato de pagamentos.')
+        path = args[0]
+
+        with open(path, 'rb') as source, open(options['report'] or path + '.conciliacao.csv', 'wb') as report:
+            writer = csv.writer(report)
+            writer.writerow(['status', 'cpf', 'email'])
+
+            def write(row, status):
+                writer.writerow([status] + [(row.get(f) or u'').encode('utf-8') for f in ('cpf', 'email')])
+
+            reconciler = PaymentReconciler(chunk_size=options['chunk_size'])
+            counts = reconciler.run(read_csv(source), write)
+
+        self.stdout.write('%d conciliada(s) (%d marcada(s) como paga(s)), %d sem inscrição, %d ambígua(s)\n' % (
+            counts[MATCHED], reconciler.updated, counts[UNMATCHED], counts[AMBIGUOUS]))
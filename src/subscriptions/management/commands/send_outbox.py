@@ -0,0 +1,89 @@
+# coding: utf-8
+import time
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+
+from src.subscriptions.models import OutboundEmail
+
+
+class Command(BaseCommand):
+    help = (u'Envia os e-mails pendentes da caixa de saída em lotes, '
+            u'reaproveitando uma única conexão SMTP por lote.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=100,
+                    help=u'Quantidade de e-mails enviados por conexão.'),
+        make_option('--max-attempts', type='int', default=5,
+                    help=u'Tentativas antes de desistir de um e-mail.'),
+        make_option('--backoff', type='int', default=60,
+                    help=u'Espera base, em segundos, antes de uma nova tentativa (dobra a cada falha).'),
+        make_option('--max-backoff', type='int', default=3600,
+                    help=u'Espera máxima, em segundos, entre tentativas.'),
+        make_option('--claim-timeout', type='int', default=600,
+                    help=u'Segundos que um e-mail fica reservado para este envio antes de voltar à fila.'),
+        make_option('--loop', action='store_true', default=False,
+                    help=u'Continua rodando, verificando a caixa de saída periodicamente.'),
+        make_option('--interval', type='float', default=5,
+                    help=u'Intervalo, em segundos, entre verificações no modo --loop.'),
+    )
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.max_attempts = options['max_attempts']
+        self.lease = timedelta(seconds=options['claim_timeout'])
+        base, cap = options['backoff'], options['max_backoff']
+        self.backoff = lambda attempts: timedelta(seconds=min(base * 2 ** (attempts - 1), cap))
+
+        while True:
+            sent, failed = self.drain()
+            if sent or failed:
+                self.stdout.write('%d enviado(s), %d falha(s)\n' % (sent, failed))
+            if not options['loop']:
+                break
+            if not (sent or failed):
+                time.sleep(options['interval'])
+
+    def drain(self):
+        sent = failed = 0
+        while True:
+            batch = list(OutboundEmail.objects.due(self.max_attempts)[:self.batch_size])
+            if not batch:
+                break
+            # Outro send_outbox rodando ao mesmo tempo pode ter lido o mesmo
+            # lote: só envia o que conseguir reservar.
+            batch = [email for email in batch if OutboundEmail.objects.claim(email, self.lease)]
+            if not batch:
+                continue
+            s, f = self.send_batch(batch)
+            sent += s
+            failed += f
+        return sent, failed
+
+    def send_batch(self, batch):
+        sent = failed = 0
+        connection = get_connection()
+        try:
+            connection.open()
+            for email in batch:
+                message = EmailMessage(subject=email.subject, body=email.message,
+                                       from_email=email.from_email, to=[email.recipient],
+                                       connection=connection)
+                try:
+                    message.send()
+                except Exception, e:
+                    email.mark_failed(repr(e), self.backoff)
+                    failed += 1
+                else:
+                    email.mark_sent()
+                    sent += 1
+        except Exception, e:
+            # Falha ao abrir a conexão: o lote inteiro volta para a fila.
+            for email in batch[sent + failed:]:
+                email.mark_failed(repr(e), self.backoff)
+                failed += 1
+        finally:
+            connection.close()
+        return sent, failed
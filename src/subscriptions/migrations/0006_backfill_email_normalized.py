@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Preenche email_normalized das inscricoes existentes, em blocos."
+        # Em Python, como o normalize_email do modelo: o LOWER do SQL so
+        # converte ASCII e deixaria valores que a busca nunca encontra.
+        Subscription = orm['subscriptions.Subscription']
+        last_pk = 0
+        while True:
+            chunk = list(Subscription.objects.filter(pk__gt=last_pk).order_by('pk')
+                         .values_list('pk', 'email')[:1000])
+            if not chunk:
+                break
+            for pk, email in chunk:
+                Subscription.objects.filter(pk=pk).update(email_normalized=(email or u'').strip().lower())
+            last_pk = chunk[-1][0]
+
+    def backwards(self, orm):
+        "Nada a desfazer: a coluna e removida pela migracao anterior."
+
+    models = {
+        'subscriptions.outboundemail': {
+            'Meta': {'object_name': 'OutboundEmail'},
+            'attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'from_email': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'message': ('django.db.models.fields.TextField', [], {}),
+            'next_attempt_at': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'recipient': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'sent_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'subscriptions.subscription': {
+            'Meta': {'object_name': 'Subscription'},
+            'cpf': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '11'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'email_normalized': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '75', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'paid': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'phone': ('django.db.models.fields.CharField', [], {'max_length': '20', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['subscriptions']
+    symmetrical = True
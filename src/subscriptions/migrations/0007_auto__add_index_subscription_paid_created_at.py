@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding index on 'Subscription', fields ['paid']
+        db.create_index('subscriptions_subscription', ['paid'])
+
+        # Adding index on 'Subscription', fields ['created_at', 'id'], used by
+        # the admin changelist ordering and keyset pagination
+        db.create_index('subscriptions_subscription', ['created_at', 'id'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'Subscription', fields ['created_at', 'id']
+        db.delete_index('subscriptions_subscription', ['created_at', 'id'])
+
+        # Removing index on 'Subscription', fields ['paid']
+        db.delete_index('subscriptions_subscription', ['paid'])
+
+
+    models = {
+        'subscriptions.outboundemail': {
+            'Meta': {'object_name': 'OutboundEmail'},
+            'attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'from_email': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'message': ('django.db.models.fields.TextField', [], {}),
+            'next_attempt_at': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'recipient': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'sent_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'subscriptions.subscription': {
+            'Meta': {'object_name': 'Subscription'},
+            'cpf': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '11'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'email_normalized': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '75', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'paid': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'phone': ('django.db.models.fields.CharField', [], {'max_length': '20', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['subscriptions']
\ No newline at end of file
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'Subscription.name_normalized'
+        db.add_column('subscriptions_subscription', 'name_normalized',
+                      self.gf('django.db.models.fields.CharField')(db_index=True, default='', max_length=100, blank=True),
+                      keep_default=False)
+
+        # Adding field 'Subscription.phone_digits'
+        db.add_column('subscriptions_subscription', 'phone_digits',
+                      self.gf('django.db.models.fields.CharField')(db_index=True, default='', max_length=20, blank=True),
+                      keep_default=False)
+
+        if db.backend_name == 'sqlite3':
+            # No SQLite o South recria a tabela para adicionar colunas e perde
+            # os indices nao unicos criados nas migracoes anteriores.
+            db.create_index('subscriptions_subscription', ['email_normalized'])
+            db.create_index('subscriptions_subscription', ['paid'])
+            db.create_index('subscriptions_subscription', ['created_at', 'id'])
+
+
+    def backwards(self, orm):
+        # Deleting field 'Subscription.name_normalized'
+        db.delete_column('subscriptions_subscription', 'name_normalized')
+
+        # Deleting field 'Subscription.phone_digits'
+        db.delete_column('subscriptions_subscription', 'phone_digits')
+
+
+    models = {
+        'subscriptions.outboundemail': {
+            'Meta': {'object_name': 'OutboundEmail'},
+            'attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'from_email': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'message': ('django.db.models.fields.TextField', [], {}),
+            'next_attempt_at': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'recipient': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'sent_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'subscriptions.subscription': {
+            'Meta': {'object_name': 'Subscription'},
+            'cpf': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '11'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'email_normalized': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '75', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name_normalized': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '100', 'blank': 'True'}),
+            'paid': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'phone': ('django.db.models.fields.CharField', [], {'max_length': '20', 'blank': 'True'}),
+            'phone_digits': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '20', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['subscriptions']
\ No newline at end of file
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import datetime
+import re
+import unicodedata
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+# Copias congeladas de normalize_text e only_digits de models.py: a
+# migracao nao pode mudar quando o modelo mudar.
+NON_DIGITS = re.compile(r'\D')
+
+
+def normalize_text(value):
+    value = unicodedata.normalize('NFKD', unicode(value or ''))
+    value = u''.join(c for c in value if not unicodedata.combining(c))
+    return u' '.join(value.lower().split())
+
+
+def only_digits(value):
+    return NON_DIGITS.sub('', value or '')
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Preenche name_normalized e phone_digits das inscricoes existentes, em blocos."
+        Subscription = orm['subscriptions.Subscription']
+        last_pk = 0
+        while True:
+            chunk = list(Subscription.objects.filter(pk__gt=last_pk).order_by('pk')
+                         .values_list('pk', 'name', 'phone')[:1000])
+            if not chunk:
+                break
+            for pk, name, phone in chunk:
+                Subscription.objects.filter(pk=pk).update(name_normalized=normalize_text(name),
+                                                          phone_digits=only_digits(phone))
+            last_pk = chunk[-1][0]
+
+    def backwards(self, orm):
+        "Nada a desfazer: as colunas sao removidas pela migracao anterior."
+
+    models = {
+        'subscriptions.outboundemail': {
+            'Meta': {'object_name': 'OutboundEmail'},
+            'attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'from_email': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'message': ('django.db.models.fields.TextField', [], {}),
+            'next_attempt_at': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'recipient': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'sent_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'subscriptions.subscription': {
+            'Meta': {'object_name': 'Subscription'},
+            'cpf': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '11'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'email_normalized': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '75', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name_normalized': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '100', 'blank': 'True'}),
+            'paid': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'phone': ('django.db.models.fields.CharField', [], {'max_length': '20', 'blank': 'True'}),
+            'phone_digits': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '20', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['subscriptions']
+    symmetrical = True
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import datetime
+import re
+import unicodedata
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+# Copias congeladas de search_tokens e normalize_text de models.py: a
+# migracao nao pode mudar quando o modelo mudar.
+EMAIL_SEPARATORS = re.compile(r'[._+\-]+')
+
+
+def normalize_text(value):
+    value = unicodedata.normalize('NFKD', unicode(value or ''))
+    value = u''.join(c for c in value if not unicodedata.combining(c))
+    return u' '.join(value.lower().split())
+
+
+def search_tokens(name, email):
+    tokens = set(normalize_text(name).split())
+    email = (email or '').strip().lower()
+    if '@' in email:
+        local, domain = email.rsplit('@', 1)
+        tokens.update([local, domain])
+        tokens.update(EMAIL_SEPARATORS.split(local))
+    tokens.discard(u'')
+    return set(token[:100] for token in tokens)
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Grava os tokens de busca das inscricoes existentes, em blocos."
+        Subscription = orm['subscriptions.Subscription']
+        SearchToken = orm['subscriptions.SearchToken']
+        last_pk = 0
+        while True:
+            chunk = list(Subscription.objects.filter(pk__gt=last_pk).order_by('pk')
+                         .values_list('pk', 'name', 'email')[:1000])
+            if not chunk:
+                break
+            tokens = [SearchToken(subscription_id=pk, token=token)
+                      for pk, name, email in chunk for token in search_tokens(name, email)]
+            for i in range(0, len(tokens), 300):
+                SearchToken.objects.bulk_create(tokens[i:i + 300])
+            last_pk = chunk[-1][0]
+
+    def backwards(self, orm):
+        "Nada a desfazer: a tabela e removida pela migracao anterior."
+
+    models = {
+        'core.course': {
+            'Meta': {'object_name': 'Course', '_ormbases': ['core.Talk']},
+            'notes': ('django.db.models.fields.TextField', [], {}),
+            'seats_taken': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'slots': ('django.db.models.fields.IntegerField', [], {}),
+            'talk_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['core.Talk']", 'unique': 'True', 'primary_key': 'True'})
+        },
+        'core.speaker': {
+            'Meta': {'object_name': 'Speaker'},
+            'avatar': ('django.db.models.fields.files.FileField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '50'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'url': ('django.db.models.fields.URLField', [], {'max_length': '200'})
+        },
+        'core.talk': {
+            'Meta': {'object_name': 'Talk'},
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'speakers': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['core.Speaker']", 'symmetrical': 'False'}),
+            'start_time': ('django.db.models.fields.TimeField', [], {'db_index': 'True', 'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '50'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'})
+        },
+        'subscriptions.enrollment': {
+            'Meta': {'unique_together': "(('subscription', 'course'),)", 'object_name': 'Enrollment'},
+            'course': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'enrollments'", 'to': "orm['core.Course']"}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'subscription': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'enrollments'", 'to': "orm['subscriptions.Subscription']"})
+        },
+        'subscriptions.outboundemail': {
+            'Meta': {'object_name': 'OutboundEmail'},
+            'attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'from_email': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'message': ('django.db.models.fields.TextField', [], {}),
+            'next_attempt_at': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'recipient': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'sent_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'subscriptions.searchtoken': {
+            'Meta': {'object_name': 'SearchToken'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'subscription': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'search_tokens'", 'to': "orm['subscriptions.Subscription']"}),
+            'token': ('django.db.models.fields.CharField', [], {'max_length': '100', 'db_index': 'True'})
+        },
+        'subscriptions.subscription': {
+            'Meta': {'object_name': 'Subscription'},
+            'cpf': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '11'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'email_normalized': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '75', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name_normalized': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '100', 'blank': 'True'}),
+            'paid': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'phone': ('django.db.models.fields.CharField', [], {'max_length': '20', 'blank': 'True'}),
+            'phone_digits': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '20', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['subscriptions']
+    symmetrical = True
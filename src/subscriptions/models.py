@@ -1,17 +1,251 @@
 # coding: utf-8
-from django.db import models
+import re
+import unicodedata
+
+from django.db import IntegrityError, connections, models, router, transaction
+from django.utils import timezone
+
+from src.core.models import Course
 
 # Create your models here.
 
+NON_DIGITS = re.compile(r'\D')
+EMAIL_SEPARATORS = re.compile(r'[._+\-]+')
+
+
+def normalize_email(value):
+    return (value or '').strip().lower()
+
+
+def normalize_text(value):
+    """Minúsculas, sem acentos e com espaços simples: 'José  da Silva' -> 'jose da silva'."""
+    value = unicodedata.normalize('NFKD', unicode(value or ''))
+    value = u''.join(c for c in value if not unicodedata.combining(c))
+    return u' '.join(value.lower().split())
+
+
+def only_digits(value):
+    return NON_DIGITS.sub('', value or '')
+
+
+def search_tokens(name, email):
+    """
+    Palavras do nome e partes do e-mail, normalizadas: 'José Silva' e
+    'jose.silva@gmail.com' -> jose, silva, jose.silva e gmail.com.
+    """
+    tokens = set(normalize_text(name).split())
+    email = normalize_email(email)
+    if '@' in email:
+        local, domain = email.rsplit('@', 1)
+        tokens.update([local, domain])
+        tokens.update(EMAIL_SEPARATORS.split(local))
+    tokens.discard(u'')
+    return set(token[:SearchToken.MAX_LENGTH] for token in tokens)
+
+
 class Subscription(models.Model):
     name = models.CharField('Nome', max_length=100)
     cpf = models.CharField('CPF', max_length=11, unique=True)
     email = models.EmailField('E-mail', blank=True)
     phone = models.CharField('Telefone', max_length=20, blank=True)
     created_at = models.DateTimeField('Criado em', auto_now_add=True)
-    paid = models.BooleanField()
+    paid = models.BooleanField(db_index=True)
+    # Colunas normalizadas e indexadas para validação e busca (ver search.py).
+    email_normalized = models.CharField(max_length=75, blank=True, db_index=True, editable=False)
+    name_normalized = models.CharField(max_length=100, blank=True, db_index=True, editable=False)
+    phone_digits = models.CharField(max_length=20, blank=True, db_index=True, editable=False)
 
     def __unicode__(self):
         return self.cpf
 
+    def normalize(self):
+        self.email_normalized = normalize_email(self.email)
+        self.name_normalized = normalize_text(self.name)
+        self.phone_digits = only_digits(self.phone)
+
+    def save(self, *args, **kwargs):
+        self.normalize()
+        created = self.pk is None
+        super(Subscription, self).save(*args, **kwargs)
+        SearchToken.objects.index([(self.pk, self.name, self.email)], replace=not created)
+
+
+class SearchTokenManager(models.Manager):
+    def index(self, rows, replace=True, batch=300):
+        """
+        Grava os tokens de busca das inscrições dadas como (pk, name, email).
+        Com replace, apaga antes os tokens que elas já tinham.
+        """
+        rows = list(rows)
+        if replace:
+            self.filter(subscription__in=[pk for pk, name, email in rows]).delete()
+        tokens = [SearchToken(subscription_id=pk, token=token)
+                  for pk, name, email in rows for token in search_tokens(name, email)]
+        # O SQLite limita os parâmetros por consulta.
+        for i in range(0, len(tokens), batch):
+            self.bulk_create(tokens[i:i + batch])
+
+
+class SearchToken(models.Model):
+    """
+    Índice de palavras das inscrições, para buscar por sobrenome ou por
+    domínio do e-mail com prefixo no índice (ver search.py).
+    """
+    MAX_LENGTH = 100
+
+    subscription = models.ForeignKey(Subscription, related_name='search_tokens')
+    token = models.CharField(max_length=MAX_LENGTH, db_index=True)
+
+    objects = SearchTokenManager()
+
+    def __unicode__(self):
+        return self.token
+
+
+
+
+class OutboundEmailManager(models.Manager):
+    def enqueue(self, subject, message, from_email, recipient):
+        return self.create(subject=subject, message=message,
+                           from_email=from_email, recipient=recipient)
+
+    def due(self, max_attempts, now=None):
+        now = now or timezone.now()
+        qs = self.filter(sent_at__isnull=True, attempts__lt=max_attempts,
+                         next_attempt_at__lte=now)
+        return qs.order_by('next_attempt_at', 'pk')
+
+    def claim(self, email, lease, now=None):
+        """
+        Reserva o e-mail para quem vai enviá-lo, adiando a próxima tentativa
+        por lease. O UPDATE só afeta a linha se ela ainda estiver pendente e
+        vencida: de dois envios simultâneos, só um consegue a reserva. Se o
+        processo morrer no meio, o e-mail volta para a fila depois do lease.
+        """
+        now = now or timezone.now()
+        claimed = self.filter(pk=email.pk, sent_at__isnull=True,
+                              next_attempt_at__lte=now).update(next_attempt_at=now + lease)
+        return claimed == 1
+
+
+class OutboundEmail(models.Model):
+    """
+    Caixa de saída persistida. A view grava aqui na mesma transação da
+    Inscrição e o comando send_outbox faz o envio via SMTP em segundo plano.
+    """
+    subject = models.CharField('Assunto', max_length=255)
+    message = models.TextField('Mensagem')
+    from_email = models.CharField('Remetente', max_length=255)
+    recipient = models.CharField(u'Destinatário', max_length=255)
+    created_at = models.DateTimeField('Criado em', auto_now_add=True)
+    next_attempt_at = models.DateTimeField(u'Próxima tentativa', default=timezone.now, db_index=True)
+    sent_at = models.DateTimeField('Enviado em', null=True, blank=True)
+    attempts = models.PositiveIntegerField('Tentativas', default=0)
+    last_error = models.TextField(u'Último erro', blank=True)
+
+    objects = OutboundEmailManager()
+
+    def __unicode__(self):
+        return self.recipient
+
+    def mark_sent(self):
+        self.sent_at = timezone.now()
+        self.last_error = ''
+        self.save()
+
+    def mark_failed(self, error, backoff):
+        self.attempts += 1
+        self.last_error = error
+        self.next_attempt_at = timezone.now() + backoff(self.attempts)
+        self.save()
+
+
+class CourseFull(Exception):
+    pass
+
+
+class AlreadyEnrolled(Exception):
+    pass
+
+
+class EnrollmentManager(models.Manager):
+    @property
+    def db(self):
+        # Tudo aqui escreve: nunca numa réplica (ver src.routers).
+        return self._db or router.db_for_write(self.model)
+
+    def execute(self, sql, params):
+        cursor = connections[self.db].cursor()
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+    def update_seats(self, course, sql):
+        # SQL direto: o update() do ORM num modelo herdado (Course) vira
+        # "WHERE pk IN (SELECT ... WHERE seats_taken < slots)", e o
+        # PostgreSQL não reavalia a subconsulta depois de esperar pelo
+        # lock da linha, o que permitiria vender vagas a mais.
+        qn = connections[self.db].ops.quote_name
+        table = Course._meta.db_table
+        return self.execute(sql % {'table': qn(table), 'pk': qn(Course._meta.pk.column),
+                                   'taken': qn('seats_taken'), 'slots': qn('slots')}, [course.pk])
+
+    def enroll(self, subscription, course):
+        """
+        Reserva uma vaga e matricula a inscrição no curso, numa transação.
+
+        A vaga é tomada por um UPDATE condicional (seats_taken < slots), que
+        o banco executa de forma atômica: não há contagem seguida de
+        inserção, e no PostgreSQL a linha do curso fica travada só até o
+        commit. Se a inscrição já estava matriculada, o índice único desfaz
+        a reserva junto com a transação.
+        """
+        try:
+            with transaction.commit_on_success(using=self.db):
+                taken = self.update_seats(course, 'UPDATE %(table)s SET %(taken)s = %(taken)s + 1 '
+                                                  'WHERE %(pk)s = %%s AND %(taken)s < %(slots)s')
+                if not taken:
+                    raise CourseFull(course.pk)
+                return self.create(subscription=subscription, course=course)
+        except IntegrityError:
+            raise AlreadyEnrolled(subscription.pk, course.pk)
+
+    def cancel(self, subscription, course):
+        """Desfaz a matrícula e devolve a vaga. Retorna False se não havia matrícula."""
+        qn = connections[self.db].ops.quote_name
+        with transaction.commit_on_success(using=self.db):
+            # O DELETE informa quantas linhas apagou: dois cancelamentos
+            # simultâneos não devolvem a vaga duas vezes.
+            deleted = self.execute('DELETE FROM %s WHERE %s = %%s AND %s = %%s' % (
+                qn(self.model._meta.db_table), qn('subscription_id'), qn('course_id')),
+                [subscription.pk, course.pk])
+            if not deleted:
+                return False
+            self.update_seats(course, 'UPDATE %(table)s SET %(taken)s = %(taken)s - 1 '
+                                      'WHERE %(pk)s = %%s AND %(taken)s > 0')
+        return True
+
+
+class Enrollment(models.Model):
+    subscription = models.ForeignKey(Subscription, verbose_name=u'Inscrição', related_name='enrollments')
+    course = models.ForeignKey(Course, verbose_name='Curso', related_name='enrollments')
+    created_at = models.DateTimeField('Criado em', auto_now_add=True)
+
+    objects = EnrollmentManager()
+
+    class Meta:
+        unique_together = ('subscription', 'course')
+        verbose_name = u'Matrícula'
+
+    def __unicode__(self):
+        return u'%s - %s' % (self.subscription, self.course)
+
+
+################################
+##         Admissão
+################################
+
+# Os limites de admissão precisam de um cache compartilhado fora do DEBUG
+# (ver src.subscriptions.admission).
+from .admission import check_admission_cache
 
+check_admission_cache()
@@ -0,0 +1,73 @@
+# coding: utf-8
+from .models import Subscription, normalize_email, only_digits
+
+
+MATCHED, UNMATCHED, AMBIGUOUS = 'matched', 'unmatched', 'ambiguous'
+
+
+def normalize_cpf(value):
+    # Extratos costumam trazer o CPF formatado (123.456.789-00) ou sem os
+    # zeros à esquerda, quando passam por uma planilha.
+    digits = only_digits(value)
+    return digits.zfill(11) if digits else ''
+
+
+class PaymentReconciler(object):
+    """
+    Concilia um extrato de pagamentos com as inscrições.
+
+    As inscrições são indexadas em memória numa única consulta (CPF -> pk e
+    e-mail normalizado -> pks). Cada linha do extrato é casada pelo CPF ou,
+    na falta dele, pelo e-mail; as inscrições encontradas são marcadas como
+    pagas com UPDATEs em blocos de chunk_size.
+    """
+    def __init__(self, chunk_size=500):
+        self.chunk_size = chunk_size
+        self.counts = {MATCHED: 0, UNMATCHED: 0, AMBIGUOUS: 0}
+        self.updated = 0
+
+    def build_index(self):
+        self.by_cpf, self.by_email = {}, {}
+        for pk, cpf, email in Subscription.objects.values_list('pk', 'cpf', 'email_normalized').iterator():
+            self.by_cpf[cpf] = pk
+            if email:
+                self.by_email.setdefault(email, set()).add(pk)
+
+    def match(self, row):
+        """Retorna (situação, pk) para uma linha do extrato."""
+        cpf_pk = self.by_cpf.get(normalize_cpf(row.get('cpf')))
+        email_pks = self.by_email.get(normalize_email(row.get('email')), ())
+
+        if cpf_pk is not None:
+            if email_pks and cpf_pk not in email_pks:
+                return AMBIGUOUS, None
+            return MATCHED, cpf_pk
+        if len(email_pks) == 1:
+            return MATCHED, iter(email_pks).next()
+        if email_pks:
+            return AMBIGUOUS, None
+        return UNMATCHED, None
+
+    def run(self, rows, report=None):
+        """
+        Processa as linhas do extrato e retorna a contagem por situação.
+        report(row, situação), se informado, recebe cada linha não casada.
+        """
+        self.build_index()
+        pending = set()
+        for row in rows:
+            status, pk = self.match(row)
+            self.counts[status] += 1
+            if status == MATCHED:
+                pending.add(pk)
+                if len(pending) == self.chunk_size:
+                    self.mark_as_paid(pending)
+                    pending = set()
+            elif report is not None:
+                report(row, status)
+        if pending:
+            self.mark_as_paid(pending)
+        return self.counts
+
+    def mark_as_paid(self, pks):
+        self.updated += Subscription.objects.filter(pk__in=pks, paid=False).update(paid=True)
@@ -0,0 +1,92 @@
+# coding: utf-8
+"""
+Busca de inscrições pelas colunas normalizadas e indexadas.
+
+A consulta é despachada pelo formato do termo, sempre com igualdade ou
+intervalo de prefixo (col >= termo AND col < termo + U+FFFF), que usam o
+índice em qualquer banco, ao contrário do LIKE '%...%' do admin:
+
+- contém '@': prefixo do e-mail normalizado, ou, começando por '@', do
+  domínio;
+- só dígitos e pontuação de CPF/telefone: CPF exato (11 dígitos) ou
+  prefixo do CPF, e prefixo do telefone só com dígitos;
+- qualquer outro texto: cada palavra é prefixo de uma palavra do nome ou de
+  uma parte do e-mail (SearchToken), o que acha sobrenomes e domínios.
+
+Palavras comuns ('maria', 'gmail.com') casam com boa parte da tabela, e o
+IN (tokens) teria de ler todas as ocorrências antes de paginar. Por isso as
+ocorrências de cada palavra são contadas pelo índice, até SELECTIVITY_PROBE:
+a consulta parte da palavra mais rara, e as demais são conferidas só nas
+inscrições encontradas, no nome ou no e-mail normalizado. Se até a mais
+rara for comum, a busca volta ao LIKE nessas colunas, que acha uma página
+de resultados logo no começo da varredura.
+"""
+import re
+
+from django.db.models import Q
+
+from .models import SearchToken, normalize_email, normalize_text, only_digits
+
+
+NUMERIC = re.compile(r'^[\d\s().\-/+]+$')
+SELECTIVITY_PROBE = 1000
+
+
+def prefix(field, value):
+    return Q(**{'%s__gte' % field: value, '%s__lt' % field: value + u'\uffff'})
+
+
+def matching_tokens(value):
+    return SearchToken.objects.filter(prefix('token', value[:SearchToken.MAX_LENGTH]))
+
+
+def token_prefix(value):
+    return Q(pk__in=matching_tokens(value).values('subscription'))
+
+
+def contains(word):
+    return Q(name_normalized__contains=word) | Q(email_normalized__contains=word)
+
+
+def words_filter(words, common=contains):
+    # len() da fatia lê só os ids, pelo índice; o count() do Django 1.4
+    # numa fatia de values() perde o LIMIT e conta todas as ocorrências.
+    hits = dict((word, len(matching_tokens(word).values_list('pk', flat=True)[:SELECTIVITY_PROBE]))
+                for word in words)
+    rarest = min(words, key=hits.get)
+    q = token_prefix(rarest) if hits[rarest] < SELECTIVITY_PROBE else common(rarest)
+    for word in words:
+        if word != rarest:
+            q &= contains(word)
+    return q
+
+
+def search_filter(query):
+    """Retorna o Q para o termo de busca, ou None se o termo for vazio."""
+    query = query.strip()
+    if not query:
+        return None
+
+    if query.startswith('@'):
+        domain = normalize_email(query[1:])
+        if not domain:
+            return None
+        return words_filter([domain], lambda domain: Q(email_normalized__contains='@' + domain))
+    if '@' in query:
+        return prefix('email_normalized', normalize_email(query))
+
+    if NUMERIC.match(query):
+        digits = only_digits(query)
+        if not digits:
+            return None
+        cpf = Q(cpf=digits) if len(digits) == 11 else prefix('cpf', digits)
+        return cpf | prefix('phone_digits', digits)
+
+    return words_filter(normalize_text(query).split())
+
+
+def search(queryset, query):
+    q = search_filter(query)
+    if q is None:
+        return queryset
+    return queryset.filter(q)
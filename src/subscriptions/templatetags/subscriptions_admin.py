@@ -0,0 +1,29 @@
+# coding: utf-8
+from hashlib import md5
+
+from django import template
+from django.contrib.admin.templatetags import admin_list
+from django.core.cache import cache
+from django.utils.encoding import force_unicode
+
+register = template.Library()
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def cached_date_hierarchy(cl):
+    """
+    date_hierarchy do admin com o resultado em cache no modo high_volume.
+    O DISTINCT sobre as datas percorre a tabela inteira a cada página.
+    """
+    if not getattr(cl.model_admin, 'high_volume', False):
+        return admin_list.date_hierarchy(cl)
+
+    key = 'subscriptions:date_hierarchy:%s' % md5(
+        (unicode(cl.query_set.query) + cl.get_query_string()).encode('utf-8')).hexdigest()
+    context = cache.get(key)
+    if context is None:
+        context = admin_list.date_hierarchy(cl)
+        if context and 'back' in context:
+            context['back']['title'] = force_unicode(context['back']['title'])
+        cache.set(key, context, cl.model_admin.count_cache_timeout)
+    return context
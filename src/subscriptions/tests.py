@@ -1,13 +1,25 @@
 # coding: utf-8
+from StringIO import StringIO
 from django.contrib.auth.models import User
+from datetime import timedelta
 from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
-from django.test.testcases import TestCase
-from mock import Mock
-from .models import Subscription
+from django.test.testcases import TestCase, TransactionTestCase
+from mock import Mock, patch
+from .models import AlreadyEnrolled, CourseFull, Enrollment, OutboundEmail, Subscription
+from src.core.models import Course
+from .search import search
+from .admission import (acquire_slot, check_admission_cache, client_id, get_admission_cache,
+                        release_slot, take_token)
+from .reconciliation import AMBIGUOUS, MATCHED, UNMATCHED, PaymentReconciler
 from django.db import IntegrityError
 from .forms import SubscriptionForm
+from .importer import SubscriptionImporter, read_csv, read_jsonl
 from .admin import SubscriptionAdmin, Subscription, admin
+from django.test.utils import override_settings
+from django.utils import timezone
 from django.utils.translation import ungettext, ugettext as _
 
 '''
@@ -76,6 +88,7 @@ Testa o Post'do formulário
 '''
 class SubscribeViewPostTest(TestCase):
     def setUp(self):
+        get_admission_cache().clear()
         data = dict(name = 'Joe Doe', cpf = '12345678900', email = 'joe@doe.com',
             phone = '99-9999-9999')
         self.resp = self.client.post(reverse('subscriptions:subscribe'), data)
@@ -89,15 +102,75 @@ class SubscribeViewPostTest(TestCase):
         "Post deve salvar a Inscrição no banco."
         self.assertTrue(Subscription.objects.exists())
 
+    def test_email_queued(self):
+        "Post deve colocar a notificacao do visitante na caixa de saida."
+        self.assertEquals(1, OutboundEmail.objects.filter(recipient='joe@doe.com').count())
+
+    def test_email_not_sent_inline(self):
+        "Post nao deve esperar pelo envio SMTP."
+        self.assertEquals(0, len(mail.outbox))
+
     def test_email_sent(self):
-        "Post deve notificar o visitante por email."
+        "O comando send_outbox deve notificar o visitante por email."
+        call_command('send_outbox', stdout=StringIO())
         self.assertEquals(1, len(mail.outbox))
+        self.assertEquals(['joe@doe.com'], mail.outbox[0].to)
+
+'''
+Testa o envio da caixa de saida
+'''
+class SendOutboxCommandTest(TestCase):
+    def setUp(self):
+        for i in range(3):
+            OutboundEmail.objects.enqueue(subject='Assunto', message='Mensagem',
+                                          from_email='contato@eventex.com.br',
+                                          recipient='joe%d@doe.com' % i)
+
+    def test_send(self):
+        "Todos os emails pendentes devem ser enviados e marcados."
+        call_command('send_outbox', stdout=StringIO(), batch_size=2)
+        self.assertEqual(3, len(mail.outbox))
+        self.assertFalse(OutboundEmail.objects.filter(sent_at__isnull=True).exists())
+
+    def test_send_once(self):
+        "Emails ja enviados nao devem ser reenviados."
+        call_command('send_outbox', stdout=StringIO())
+        call_command('send_outbox', stdout=StringIO())
+        self.assertEqual(3, len(mail.outbox))
+
+    def test_claimed_not_sent(self):
+        "Emails reservados por outro envio em andamento nao devem ser enviados de novo."
+        email = OutboundEmail.objects.all()[0]
+        self.assertTrue(OutboundEmail.objects.claim(email, timedelta(minutes=10)))
+        self.assertFalse(OutboundEmail.objects.claim(email, timedelta(minutes=10)))
+        call_command('send_outbox', stdout=StringIO())
+        self.assertEqual(2, len(mail.outbox))
+        self.assertNotIn(email.recipient, [m.to[0] for m in mail.outbox])
+
+    def test_retry_with_backoff(self):
+        "Falhas devem ser registradas e reagendadas para depois."
+        with patch('django.core.mail.message.EmailMessage.send', Mock(side_effect=IOError('smtp'))):
+            call_command('send_outbox', stdout=StringIO())
+        email = OutboundEmail.objects.all()[0]
+        self.assertEqual(1, email.attempts)
+        self.assertIn('smtp', email.last_error)
+        self.assertIsNone(email.sent_at)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertFalse(OutboundEmail.objects.due(max_attempts=5).exists())
+
+    def test_give_up(self):
+        "Emails que esgotaram as tentativas nao devem ser reenviados."
+        OutboundEmail.objects.update(attempts=5)
+        call_command('send_outbox', stdout=StringIO(), max_attempts=5)
+        self.assertEqual(0, len(mail.outbox))
+
 
 '''
 Testa os casos de posts invalidos
 '''
 class SubscribeViewInvalidPostTest(TestCase):
     def setUp(self):
+        get_admission_cache().clear()
         data = dict(name = 'Joe Doe', cpf = '123456789001', email = 'joe@doe.com',
             phone = '99-9999-9999')
         self.resp = self.client.post(reverse('subscriptions:subscribe'), data)
@@ -185,6 +258,35 @@ class ExportSubscriptionViewTest(TestCase):
         u'Header indicado ao browser que a resposta é um arquivo a ser salvo'
         self.assertTrue('attachment;' in self.resp['Content-Disposition'])
 
+'''
+Testa o conteudo gerado pela exportacao em blocos
+'''
+class ExportSubscriptionContentTest(TestCase):
+    def setUp(self):
+        Subscription.objects.create(name='Joe Doe', cpf='12345678900', email='joe@doe.com', phone='12-34567890')
+        Subscription.objects.create(name=u'João, Filho', cpf='12345678901', email='joao@doe.com', phone='')
+        Subscription.objects.create(name='Jane Doe', cpf='12345678902', email='', phone='98-76543210')
+        self.modeladmin = SubscriptionAdmin(Subscription, admin.site)
+        self.modeladmin.export_chunk_size = 2
+
+    def test_rows(self):
+        u'Todas as inscrições devem ser exportadas, mesmo ultrapassando o tamanho do bloco.'
+        content = ''.join(self.modeladmin.iter_export_rows())
+        self.assertEqual('Joe Doe,joe@doe.com,12-34567890\r\n'
+                         '"Jo\xc3\xa3o, Filho",joao@doe.com,\r\n'
+                         'Jane Doe,,98-76543210\r\n', content)
+
+    def test_lazy(self):
+        u'Nenhuma consulta deve ser feita antes de consumir o conteúdo.'
+        with self.assertNumQueries(0):
+            self.modeladmin.iter_export_rows()
+
+    def test_queries(self):
+        u'Cada bloco deve custar uma consulta, mais a consulta final vazia.'
+        with self.assertNumQueries(3):
+            list(self.modeladmin.iter_export_rows())
+
+
 '''
 Testa o se esta bloqueando usuario nao logado
 '''
@@ -227,3 +329,570 @@ class SubscriptionFormTest(TestCase):
         form = self.make_and_validate_form(cpf='1234567890')
         self.assertDictEqual(form.errors, {'cpf': [_(u'O CPF deve ter 11 dígitos')]})
 
+    def test_email_unique(self):
+        u'Email já cadastrado, mesmo com maiúsculas, deve ser recusado.'
+        Subscription.objects.create(name='Joe Doe', cpf='12345678900', email='Joe@Mail.com')
+        form = self.make_and_validate_form(email='joe@mail.COM')
+        self.assertEqual([_(u'Email já cadastrado.')], form.errors['email'])
+
+    def test_email_normalized(self):
+        u'O email normalizado deve ser mantido ao salvar.'
+        s = Subscription.objects.create(name='Joe Doe', cpf='12345678900', email=' Joe@Mail.com')
+        self.assertEqual('joe@mail.com', s.email_normalized)
+        s.email = 'Other@Mail.com'
+        s.save()
+        self.assertEqual('other@mail.com', Subscription.objects.get(pk=s.pk).email_normalized)
+
+
+
+'''
+Testa a importacao de inscricoes em lote
+'''
+class ImportSubscriptionsTest(TestCase):
+    def setUp(self):
+        Subscription.objects.create(name='Joe Doe', cpf='12345678900', email='joe@doe.com')
+        self.rejects = []
+        self.importer = SubscriptionImporter(lambda row, errors: self.rejects.append((row.get('cpf'), errors)),
+                                             chunk_size=2)
+
+    def import_csv(self, content):
+        return self.importer.run(read_csv(StringIO(content)))
+
+    def test_import(self):
+        u'Linhas validas devem ser inseridas em lote.'
+        result = self.import_csv('name,cpf,email,phone\r\n'
+                                 'Ana,11111111111,Ana@Mail.com,\r\n'
+                                 'Bia,22222222222,,21-99998888\r\n'
+                                 'Caio,33333333333,caio@mail.com,21-99997777\r\n')
+        self.assertEqual((3, 0), result)
+        self.assertEqual('ana@mail.com', Subscription.objects.get(cpf='11111111111').email_normalized)
+        self.assertEqual('21-99998888', Subscription.objects.get(cpf='22222222222').phone)
+
+    def test_rejects_invalid(self):
+        u'Linhas invalidas devem ser recusadas com as mensagens do formulario.'
+        result = self.import_csv('name,cpf,email,phone\r\n'
+                                 'Ana,1111,ana@mail.com,\r\n'
+                                 'Bia,22222222222,,\r\n'
+                                 'Caio,33333333333,caio@mail.com,9-1\r\n')
+        self.assertEqual((0, 3), result)
+        self.assertEqual([_(u'O CPF deve ter 11 dígitos')], self.rejects[0][1])
+        self.assertEqual([_(u'Informe seu e-mail ou telefone.')], self.rejects[1][1])
+
+    def test_rejects_duplicates(self):
+        u'CPF e email ja cadastrados ou repetidos no arquivo devem ser recusados.'
+        result = self.import_csv('name,cpf,email,phone\r\n'
+                                 'Joe,12345678900,other@mail.com,\r\n'
+                                 'Jon,44444444444,JOE@doe.com,\r\n'
+                                 'Ana,11111111111,ana@mail.com,\r\n'
+                                 'Ana,11111111111,ana2@mail.com,\r\n')
+        self.assertEqual((1, 3), result)
+        self.assertEqual(['12345678900', '44444444444', '11111111111'], [cpf for cpf, e in self.rejects])
+
+    def test_jsonl(self):
+        result = self.importer.run(read_jsonl(StringIO(
+            '{"name": "Ana", "cpf": "11111111111", "email": "ana@mail.com"}\n\n'
+            '{"name": "Bia", "cpf": "22222222222", "phone": "21-99998888"}\n')))
+        self.assertEqual((2, 0), result)
+
+    def test_jsonl_non_string_values(self):
+        u'Valores numericos devem ser aceitos e valores de outros tipos recusados so naquela linha.'
+        result = self.importer.run(read_jsonl(StringIO(
+            '{"name": "Ana", "cpf": 11111111111, "email": "ana@mail.com"}\n'
+            '{"name": "Bia", "cpf": "22222222222", "phone": ["21", "99998888"]}\n'
+            '{"name": "Caio", "cpf": 33333333333, "email": "caio@mail.com"}\n')))
+        self.assertEqual((2, 1), result)
+        self.assertEqual('11111111111', Subscription.objects.get(name='Ana').cpf)
+        self.assertEqual([_(u'Valor inválido para phone.')], self.rejects[0][1])
+
+    def test_jsonl_malformed_lines(self):
+        u'Linhas que nao sao um objeto JSON devem ser recusadas com o numero da linha, sem perder as demais.'
+        result = self.importer.run(read_jsonl(StringIO(
+            '{"name": "Ana", "cpf": "11111111111", "email": "ana@mail.com"}\n'
+            '{"name": "Bia", "cpf": \n'
+            '[1, 2]\n'
+            '"x"\n'
+            '{"name": "Caio", "cpf": "33333333333", "email": "caio@mail.com"}\n')))
+        self.assertEqual((2, 3), result)
+        self.assertEqual([[_(u'Linha 2: JSON inválido.')], [_(u'Linha 3: esperado um objeto JSON.')],
+                          [_(u'Linha 4: esperado um objeto JSON.')]], [e for cpf, e in self.rejects])
+
+    def test_command_malformed_jsonl(self):
+        u'O comando deve importar as linhas validas e gravar a linha quebrada nos rejeitados.'
+        import os
+        import tempfile
+        from django.core.management import call_command
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(fd, 'wb') as f:
+            f.write('{"name": "Ana", "cpf": "11111111111", "email": "ana@mail.com"}\n'
+                    '{"name": "Bia", "cpf": "22222222222", "email": "bia@mail.com"}\n'
+                    '{quebrada\n'
+                    '{"name": "Caio", "cpf": "33333333333", "email": "caio@mail.com"}\n')
+        out = StringIO()
+        try:
+            call_command('import_subscriptions', path, stdout=out)
+            with open(path + '.rejeitados.csv', 'rb') as f:
+                rejects = f.read()
+        finally:
+            os.remove(path)
+            os.remove(path + '.rejeitados.csv')
+        self.assertEqual(u'3 inscrição(ões) importada(s), 1 recusada(s)\n', out.getvalue().decode('utf-8'))
+        self.assertIn(_(u'Linha 3: JSON inválido.').encode('utf-8'), rejects)
+
+    def test_queries(self):
+        u'Cada bloco deve custar duas consultas de duplicidade, um INSERT e a gravação dos tokens de busca.'
+        content = 'name,cpf,email,phone\r\n' + ''.join(
+            'Nome,%011d,user%d@mail.com,\r\n' % (i, i) for i in range(4))
+        with self.assertNumQueries(10):
+            self.import_csv(content)
+
+
+'''
+Testa a conciliacao de pagamentos
+'''
+class PaymentReconcilerTest(TestCase):
+    def setUp(self):
+        self.joe = Subscription.objects.create(name='Joe', cpf='01234567890', email='joe@doe.com')
+        Subscription.objects.create(name='Ana', cpf='11111111111', email='ana@doe.com')
+        Subscription.objects.create(name='Ana 2', cpf='22222222222', email='ana@doe.com')
+        self.reconciler = PaymentReconciler(chunk_size=1)
+
+    def test_match_by_cpf(self):
+        u'CPF formatado ou sem zeros a esquerda deve ser encontrado.'
+        self.reconciler.build_index()
+        self.assertEqual((MATCHED, self.joe.pk), self.reconciler.match({'cpf': '123.456.789-0'}))
+
+    def test_run(self):
+        rows = [{'cpf': '012.345.678-90'}, {'email': 'JOE@doe.com'}, {'email': 'ana@doe.com'},
+                {'cpf': '99999999999'}, {'cpf': '11111111111', 'email': 'joe@doe.com'}]
+        report = []
+        counts = self.reconciler.run(rows, lambda row, status: report.append(status))
+        self.assertEqual({MATCHED: 2, UNMATCHED: 1, AMBIGUOUS: 2}, counts)
+        self.assertEqual([AMBIGUOUS, UNMATCHED, AMBIGUOUS], report)
+        self.assertEqual(1, self.reconciler.updated)
+        self.assertEqual(['01234567890'], list(Subscription.objects.filter(paid=True).values_list('cpf', flat=True)))
+
+    def test_queries(self):
+        u'Indice em uma consulta e UPDATEs em blocos.'
+        rows = [{'cpf': '01234567890'}, {'cpf': '11111111111'}, {'email': 'nobody@doe.com'}]
+        with self.assertNumQueries(3):
+            self.reconciler.run(rows)
+
+
+class ReconcilePaymentsViewTest(TestCase):
+    def setUp(self):
+        Subscription.objects.create(name='Joe', cpf='12345678900', email='joe@doe.com')
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        assert self.client.login(username='admin', password='admin')
+
+    def test_get(self):
+        resp = self.client.get(reverse('admin:reconcile_payments'))
+        self.assertContains(resp, 'type="file"')
+
+    def test_post(self):
+        extrato = StringIO('cpf,email\r\n12345678900,\r\n,nobody@doe.com\r\n')
+        extrato.name = 'extrato.csv'
+        resp = self.client.post(reverse('admin:reconcile_payments'), {'file': extrato})
+        self.assertContains(resp, '1 conciliada(s), 1 marcada(s) como paga(s).')
+        self.assertContains(resp, 'nobody@doe.com')
+        self.assertTrue(Subscription.objects.get(cpf='12345678900').paid)
+
+    def test_post_cp1252(self):
+        u'Extratos em cp1252 devem ser lidos, não resultar em erro 500.'
+        extrato = StringIO(u'nome,cpf\r\nJoão,12345678900\r\n'.encode('cp1252'))
+        extrato.name = 'extrato.csv'
+        resp = self.client.post(reverse('admin:reconcile_payments'), {'file': extrato})
+        self.assertContains(resp, '1 conciliada(s), 1 marcada(s) como paga(s).')
+
+
+'''
+Testa o changelist para grandes volumes
+'''
+class KeysetChangeListTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(5):
+            Subscription.objects.create(name='Inscrito %d' % i, cpf='%011d' % i, email='user%d@doe.com' % i)
+        # Mesmo created_at para todos: o desempate tem que ser pelo id.
+        Subscription.objects.filter(pk__lte=3).update(created_at=timezone.now() - timedelta(days=1))
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        assert self.client.login(username='admin', password='admin')
+        self.url = reverse('admin:subscriptions_subscription_changelist')
+        SubscriptionAdmin.list_per_page = 2
+
+    def tearDown(self):
+        SubscriptionAdmin.list_per_page = admin.ModelAdmin.list_per_page
+
+    def names(self, resp):
+        return [s.name for s in resp.context['cl'].result_list]
+
+    def test_pages(self):
+        u'As paginas devem seguir o cursor, sem repetir nem pular inscricoes.'
+        resp = self.client.get(self.url)
+        names = self.names(resp)
+        while resp.context['cl'].next_cursor:
+            resp = self.client.get(self.url + resp.context['cl'].next_page_url())
+            names += self.names(resp)
+        self.assertEqual(['Inscrito %d' % i for i in (4, 3, 2, 1, 0)], names)
+
+    def test_count_cached(self):
+        u'A contagem deve ser servida do cache nas proximas paginas.'
+        self.client.get(self.url)
+        Subscription.objects.create(name='Novo', cpf='99999999999', email='novo@doe.com')
+        resp = self.client.get(self.url)
+        self.assertEqual(5, resp.context['cl'].result_count)
+
+    def test_subscribed_today(self):
+        resp = self.client.get(self.url)
+        self.assertEqual([True, True], [s.is_today for s in resp.context['cl'].result_list])
+
+    def test_sorted_fallback(self):
+        u'Ordenando por outra coluna deve usar a paginacao padrao do admin.'
+        resp = self.client.get(self.url + '?o=1')
+        self.assertFalse(resp.context['cl'].keyset)
+        self.assertEqual(5, resp.context['cl'].result_count)
+
+
+'''
+Testa a busca pelas colunas normalizadas
+'''
+class SubscriptionSearchTest(TestCase):
+    def setUp(self):
+        Subscription.objects.create(name=u'José da Silva', cpf='12345678900', email='Jose@Doe.com', phone='21-99998888')
+        Subscription.objects.create(name=u'Maria Souza', cpf='98765432100', email='maria@doe.com', phone='11-12345678')
+
+    def names(self, query):
+        return sorted(s.name for s in search(Subscription.objects.all(), query))
+
+    def test_normalized_columns(self):
+        s = Subscription.objects.get(cpf='12345678900')
+        self.assertEqual((u'jose da silva', '2199998888'), (s.name_normalized, s.phone_digits))
+
+    def test_cpf(self):
+        self.assertEqual([u'José da Silva'], self.names('123.456.789-00'))
+        self.assertEqual([u'Maria Souza'], self.names('98765'))
+
+    def test_email_prefix(self):
+        self.assertEqual([u'José da Silva'], self.names('JOSE@'))
+        self.assertEqual([], self.names('doe.com@'))
+
+    def test_phone_prefix(self):
+        self.assertEqual([u'José da Silva'], self.names('(21) 9999'))
+
+    def test_name_prefix(self):
+        self.assertEqual([u'José da Silva'], self.names('jose da'))
+        self.assertEqual([u'Maria Souza'], self.names(u'MÁRIA'))
+
+    def test_word_prefix(self):
+        u'Sobrenomes e palavras do meio do nome devem ser encontrados.'
+        self.assertEqual([u'José da Silva'], self.names('Silva'))
+        self.assertEqual([u'José da Silva'], self.names('silv jos'))
+        self.assertEqual([], self.names('silva maria'))
+
+    def test_email_domain(self):
+        self.assertEqual([u'José da Silva', u'Maria Souza'], self.names('doe.com'))
+        self.assertEqual([u'José da Silva', u'Maria Souza'], self.names('@Doe'))
+        self.assertEqual([u'Maria Souza'], self.names('maria doe.com'))
+
+    def test_common_words(self):
+        u'Palavras comuns demais para o índice devem cair no LIKE das colunas normalizadas.'
+        with patch('src.subscriptions.search.SELECTIVITY_PROBE', 1):
+            self.assertEqual([u'José da Silva', u'Maria Souza'], self.names('doe.com'))
+            self.assertEqual([u'José da Silva', u'Maria Souza'], self.names('@Doe'))
+            self.assertEqual([u'José da Silva'], self.names('silva jose'))
+
+    def test_tokens_updated_on_save(self):
+        s = Subscription.objects.get(cpf='98765432100')
+        s.name, s.email = u'Maria Oliveira', 'maria@mail.com'
+        s.save()
+        self.assertEqual([u'Maria Oliveira'], self.names('oliveira'))
+        self.assertEqual([], self.names('souza'))
+        self.assertEqual([u'José da Silva'], self.names('doe.com'))
+
+    def test_imported_tokens(self):
+        SubscriptionImporter(lambda row, errors: None).run([
+            {'name': u'Ana Pereira', 'cpf': '11111111111', 'email': 'ana@gmail.com'}])
+        self.assertEqual([u'Ana Pereira'], self.names('pereira'))
+        self.assertEqual([u'Ana Pereira'], self.names('gmail.com'))
+
+    def test_empty(self):
+        self.assertEqual(2, len(self.names('  ')))
+
+    def test_admin_search(self):
+        u'O changelist do admin deve usar a busca indexada.'
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        assert self.client.login(username='admin', password='admin')
+        resp = self.client.get(reverse('admin:subscriptions_subscription_changelist') + '?q=maria@')
+        self.assertEqual([u'Maria Souza'], [s.name for s in resp.context['cl'].result_list])
+
+
+class EnrollmentTest(TransactionTestCase):
+    u'TransactionTestCase: o enroll depende do rollback da própria transação.'
+    def setUp(self):
+        self.course = Course.objects.create(title=u'Curso', start_time='09:00', slots=2, notes='')
+        self.subscriptions = [Subscription.objects.create(name='Inscrito %d' % i, cpf='%011d' % i)
+                              for i in range(3)]
+
+    def seats(self):
+        course = Course.objects.get(pk=self.course.pk)
+        return course.seats_taken, course.seats_left
+
+    def test_enroll(self):
+        Enrollment.objects.enroll(self.subscriptions[0], self.course)
+        self.assertEqual((1, 1), self.seats())
+
+    def test_full(self):
+        Enrollment.objects.enroll(self.subscriptions[0], self.course)
+        Enrollment.objects.enroll(self.subscriptions[1], self.course)
+        self.assertRaises(CourseFull, Enrollment.objects.enroll, self.subscriptions[2], self.course)
+        self.assertEqual((2, 0), self.seats())
+        self.assertEqual(2, Enrollment.objects.count())
+
+    def test_already_enrolled(self):
+        u'A matrícula repetida não deve consumir vaga.'
+        Enrollment.objects.enroll(self.subscriptions[0], self.course)
+        self.assertRaises(AlreadyEnrolled, Enrollment.objects.enroll, self.subscriptions[0], self.course)
+        self.assertEqual((1, 1), self.seats())
+
+    def test_cancel(self):
+        Enrollment.objects.enroll(self.subscriptions[0], self.course)
+        self.assertTrue(Enrollment.objects.cancel(self.subscriptions[0], self.course))
+        self.assertFalse(Enrollment.objects.cancel(self.subscriptions[0], self.course))
+        self.assertEqual((0, 2), self.seats())
+
+    def test_seats_left_without_count(self):
+        u'Vagas restantes vêm do contador, sem COUNT nas matrículas.'
+        Enrollment.objects.enroll(self.subscriptions[0], self.course)
+        with self.assertNumQueries(1):
+            self.assertEqual(1, Course.objects.get(pk=self.course.pk).seats_left)
+
+
+
+class AdmissionControlTest(TestCase):
+    def setUp(self):
+        self.cache = get_admission_cache()
+        self.cache.clear()
+        self.url = reverse('subscriptions:subscribe')
+
+    def post(self, i, **extra):
+        return self.client.post(self.url, dict(name='Joe Doe', cpf='%011d' % i, email='joe%d@doe.com' % i,
+                                               phone_0='21', phone_1='99998888'), **extra)
+
+    def test_token_bucket(self):
+        self.assertEqual(0, take_token(self.cache, 'a', 1.0, 2, now=100))
+        self.assertEqual(0, take_token(self.cache, 'a', 1.0, 2, now=100))
+        self.assertAlmostEqual(1.0, take_token(self.cache, 'a', 1.0, 2, now=100))
+        self.assertAlmostEqual(0.5, take_token(self.cache, 'a', 1.0, 2, now=100.5))
+        self.assertEqual(0, take_token(self.cache, 'a', 1.0, 2, now=101))
+        self.assertEqual(0, take_token(self.cache, 'b', 1.0, 2, now=101))
+
+    @override_settings(ADMISSION_BURST=2, ADMISSION_RATE=0.1)
+    def test_rate_limited(self):
+        self.assertEqual(302, self.post(1).status_code)
+        self.assertEqual(302, self.post(2).status_code)
+        with self.assertNumQueries(0):
+            resp = self.post(3)
+        self.assertEqual(429, resp.status_code)
+        self.assertEqual('10', resp['Retry-After'])
+        # Outro cliente tem o próprio balde.
+        self.assertEqual(302, self.post(4, REMOTE_ADDR='10.0.0.2').status_code)
+
+    def test_get_not_limited(self):
+        for i in range(10):
+            self.assertEqual(200, self.client.get(self.url).status_code)
+
+    @override_settings(ADMISSION_MAX_CONCURRENT=2)
+    def test_concurrency_cap(self):
+        self.assertTrue(acquire_slot(self.cache, 2))
+        self.assertTrue(acquire_slot(self.cache, 2))
+        with self.assertNumQueries(0):
+            resp = self.post(1)
+        self.assertEqual(503, resp.status_code)
+        self.assertEqual('1', resp['Retry-After'])
+
+    @override_settings(ADMISSION_BURST=2, ADMISSION_RATE=0.1)
+    def test_invalid_post_keeps_token(self):
+        u'Só a inscrição aceita gasta ficha: o formulário com erro pode ser reenviado.'
+        for i in range(3):
+            self.assertEqual(200, self.client.post(self.url, dict(name='Joe Doe')).status_code)
+        self.assertEqual(302, self.post(1).status_code)
+        self.assertEqual(302, self.post(2).status_code)
+        self.assertEqual(429, self.post(3).status_code)
+
+    @override_settings(ADMISSION_MAX_CONCURRENT=1)
+    def test_slot_released(self):
+        self.assertEqual(302, self.post(1).status_code)
+        self.assertEqual(302, self.post(2).status_code)
+
+    def test_slots_expire_independently(self):
+        u'Uma vaga presa por um worker que morreu expira sozinha, sem levar as outras.'
+        first = acquire_slot(self.cache, 2)
+        second = acquire_slot(self.cache, 2)
+        self.assertIsNone(acquire_slot(self.cache, 2))
+        self.cache.delete(first[0])
+        third = acquire_slot(self.cache, 2)
+        self.assertEqual(first[0], third[0])
+        # O dono antigo não libera a vaga que agora é de outro POST.
+        release_slot(self.cache, first)
+        self.assertEqual(third[1], self.cache.get(third[0]))
+        release_slot(self.cache, second)
+        self.assertIsNone(self.cache.get(second[0]))
+
+    def test_client_behind_proxy(self):
+        from django.test.client import RequestFactory
+        request = RequestFactory().post(self.url, REMOTE_ADDR='10.0.0.1',
+                                        HTTP_X_FORWARDED_FOR='1.1.1.1, 2.2.2.2, 10.0.0.2')
+        with self.settings(ADMISSION_TRUSTED_PROXIES=None):
+            self.assertEqual('10.0.0.1', client_id(request))
+        with self.settings(ADMISSION_TRUSTED_PROXIES=['10.0.0.1', '10.0.0.2']):
+            # 1.1.1.1 foi escrito pelo cliente e não vale.
+            self.assertEqual('2.2.2.2', client_id(request))
+
+    @override_settings(ADMISSION_REQUIRE_SHARED_CACHE=True, ADMISSION_TRUSTED_PROXIES=[])
+    def test_shared_cache_required(self):
+        from django.core.exceptions import ImproperlyConfigured
+        self.assertRaises(ImproperlyConfigured, check_admission_cache)
+        with self.settings(ADMISSION_RATE=None, ADMISSION_MAX_CONCURRENT=None):
+            check_admission_cache()
+
+    @override_settings(ADMISSION_REQUIRE_SHARED_CACHE=True, ADMISSION_CACHE='dummy', ADMISSION_TRUSTED_PROXIES=None,
+                       CACHES={'dummy': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_trusted_proxies_required(self):
+        from django.core.exceptions import ImproperlyConfigured
+        self.assertRaises(ImproperlyConfigured, check_admission_cache)
+        with self.settings(ADMISSION_TRUSTED_PROXIES=[]):
+            check_admission_cache()
+
+
+@override_settings(REPLICA_DATABASES=['replica'], REPLICA_APPS=('core', 'subscriptions'))
+class ReplicaRoutingTest(TransactionTestCase):
+    u'''
+    Um segundo arquivo SQLite faz o papel da réplica: é uma cópia do banco de
+    testes tirada no setUp, então o que for gravado depois só existe no
+    primário, como numa réplica atrasada. O iterdump faz commit, daí o
+    TransactionTestCase.
+    '''
+    def setUp(self):
+        import os
+        import sqlite3
+        import tempfile
+        from django.db import connections
+        get_admission_cache().clear()
+        self.old = Subscription.objects.create(name='Antigo', cpf='11111111111', email='antigo@mail.com',
+                                               phone='21-99998888')
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        default = connections['default']
+        default.cursor()
+        replica = sqlite3.connect(self.path)
+        replica.executescript('\n'.join(default.connection.iterdump()))
+        replica.close()
+        connections.databases['replica'] = dict(default.settings_dict, ENGINE='django.db.backends.sqlite3',
+                                                NAME=self.path, TEST_MIRROR=None)
+        self.new = Subscription.objects.create(name='Novo', cpf='22222222222', email='novo@mail.com',
+                                               phone='21-99998888')
+
+    def tearDown(self):
+        import os
+        from django.db import connections
+        connections['replica'].close()
+        del connections._connections.replica
+        del connections.databases['replica']
+        os.remove(self.path)
+
+    def test_get_reads_replica(self):
+        self.assertEqual(200, self.client.get(reverse('subscriptions:success', args=[self.old.pk])).status_code)
+        self.assertEqual(404, self.client.get(reverse('subscriptions:success', args=[self.new.pk])).status_code)
+
+    def test_core_reads_replica(self):
+        from src.core.models import Talk
+        talk = Talk.objects.create(title=u'Nova palestra', start_time='10:00')
+        self.assertEqual(404, self.client.get(reverse('core:talk_detail', args=[talk.pk])).status_code)
+
+    @override_settings(PAGE_CACHE_SECONDS=600)
+    def test_fresh_version_reads_primary(self):
+        u'Logo depois de uma alteração, o cache de páginas é preenchido pelo primário.'
+        from src.core.models import Talk
+        from src.core.pagecache import get_page_cache
+        get_page_cache().clear()
+        talk = Talk.objects.create(title=u'Nova palestra', start_time='10:00')
+        url = reverse('core:talk_detail', args=[talk.pk])
+        self.assertEqual(200, self.client.get(url).status_code)
+        with self.settings(REPLICA_PIN_SECONDS=0):
+            other = Talk.objects.create(title=u'Outra palestra', start_time='11:00')
+            self.assertEqual(404, self.client.get(reverse('core:talk_detail', args=[other.pk])).status_code)
+
+    def test_outside_requests_read_primary(self):
+        u'Comandos e código fora de requisições GET não leem das réplicas.'
+        self.assertEqual(2, Subscription.objects.count())
+
+    def test_read_your_writes(self):
+        u'Depois do POST, a página de sucesso lê a nova inscrição do primário.'
+        resp = self.client.post(reverse('subscriptions:subscribe'), {
+            'name': 'Joe Doe', 'cpf': '12345678900', 'email': 'joe@doe.com',
+            'phone_0': '21', 'phone_1': '99998888'})
+        self.assertIn('db_pin', resp.cookies)
+        self.assertEqual(200, self.client.get(resp['Location']).status_code)
+        del self.client.cookies['db_pin']
+        self.assertEqual(404, self.client.get(resp['Location']).status_code)
+
+    def test_export_reads_replica(self):
+        u'O export lê da réplica mesmo consumindo as linhas depois do middleware.'
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        content = self.client.get(reverse('admin:export_subscriptions')).content
+        self.assertIn('antigo@mail.com', content)
+        self.assertNotIn('novo@mail.com', content)
+
+    def test_export_releases_connection(self):
+        u'A conexão que o export reabre depois do request_finished é fechada ao terminar.'
+        from django.db import connections
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        resp = self.client.get(reverse('admin:export_subscriptions'))
+        # Como o WSGIHandler faz antes de percorrer o corpo.
+        connections['replica'].close()
+        self.assertIn('antigo@mail.com', resp.content)
+        self.assertIsNone(connections['replica'].connection)
+
+    def test_ical_releases_connection(self):
+        u'O mesmo vale para o iCalendar, lido da réplica enquanto a resposta é enviada.'
+        from django.db import connections
+        from src.core.models import Talk
+        Talk.objects.create(title=u'Nova palestra', start_time='10:00')
+        resp = self.client.get(reverse('core:ical'))
+        connections['replica'].close()
+        self.assertIn('END:VCALENDAR', resp.content)
+        self.assertNotIn('Nova palestra', resp.content)
+        self.assertIsNone(connections['replica'].connection)
+
+    def test_writes_go_to_primary(self):
+        course = Course.objects.create(title=u'Curso', start_time='09:00', slots=1, notes='')
+        Enrollment.objects.enroll(self.new, course)
+        self.assertEqual(1, Course.objects.get(pk=course.pk).seats_taken)
+
+
+class SubscribeRetryTest(TransactionTestCase):
+    def setUp(self):
+        get_admission_cache().clear()
+
+    def test_retried_on_lock(self):
+        u'Um "database is locked" no meio da transação a desfaz e a repete inteira.'
+        from django.db import DatabaseError
+        enqueue = OutboundEmail.objects.enqueue
+        calls = []
+
+        def locked_once(**kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise DatabaseError('database is locked')
+            return enqueue(**kwargs)
+
+        with patch.object(OutboundEmail.objects, 'enqueue', locked_once):
+            with self.settings(DATABASE_WRITE_BACKOFF=0):
+                resp = self.client.post(reverse('subscriptions:subscribe'), {
+                    'name': 'Joe Doe', 'cpf': '12345678900', 'email': 'joe@doe.com',
+                    'phone_0': '21', 'phone_1': '99998888'})
+        self.assertEqual(302, resp.status_code)
+        self.assertEqual(2, len(calls))
+        self.assertEqual(1, Subscription.objects.count())
+        self.assertEqual(1, OutboundEmail.objects.count())
@@ -1,16 +1,20 @@
 # coding: utf-8
 # Create your views here.
-from django.core.mail import send_mail
 from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.db import transaction
 
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.views.generic.simple import direct_to_template
 
+from src.sqlite import retry_on_lock
+
+from .admission import admission_control
 from .forms import SubscriptionForm
-from .models import Subscription
+from .models import OutboundEmail, Subscription
 
+@admission_control
 def subscribe(request):
     if request.method == 'POST':
         return subscribeDoPost(request)
@@ -22,13 +26,22 @@ def subscribeDoPost(request):
     if not form.is_valid():
         return openSubscription(request, form)
 
-    subscription = form.save()
-    send_mail(subject=u'Cadastro com Sucesso no EventeX',
-              message=u'Obrigado pela sua inscrição!',
-              from_email=settings.DEFAULT_FROM_EMAIL,
-              recipient_list=[subscription.email],
-    )
-
+    # O e-mail vai para a caixa de saída na mesma transação da inscrição;
+    # o envio SMTP fica a cargo do comando send_outbox.
+    def save():
+        # Numa nova tentativa a transação anterior foi desfeita: a inscrição
+        # volta a ser nova.
+        form.instance.pk = None
+        with transaction.commit_on_success():
+            subscription = form.save()
+            if subscription.email:
+                OutboundEmail.objects.enqueue(subject=u'Cadastro com Sucesso no EventeX',
+                                              message=u'Obrigado pela sua inscrição!',
+                                              from_email=settings.DEFAULT_FROM_EMAIL,
+                                              recipient=subscription.email)
+        return subscription
+
+    subscription = retry_on_lock(save)
     return HttpResponseRedirect(reverse('subscriptions:success', args=[subscription.pk]))
 
 
@@ -0,0 +1,21 @@
+# coding: utf-8
+"""
+Runner da suíte de testes: o do Django, com o log por requisição do
+TimingMiddleware (ver src.instrumentation) silenciado enquanto ela roda.
+"""
+import logging
+
+from django.test.simple import DjangoTestSuiteRunner
+
+
+class TestRunner(DjangoTestSuiteRunner):
+    logger = logging.getLogger('src.instrumentation')
+
+    def setup_test_environment(self, **kwargs):
+        super(TestRunner, self).setup_test_environment(**kwargs)
+        self.log_level = self.logger.level
+        self.logger.setLevel(logging.WARNING)
+
+    def teardown_test_environment(self, **kwargs):
+        self.logger.setLevel(self.log_level)
+        super(TestRunner, self).teardown_test_environment(**kwargs)
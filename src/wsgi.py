@@ -23,6 +23,10 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "src.settings")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# Serves the hashed files from STATIC_ROOT with far-future caching.
+from src.assets import AssetsApplication
+application = AssetsApplication(application)
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)